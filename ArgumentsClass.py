@@ -106,6 +106,130 @@ class CommonArguments():
 			action="store_true",
 			help="Use this parameter to add a timing for the scripts")
 
+	def recheck(self):
+		self.my_parser.add_argument(
+			"--recheck",
+			dest="Recheck",
+			action="store_true",
+			help="Try the roles and regions that recently failed for an account again, instead of skipping them, and list the Org's accounts afresh rather than using the cached list.")
+
+	def resume(self):
+		self.my_parser.add_argument(
+			"--resume",
+			dest="Resume",
+			action="store_true",
+			help="Pick up where the last (interrupted) run left off, rather than looking through every account and region again.")
+		self.my_parser.add_argument(
+			"--journal",
+			dest="Journal",
+			action="store_true",
+			help="Keep a journal of this run, so that if it's interrupted, --resume can pick up where it left off. Runs with --resume always keep one.")
+
+	def concurrency(self):
+		self.my_parser.add_argument(
+			"--workers",
+			dest="Workers",
+			type=int,
+			metavar="Number of account / region pairs",
+			default=None,  # Defaults to Inventory_Modules.SWEEP_WORKERS
+			help="The most account and region pairs to look at the same time.")
+		self.my_parser.add_argument(
+			"--credworkers",
+			dest="CredentialWorkers",
+			type=int,
+			metavar="Number of accounts",
+			default=None,  # Defaults to Inventory_Modules.CREDENTIAL_WORKERS
+			help="The most child accounts to get credentials for at the same time. This backs off on its own if STS throttles us.")
+		self.my_parser.add_argument(
+			"--tasktimeout",
+			dest="TaskTimeout",
+			type=int,
+			metavar="Seconds",
+			default=None,  # Defaults to Inventory_Modules.SWEEP_TIMEOUT
+			help="How long to wait on any one account and region, before giving up on it.")
+		self.my_parser.add_argument(
+			"--engine",
+			dest="Engine",
+			choices=['threads', 'asyncio'],
+			default='threads',
+			help="Whether to look through the accounts and regions with threads, or with asyncio (which needs the aiobotocore package).")
+		self.my_parser.add_argument(
+			"--ratelimit",
+			dest="RateLimits",
+			nargs="*",
+			metavar="service=calls per second",
+			default=None,  # Defaults to Inventory_Modules.RATE_LIMITS
+			help="Change how many calls per second we make to a service, in each account and region (like 'iam=2 ec2=100'). Use 0 for no limit.")
+		self.my_parser.add_argument(
+			"--retrymode",
+			dest="RetryMode",
+			choices=['legacy', 'standard', 'adaptive'],
+			default=None,  # Defaults to Inventory_Modules.CLIENT_RETRY_MODE
+			help="How botocore retries calls that fail or are throttled.")
+		self.my_parser.add_argument(
+			"--maxattempts",
+			dest="MaxAttempts",
+			type=int,
+			metavar="Attempts",
+			default=None,  # Defaults to Inventory_Modules.CLIENT_MAX_ATTEMPTS
+			help="How many times to try any one call (the first try included), before giving up on it.")
+		self.my_parser.add_argument(
+			"--connecttimeout",
+			dest="ConnectTimeout",
+			type=int,
+			metavar="Seconds",
+			default=None,  # Defaults to Inventory_Modules.CLIENT_CONNECT_TIMEOUT
+			help="How long to wait for a connection to AWS to be made.")
+		self.my_parser.add_argument(
+			"--readtimeout",
+			dest="ReadTimeout",
+			type=int,
+			metavar="Seconds",
+			default=None,  # Defaults to Inventory_Modules.CLIENT_READ_TIMEOUT
+			help="How long to wait for AWS to answer a call, once we're connected.")
+		self.my_parser.add_argument(
+			"--poolsize",
+			dest="PoolSize",
+			type=int,
+			metavar="Connections",
+			default=None,  # Defaults to matching the number of workers
+			help="How many connections each client keeps open. By default this grows to match the number of workers.")
+
+	def processes(self):
+		self.my_parser.add_argument(
+			"--processes",
+			dest="Processes",
+			type=int,
+			metavar="Number of worker processes",
+			default=None,
+			help="Spread the work across this many worker processes. By default everything happens in this one process.")
+		self.my_parser.add_argument(
+			"--shardby",
+			dest="ShardBy",
+			choices=['mgmt', 'account'],
+			default='mgmt',
+			help="With --processes, whether each worker takes whole management accounts (profiles), or a slice of all the accounts.")
+
+	def workqueue(self):
+		self.my_parser.add_argument(
+			"--queue",
+			dest="WorkQueue",
+			metavar="Path to the work queue file",
+			default=None,
+			help="Hand the account and region pairs out through a work queue (a SQLite file, somewhere every runner can reach), for workers to pick up.")
+		self.my_parser.add_argument(
+			"--queueworkers",
+			dest="QueueWorkers",
+			type=int,
+			metavar="Number of worker processes",
+			default=0,
+			help="With --queue, how many workers to start on this machine as well.")
+		self.my_parser.add_argument(
+			"--queueworker",
+			dest="QueueWorker",
+			action="store_true",
+			help="With --queue, be a worker - pick up tasks put there by this same script (run with the same parameters) until there's nothing left to do.")
+
 	def fragment(self):
 		self.my_parser.add_argument(
 			"-f", "--fragment",
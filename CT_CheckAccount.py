@@ -21,6 +21,7 @@ parser.verbosity()
 parser.singleprofile()
 parser.multiregion()
 parser.extendedargs()
+parser.recheck()  # Allows for retrying the roles and regions that recently failed
 parser.my_parser.add_argument(
 	"--explain",
 	dest="pExplain",
@@ -71,6 +72,7 @@ FixRun = args.FixRun
 pExplain = args.pExplain
 pVPCConfirm = args.Force
 logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)30s() ] %(message)s")
+Inventory_Modules.set_negative_cache_recheck(args.Recheck)
 # This is hard-coded, because this is the listing of regions that are supported by AWS Control Tower.
 if Quick:
 	RegionList = ['us-east-1']
@@ -253,6 +255,8 @@ def DoAccountSteps(fChildAccountId, aws_account, fFixRun, fRegionList):
 		  f" and trusts {Fore.GREEN}our role{Fore.RESET} within the Management Account")
 	print(f"{Fore.GREEN}** Step 0 completed without issues{Fore.RESET}")
 	print()
+	# Regions this account hasn't opted into (or that we recently found disabled) would only fail each of the steps below
+	fRegionList = Inventory_Modules.filter_disabled_regions(account_credentials, fRegionList)
 
 	"""
 	# Step 1 -- Obsoleted due to Control Tower no longer checking this --
@@ -272,15 +276,20 @@ def DoAccountSteps(fChildAccountId, aws_account, fFixRun, fRegionList):
 		ConfigList = []
 		DeliveryChanList = []
 		"""
-		TODO: Need to find a way to gracefully handle the error processing of opt-in regions.
-			Until then - we're using a hard-coded listing of regions, instead of dynamically finding those.
+		Opt-in regions the account hasn't enabled were already filtered out after Step 0. If a region still turns out to be
+		disabled, we remember that (so the next run skips it) and move on to the next region.
 		"""
-		# fRegionList.remove('me-south-1')	# Opt-in region, which causes a failure if we check and it's not opted-in
-		# fRegionList.remove('ap-east-1')	# Opt-in region, which causes a failure if we check and it's not opted-in
 		for region in fRegionList:
 			print(ERASE_LINE, f"Checking account {fChildAccountId} in region {region} for Config Recorder", end='\r')
 			logging.info("Looking for Config Recorders in account %s from Region %s", fChildAccountId, region)
-			ConfigRecorder = Inventory_Modules.find_config_recorders2(account_credentials, region)
+			try:
+				ConfigRecorder = Inventory_Modules.find_config_recorders2(account_credentials, region)
+			except ClientError as my_Error:
+				if not Inventory_Modules.is_disabled_region_error(my_Error, account_credentials, region):
+					raise
+				logging.warning(f"Region {region} isn't enabled for account {fChildAccountId}, so we're skipping it")
+				Inventory_Modules.record_disabled_region(fChildAccountId, region, my_Error.response['Error']['Code'])
+				continue
 			logging.debug("Tried to capture Config Recorder")
 			if len(ConfigRecorder['ConfigurationRecorders']) > 0:
 				ConfigList.append({
@@ -303,6 +312,9 @@ def DoAccountSteps(fChildAccountId, aws_account, fFixRun, fRegionList):
 		logging.warning("Failed to capture Config Recorder and Delivery Channels")
 		ProcessStatus[Step]['Success'] = False
 		print(my_Error)
+	finally:
+		# Whatever we learned above about which regions the account can use is written to disk in one go
+		Inventory_Modules.save_caches()
 
 	for _ in range(len(ConfigList)):
 		logging.warning(f"{Fore.RED}Found a config recorder for account %s in region %s", ConfigList[_]['AccountID'], ConfigList[_]['Region'] + Fore.RESET)
@@ -1,3 +1,9 @@
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
 def get_regions_old(fkey, fprofile="default"):
 	"""
 	This library is DEPRECATED.
@@ -41,23 +47,12 @@ def get_regions3(faws_acct, fregion_list=None):
 
 	Thr first parameter to this library must provide a valid account object that includes a boto3 session,
 	so that regions can be looked up.
+	The regions come from the account's cached region catalogue (see get_region_catalogue).
 	"""
-	import logging
-
-	region_info = faws_acct.session.client('ec2')
-	regions = region_info.describe_regions(Filters=[
-		{'Name': 'opt-in-status', 'Values': ['opt-in-not-required', 'opted-in']}])
-	RegionNames = [region_name['RegionName'] for region_name in regions['Regions']]
+	RegionNames = get_opted_in_regions(faws_acct)
 	if fregion_list is None or "all" in fregion_list or "ALL" in fregion_list or "All" in fregion_list:
 		return (RegionNames)
-	RegionNames2 = []
-	for x in fregion_list:
-		for y in RegionNames:
-			logging.info(f"Have {y} | Looking for {x}")
-			if y.find(x) >= 0:
-				logging.info(f"Found {y}")
-				RegionNames2.append(y)
-	return (RegionNames2)
+	return (_match_region_fragments(RegionNames, fregion_list))
 
 
 def get_ec2_regions(fprofile=None, fregion_list=None):
@@ -95,28 +90,20 @@ def get_ec2_regions(fprofile=None, fregion_list=None):
 
 
 def get_ec2_regions3(faws_acct, fkey=None):
+	"""
+	Returns the opted-in regions for the account that match the fragments in fkey, using the cached region catalogue.
+	"""
 	import logging
 
 	RegionNames = []
 	try:
-		region_info = faws_acct.session.client('ec2')
+		RegionNames = get_opted_in_regions(faws_acct)
 	except AttributeError as my_Error:
 		logging.error(my_Error)
 		return (RegionNames)
-	regions = region_info.describe_regions(Filters=[
-		{'Name': 'opt-in-status', 'Values': ['opt-in-not-required', 'opted-in']}])
-	for region in regions['Regions']:
-		RegionNames.append(region['RegionName'])
-	if "all" in fkey or "ALL" in fkey or 'All' in fkey or fkey is None:
+	if fkey is None or "all" in fkey or "ALL" in fkey or 'All' in fkey:
 		return (RegionNames)
-	RegionNames2 = []
-	for x in fkey:
-		for y in RegionNames:
-			logging.info(f"Have {y} | Looking for {x}")
-			if y.find(x) >= 0:
-				logging.info(f"Found {y}")
-				RegionNames2.append(y)
-	return (RegionNames2)
+	return (_match_region_fragments(RegionNames, fkey))
 
 
 def get_service_regions(service, fkey=None):
@@ -128,10 +115,9 @@ def get_service_regions(service, fkey=None):
 			If they send "us-" (for example), we would send back only those regions which matched that fragment.
 			This is good for focusing a search on only those regions you're searching within.
 	"""
-	import boto3
 	import logging
 
-	s = boto3.Session()
+	s = get_shared_session()
 	regions = s.get_available_regions(service, partition_name='aws', allow_non_regional=False)
 	if fkey is None or ('all' in fkey or 'All' in fkey or 'ALL' in fkey):
 		return (regions)
@@ -146,15 +132,15 @@ def get_service_regions(service, fkey=None):
 
 
 def validate_region3(faws_acct, fRegion=None):
+	"""
+	Checks that fRegion is a region this account can use, using the cached region catalogue.
+	"""
 	import logging
 
-	session_region = faws_acct.session
-	client_region = session_region.client('ec2')
 	if fRegion is None:
 		logging.info(f"No region supplied. Defaulting to 'us-east-1'")
 		fRegion = 'us-east-1'
-	region_info = client_region.describe_regions(Filters=[{'Name': 'region-name', 'Values': [fRegion]}])['Regions']
-	if len(region_info) == 0:
+	if fRegion not in get_opted_in_regions(faws_acct):
 		message = f"'{fRegion}' is not a valid region name for this account"
 		logging.error(message)
 		result = {'Success': False, 'Message': message}
@@ -335,20 +321,48 @@ def find_acct_email(fOrgRootProfile, fAccountId):
 	return (email_addr)
 
 
+_caller_identities = {'Identities': dict(), 'Locks': dict()}
+_caller_identity_lock = threading.Lock()
+
+
+def _get_caller_identity(fProfile=None):
+	"""
+	Returns the get_caller_identity response for the profile (or the default credentials, if fProfile is None).
+	A profile always leads to the same identity, so each one is only looked up once per process - and only one thread
+	makes the call, while any others asking for the same profile wait for its answer.
+	Failures aren't remembered, so the exception goes back to the caller, and the next caller tries again.
+	"""
+	with _caller_identity_lock:
+		profile_lock = _caller_identities['Locks'].setdefault(fProfile, threading.Lock())
+	with profile_lock:
+		if fProfile not in _caller_identities['Identities']:
+			client_sts = _get_profile_session(fProfile).client('sts')
+			response = client_sts.get_caller_identity()
+			_caller_identities['Identities'][fProfile] = {'Account': response['Account'],
+														  'Arn'    : response['Arn'],
+														  'UserId' : response['UserId']}
+		return (_caller_identities['Identities'][fProfile])
+
+
+def clear_caller_identity_cache():
+	"""
+	Forgets which account each profile belongs to. Useful if a profile's config has changed while the process is running.
+	"""
+	with _caller_identity_lock:
+		_caller_identities['Identities'].clear()
+
+
 def find_account_number(fProfile=None):
-	import boto3
+	"""
+	Returns the account number the profile leads to. The answer is remembered for the rest of the process.
+	"""
 	import logging
 	from botocore.exceptions import ClientError, CredentialRetrievalError, InvalidConfigError
 
 	response = '123456789012'  # This is the Failure response
 	try:
 		# logging.info("Looking for profile %s", fProfile)
-		if fProfile is None:
-			sts_session = boto3.Session()
-		else:
-			sts_session = boto3.Session(profile_name=fProfile)
-		client_sts = sts_session.client('sts')
-		response = client_sts.get_caller_identity()['Account']
+		response = _get_caller_identity(fProfile)['Account']
 	except ClientError as my_Error:
 		if str(my_Error).find("UnrecognizedClientException") > 0:
 			logging.error("%s: Security Issue", fProfile)
@@ -372,15 +386,15 @@ def find_account_number(fProfile=None):
 
 
 def find_calling_identity(fProfile):
-	import boto3
+	"""
+	Returns the Arn, AccountId and Short name of the identity behind the profile. Shares its memo with find_account_number.
+	"""
 	import logging
 	from botocore.exceptions import ClientError
 
 	try:
-		session_sts = boto3.Session(profile_name=fProfile)
 		logging.info("Getting creds used within profile %s", fProfile)
-		client_sts = session_sts.client('sts')
-		response = client_sts.get_caller_identity()
+		response = _get_caller_identity(fProfile)
 		creds = {'Arn'  : response['Arn'], 'AccountId': response['Account'],
 				 'Short': response['Arn'][response['Arn'].rfind(':') + 1:]}
 	except ClientError as my_Error:
@@ -607,14 +621,13 @@ def get_child_access(fRootProfile, fChildAccount, fRegion='us-east-1', fRoleList
 							'SessionToken': None,
 							'AccountNumber': None}
 	"""
-	import boto3
 	import logging
 	from botocore.exceptions import ClientError
 
 	if not isinstance(fChildAccount, str):  # Make sure the passed in account number is a string
 		fChildAccount = str(fChildAccount)
 	ParentAccountId = find_account_number(fRootProfile)
-	sts_session = boto3.Session(profile_name=fRootProfile)
+	sts_session = _get_profile_session(fRootProfile)
 	sts_client = sts_session.client('sts', region_name=fRegion)
 	if fChildAccount == ParentAccountId:
 		explain_string = ("We're trying to get access to either the Root Account (which we already have access "
@@ -659,12 +672,1175 @@ def get_child_access(fRootProfile, fChildAccount, fRegion='us-east-1', fRoleList
 	return (account_credentials, return_string)
 
 
-def get_child_access3(faws_acct, fChildAccount, fRegion='us-east-1', fRoleList=None):
+"""
+Local caches - kept in memory for the life of the process, and persisted between runs in the user's home directory
+"""
+
+CREDENTIAL_CACHE_MARGIN = 900  # Seconds before its 'Expiration' that we stop trusting a cached credential
+_cache_lock = threading.RLock()
+# 'Unsaved' holds the credentials put in the cache since it was last written to disk (see save_cached_credentials)
+_credential_cache = {'Loaded': False, 'Entries': dict(), 'Unsaved': dict()}
+_credential_cache_stats = {'Hits': 0, 'Misses': 0}
+
+
+def _cache_file_path(fCacheName):
+	"""
+	Returns the path of the named cache file.
+	The directory defaults to ~/.inventory_scripts/cache, but can be moved with the INVENTORY_SCRIPTS_CACHE_DIR env variable.
+	"""
+	import os
+
+	cache_dir = os.environ.get('INVENTORY_SCRIPTS_CACHE_DIR',
+							   os.path.join(os.path.expanduser('~'), '.inventory_scripts', 'cache'))
+	os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+	return (os.path.join(cache_dir, f"{fCacheName}.json"))
+
+
+@contextmanager
+def _locked_cache_file(fCacheName, fWrite=False):
+	"""
+	Opens the named cache file under a file lock, so that several scripts running at the same time don't clobber each other.
+	Yields the decoded dict. If fWrite is True, whatever is in the dict when the block exits is written back to disk.
+	The file is only readable by the current user, since some of these caches hold credentials.
+	"""
+	import os
+	import json
+	import logging
+	try:
+		import fcntl
+	except ImportError:  # Windows doesn't have fcntl, so we can only lock within this process
+		fcntl = None
+
+	cache_file = _cache_file_path(fCacheName)
+	with _cache_lock:
+		with open(f"{cache_file}.lock", 'a') as lock_file:
+			if fcntl is not None:
+				fcntl.flock(lock_file, fcntl.LOCK_EX if fWrite else fcntl.LOCK_SH)
+			try:
+				try:
+					with open(cache_file) as cache_contents:
+						cache_data = json.load(cache_contents)
+				except (FileNotFoundError, ValueError) as my_Error:
+					logging.debug(f"Starting with an empty {fCacheName} cache: {my_Error}")
+					cache_data = dict()
+				yield (cache_data)
+				if fWrite:
+					temp_file = f"{cache_file}.{os.getpid()}.tmp"
+					with open(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as temp_contents:
+						json.dump(cache_data, temp_contents, default=str)
+					os.replace(temp_file, cache_file)
+			finally:
+				if fcntl is not None:
+					fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _save_cache_changes(fCache, fCacheName):
+	"""
+	Writes the changes made to one of the in-memory caches since its last save (held in its 'Unsaved' dict, where None
+	means the entry was removed) to the named cache file, in one go. Anything else in the file is left as it is, so
+	changes saved in the meantime by another script aren't lost.
+	"""
+	with _cache_lock:
+		if len(fCache['Unsaved']) == 0:
+			return
+		with _locked_cache_file(fCacheName, fWrite=True) as cache_data:
+			for cache_key, cache_entry in fCache['Unsaved'].items():
+				if cache_entry is None:
+					cache_data.pop(cache_key, None)
+				else:
+					cache_data[cache_key] = cache_entry
+		fCache['Unsaved'].clear()
+
+
+def _credentials_still_valid(fExpiration, fMargin=None):
+	"""
+	fExpiration is either the datetime that STS sent back, or the ISO string we stored in the cache.
+	Returns True if the credentials will still be good for at least fMargin seconds.
+	"""
+	from datetime import datetime, timedelta, timezone
+
+	if fMargin is None:
+		fMargin = CREDENTIAL_CACHE_MARGIN
+	if fExpiration is None:
+		return (False)
+	if isinstance(fExpiration, str):
+		fExpiration = datetime.fromisoformat(fExpiration)
+	if fExpiration.tzinfo is None:
+		fExpiration = fExpiration.replace(tzinfo=timezone.utc)
+	return (fExpiration - timedelta(seconds=fMargin) > datetime.now(timezone.utc))
+
+
+def _get_cached_credentials(fMgmtAccount, fChildAccount, fRole):
+	"""
+	Returns the cached credentials for this (management account, child account, role) if they're still valid, otherwise None.
+	"""
+	from datetime import datetime
+
+	cache_key = f"{fMgmtAccount}:{fChildAccount}:{fRole}"
+	with _cache_lock:
+		if not _credential_cache['Loaded']:
+			with _locked_cache_file('credentials') as cache_data:
+				_credential_cache['Entries'].update(cache_data)
+			_credential_cache['Loaded'] = True
+		cached_credentials = _credential_cache['Entries'].get(cache_key)
+	if cached_credentials is None or not _credentials_still_valid(cached_credentials['Expiration']):
+		return (None)
+	return ({'AccessKeyId'    : cached_credentials['AccessKeyId'],
+			 'SecretAccessKey': cached_credentials['SecretAccessKey'],
+			 'SessionToken'   : cached_credentials['SessionToken'],
+			 'Expiration'     : datetime.fromisoformat(cached_credentials['Expiration'])})
+
+
+def _put_cached_credentials(fMgmtAccount, fChildAccount, fRole, fCredentials):
+	"""
+	Caches the credentials for this (management account, child account, role). Nothing is written to disk until
+	save_cached_credentials is called.
+	"""
+	cache_key = f"{fMgmtAccount}:{fChildAccount}:{fRole}"
+	cache_entry = {'AccessKeyId'    : fCredentials['AccessKeyId'],
+				   'SecretAccessKey': fCredentials['SecretAccessKey'],
+				   'SessionToken'   : fCredentials['SessionToken'],
+				   'Expiration'     : fCredentials['Expiration'].isoformat()}
+	with _cache_lock:
+		_credential_cache['Entries'][cache_key] = cache_entry
+		_credential_cache['Unsaved'][cache_key] = cache_entry
+
+
+def save_cached_credentials():
+	"""
+	Writes the credentials cached since the last save to the 'credentials' cache on disk, and prunes anything there
+	that has already expired.
+	"""
+	with _cache_lock:
+		if len(_credential_cache['Unsaved']) == 0:
+			return
+		with _locked_cache_file('credentials', fWrite=True) as cache_data:
+			cache_data.update(_credential_cache['Unsaved'])
+			for key in [key for key, value in cache_data.items() if not _credentials_still_valid(value['Expiration'], 0)]:
+				cache_data.pop(key)
+		_credential_cache['Unsaved'].clear()
+
+
+THROTTLING_ERROR_CODES = ('Throttling', 'ThrottlingException', 'ThrottledException', 'RequestLimitExceeded',
+						  'TooManyRequestsException', 'RequestThrottled', 'SlowDown')
+# 'Unsaved' holds the roles learned (or forgotten, as None) since the cache was last written to disk (see save_role_preferences)
+_role_preferences = {'Loaded': False, 'Entries': dict(), 'Unsaved': dict()}
+
+
+def _is_throttling_error(my_Error):
+	"""
+	Returns True if the exception is AWS telling us to slow down, rather than telling us "No".
+	"""
+	from botocore.exceptions import ClientError
+
+	return (isinstance(my_Error, ClientError) and
+			my_Error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES)
+
+
+def _load_role_preferences():
+	with _cache_lock:
+		if not _role_preferences['Loaded']:
+			with _locked_cache_file('role_preferences') as cache_data:
+				_role_preferences['Entries'].update(cache_data)
+			_role_preferences['Loaded'] = True
+
+
+def get_learned_roles(fMgmtAccount):
+	"""
+	Returns a dict of {child account: role name} holding the role that last worked to get into each child account
+	from the management account provided. get_child_access3 tries these roles first.
+	"""
+	_load_role_preferences()
+	with _cache_lock:
+		return ({key.split(':')[1]: role for key, role in _role_preferences['Entries'].items()
+				 if key.split(':')[0] == str(fMgmtAccount)})
+
+
+def _update_learned_role(fMgmtAccount, fChildAccount, fRole=None):
+	"""
+	Records the role that worked for this child account, or if fRole is None, forgets (demotes) whatever role we had learned.
+	Nothing is written to disk until save_role_preferences is called.
+	"""
+	_load_role_preferences()
+	cache_key = f"{fMgmtAccount}:{fChildAccount}"
+	with _cache_lock:
+		if _role_preferences['Entries'].get(cache_key) == fRole:
+			return
+		if fRole is None:
+			_role_preferences['Entries'].pop(cache_key, None)
+		else:
+			_role_preferences['Entries'][cache_key] = fRole
+		_role_preferences['Unsaved'][cache_key] = fRole
+
+
+def save_role_preferences():
+	"""
+	Writes the roles learned (and forgotten) since the last save to the 'role_preferences' cache on disk.
+	"""
+	_save_cache_changes(_role_preferences, 'role_preferences')
+
+
+def _order_roles_by_preference(fMgmtAccount, fChildAccount, fRoleList):
+	"""
+	Moves the role that last worked for this child account to the front of the list, if it's in the list at all.
+	"""
+	learned_role = get_learned_roles(fMgmtAccount).get(str(fChildAccount))
+	if learned_role is None or learned_role not in fRoleList:
+		return (list(fRoleList))
+	return ([learned_role] + [role for role in fRoleList if not role == learned_role])
+
+
+def get_credential_cache_stats():
+	"""
+	Returns a dict with the number of 'Hits' and 'Misses' that get_child_access3 has had on the credential cache in this process.
+	"""
+	with _cache_lock:
+		return (dict(_credential_cache_stats))
+
+
+def clear_credential_cache():
+	"""
+	Removes all cached child-account credentials, both in memory and on disk.
+	"""
+	with _cache_lock:
+		_credential_cache['Entries'].clear()
+		_credential_cache['Unsaved'].clear()
+		with _locked_cache_file('credentials', fWrite=True) as cache_data:
+			cache_data.clear()
+
+
+REGION_CACHE_TTL = 86400  # Seconds we trust an account's region catalogue before asking EC2 again
+OPTED_IN_STATUSES = ['opt-in-not-required', 'opted-in']
+# 'Unsaved' holds the catalogues looked up since the cache was last written to disk (see save_region_catalogues)
+_region_catalogues = {'Loaded': False, 'Entries': dict(), 'Unsaved': dict()}
+
+
+def _get_region_catalogue(fAccountNumber, fEc2Client, fForceRefresh=False, fSaveCache=True):
+	"""
+	Does the work for get_region_catalogue and get_region_catalogue2.
+	fEc2Client is a function that returns an EC2 client for the account - it's only called if we need to ask EC2.
+	fSaveCache determines whether a catalogue we had to look up is written to the cache on disk straight away. Anything
+	looking up many accounts at once (like get_service_region_matrix) turns it off, and calls save_region_catalogues
+	once it's done.
+	"""
+	import logging
+	from datetime import datetime, timedelta, timezone
+
+	cache_key = str(fAccountNumber)
+	with _cache_lock:
+		if not _region_catalogues['Loaded']:
+			with _locked_cache_file('regions') as cache_data:
+				_region_catalogues['Entries'].update(cache_data)
+			_region_catalogues['Loaded'] = True
+		cached_catalogue = _region_catalogues['Entries'].get(cache_key)
+	if not fForceRefresh and cached_catalogue is not None and \
+			datetime.fromisoformat(cached_catalogue['Timestamp']) + timedelta(seconds=REGION_CACHE_TTL) > datetime.now(timezone.utc):
+		return (dict(cached_catalogue['Regions']))
+	logging.info(f"Looking up the regions for account {cache_key}")
+	regions = fEc2Client().describe_regions(AllRegions=True)['Regions']
+	cache_entry = {'Timestamp': datetime.now(timezone.utc).isoformat(),
+				   'Regions'  : {region['RegionName']: region['OptInStatus'] for region in regions}}
+	with _cache_lock:
+		_region_catalogues['Entries'][cache_key] = cache_entry
+		_region_catalogues['Unsaved'][cache_key] = cache_entry
+	if fSaveCache:
+		save_region_catalogues()
+	return (dict(cache_entry['Regions']))
+
+
+def save_region_catalogues():
+	"""
+	Writes the region catalogues looked up since the last save to the 'regions' cache on disk.
+	"""
+	_save_cache_changes(_region_catalogues, 'regions')
+
+
+def get_region_catalogue(faws_acct, fForceRefresh=False, fSaveCache=True):
+	"""
+	Returns a dict of {region name: opt-in status} with every AWS region, as seen by this account.
+	The catalogue comes from one describe_regions call, and is kept (in memory and on disk) for REGION_CACHE_TTL seconds,
+	so resolving regions for an account we've seen recently doesn't cost any API calls at all.
+	fForceRefresh ignores whatever we have cached, and asks EC2 again.
+	EC2 is asked in us-east-1, rather than the session's region, since that region might be the one that's wrong.
+	fSaveCache set to False leaves a new catalogue in memory, until save_region_catalogues is called.
+	"""
+	return (_get_region_catalogue(faws_acct.acct_number, lambda: faws_acct.session.client('ec2', region_name='us-east-1'),
+								  fForceRefresh, fSaveCache))
+
+
+def get_region_catalogue2(ocredentials, fForceRefresh=False, fSaveCache=True):
+	"""
+	The same as get_region_catalogue, but for the credentials dict that get_child_access3 hands back.
+	"""
+	return (_get_region_catalogue(ocredentials['AccountNumber'],
+								  lambda: get_aws_client(ocredentials, 'ec2', ocredentials.get('Region')), fForceRefresh, fSaveCache))
+
+
+def get_opted_in_regions(faws_acct):
+	"""
+	Returns the names of the regions this account can actually use (those that don't need an opt-in, or were opted into).
+	"""
+	return ([region_name for region_name, opt_in_status in get_region_catalogue(faws_acct).items()
+			 if opt_in_status in OPTED_IN_STATUSES])
+
+
+def get_service_region_matrix(fCredentialList, fServices, fRegionFragments=None):
+	"""
+	fCredentialList is a list of credentials dicts (like get_credentials_for_accounts_in_org returns)
+	fServices is a list of boto3 service names ('ds', 'guardduty', etc.)
+	fRegionFragments optionally narrows things down to the regions that match these fragments (like get_regions3)
+
+	Returns {service: {account number: [regions]}} holding, for each service and account, only the regions where the
+	service exists (from the botocore endpoint data, as get_service_regions does) *and* the account has opted in
+	(from the cached region catalogue). Sweeping only these regions means we never try a call that can't work.
+	Regions we recently found to be disabled for an account (see is_region_disabled) are left out too.
+	Accounts whose credentials didn't work get an empty list, and so do accounts we couldn't get the regions for
+	(describe_regions denied by an SCP, say) - those are logged, but don't stop the rest.
+	The catalogues we had to look up are written to the cache on disk together, once they're all in.
+	"""
+	import logging
+
+	def region_catalogue_or_error(ocredentials):
+		try:
+			return (get_region_catalogue2(ocredentials, fSaveCache=False))
+		except Exception as my_Error:
+			return (my_Error)
+
+	ServiceRegions = {service: get_service_regions(service, fRegionFragments) for service in fServices}
+	RegionMatrix = {service: dict() for service in fServices}
+	# An account we haven't seen lately costs one describe_regions call, so we look those up side by side, in the
+	# biggest sweep pool we've made so far (or a default-sized one, if there isn't one yet)
+	RegionCatalogues = _get_sweep_pool(_sweep_pool['MaxWorkers'] or SWEEP_WORKERS).map(
+		region_catalogue_or_error, [ocredentials for ocredentials in fCredentialList if ocredentials.get('Success', True)])
+	for ocredentials in fCredentialList:
+		if not ocredentials.get('Success', True):
+			for service in fServices:
+				RegionMatrix[service][ocredentials.get('AccountNumber', ocredentials.get('AccountId'))] = []
+			continue
+		region_catalogue = next(RegionCatalogues)
+		if isinstance(region_catalogue, Exception):
+			logging.error(f"Couldn't find the regions for account {ocredentials['AccountNumber']}, so we'll skip it: {region_catalogue}")
+			for service in fServices:
+				RegionMatrix[service][ocredentials['AccountNumber']] = []
+			continue
+		OptedInRegions = [region_name for region_name, opt_in_status in region_catalogue.items()
+						  if opt_in_status in OPTED_IN_STATUSES]
+		for service in fServices:
+			RegionMatrix[service][ocredentials['AccountNumber']] = [region for region in ServiceRegions[service]
+																	if region in OptedInRegions and
+																	not is_region_disabled(ocredentials['AccountNumber'], region)]
+			logging.info(f"Service {service} is available in {len(RegionMatrix[service][ocredentials['AccountNumber']])} "
+						 f"regions for account {ocredentials['AccountNumber']}")
+	save_region_catalogues()
+	return (RegionMatrix)
+
+
+def _match_region_fragments(fRegionNames, fFragments):
+	"""
+	Returns the regions whose names contain any of the fragments ('us-east' finds 'us-east-1' and 'us-east-2').
+	"""
+	import logging
+
+	RegionNames = []
+	for x in fFragments:
+		for y in fRegionNames:
+			logging.info(f"Have {y} | Looking for {x}")
+			if y.find(x) >= 0:
+				logging.info(f"Found {y}")
+				RegionNames.append(y)
+	return (RegionNames)
+
+
+def clear_region_cache():
+	"""
+	Removes all cached region catalogues, both in memory and on disk.
+	"""
+	with _cache_lock:
+		_region_catalogues['Entries'].clear()
+		_region_catalogues['Unsaved'].clear()
+		with _locked_cache_file('regions', fWrite=True) as cache_data:
+			cache_data.clear()
+
+
+NEGATIVE_CACHE_TTL = 86400  # Seconds we trust that an account / role or account / region is a dead end, before trying again
+# Errors that always mean the account can't use the region
+DISABLED_REGION_ERRORS = ['OptInRequired']
+# Errors we get from a region the account hasn't opted into - but also from credentials that are bad or expired,
+# so they only count once the account's region catalogue agrees the region isn't opted in
+POSSIBLY_DISABLED_REGION_ERRORS = ['security token included in the request is invalid', 'AuthFailure']
+# 'Unsaved' holds the dead ends recorded (or forgotten, as None) since the cache was last written to disk (see save_negative_cache)
+_negative_cache = {'Loaded': False, 'Entries': dict(), 'Unsaved': dict(), 'Recheck': False}
+
+
+def set_negative_cache_recheck(fRecheck=True):
+	"""
+	With fRecheck set, nothing is skipped because of the negative cache - every account, role and region gets tried again.
+	Whatever we learn is still recorded (or forgotten), so the cache is up to date for the next run.
+	The Org's list of accounts is enumerated afresh as well, rather than coming from the cache (see get_org_accounts).
+	Scripts hook this up to the "--recheck" parameter.
+	"""
+	with _cache_lock:
+		_negative_cache['Recheck'] = fRecheck
+
+
+def _load_negative_cache():
+	with _cache_lock:
+		if not _negative_cache['Loaded']:
+			with _locked_cache_file('negative') as cache_data:
+				_negative_cache['Entries'].update(cache_data)
+			_negative_cache['Loaded'] = True
+
+
+def _is_dead_end(fCacheKey):
+	"""
+	Returns True if we recorded this as a dead end within the last NEGATIVE_CACHE_TTL seconds (and we're not rechecking).
+	"""
+	from datetime import datetime, timedelta, timezone
+
+	_load_negative_cache()
+	with _cache_lock:
+		if _negative_cache['Recheck']:
+			return (False)
+		cache_entry = _negative_cache['Entries'].get(fCacheKey)
+	return (cache_entry is not None and
+			datetime.fromisoformat(cache_entry['Timestamp']) + timedelta(seconds=NEGATIVE_CACHE_TTL) > datetime.now(timezone.utc))
+
+
+def _record_dead_end(fCacheKey, fReason=None):
+	from datetime import datetime, timezone
+
+	_load_negative_cache()
+	cache_entry = {'Timestamp': datetime.now(timezone.utc).isoformat(), 'Reason': str(fReason)}
+	with _cache_lock:
+		_negative_cache['Entries'][fCacheKey] = cache_entry
+		_negative_cache['Unsaved'][fCacheKey] = cache_entry
+
+
+def _forget_dead_end(fCacheKey):
+	_load_negative_cache()
+	with _cache_lock:
+		if fCacheKey not in _negative_cache['Entries']:
+			return
+		_negative_cache['Entries'].pop(fCacheKey)
+		_negative_cache['Unsaved'][fCacheKey] = None
+
+
+def save_negative_cache():
+	"""
+	Writes the inaccessible roles and disabled regions recorded (or forgotten) since the last save to the 'negative'
+	cache on disk. Recording them only changes what's in memory, so they can be recorded from a sweep's threads without
+	each one rewriting the file - the sweeps (and get_credentials_for_accounts_in_org) save them when they finish.
+	"""
+	_save_cache_changes(_negative_cache, 'negative')
+
+
+def is_role_inaccessible(fMgmtAccount, fChildAccount, fRole):
+	"""
+	Returns True if assuming this role in the child account (from this management account) recently failed.
+	"""
+	return (_is_dead_end(f"Role:{fMgmtAccount}:{fChildAccount}:{fRole}"))
+
+
+def record_inaccessible_role(fMgmtAccount, fChildAccount, fRole, fReason=None):
+	_record_dead_end(f"Role:{fMgmtAccount}:{fChildAccount}:{fRole}", fReason)
+
+
+def is_region_disabled(fAccountNumber, fRegion):
+	"""
+	Returns True if this account was recently found not to be able to use this region.
+	"""
+	return (_is_dead_end(f"Region:{fAccountNumber}:{fRegion}"))
+
+
+def record_disabled_region(fAccountNumber, fRegion, fReason=None):
+	"""
+	Remembers that this account can't use this region. It's written to disk the next time save_negative_cache (or
+	save_caches) is called - which the sweeps do when they finish.
+	"""
+	_record_dead_end(f"Region:{fAccountNumber}:{fRegion}", fReason)
+
+
+def is_disabled_region_error(my_Error, ocredentials=None, fRegion=None):
+	"""
+	Returns True if the exception is AWS telling us that the account can't use the region (usually because it never opted in).
+	Some of those errors could just as well mean the credentials are bad, so with ocredentials and fRegion given, they
+	only count if the account's region catalogue shows the region isn't opted in - and without them, they don't count.
+	"""
+	import logging
+
+	if any([str(my_Error).find(error_text) >= 0 for error_text in DISABLED_REGION_ERRORS]):
+		return (True)
+	if ocredentials is None or fRegion is None or \
+			not any([str(my_Error).find(error_text) >= 0 for error_text in POSSIBLY_DISABLED_REGION_ERRORS]):
+		return (False)
+	try:
+		# This is usually called from a sweep's threads, so a catalogue we have to look up is saved along with the sweep's caches
+		return (get_region_catalogue2(ocredentials, fSaveCache=False).get(fRegion) not in OPTED_IN_STATUSES)
+	except Exception as my_CatalogueError:
+		logging.info(f"Couldn't check the region catalogue for account {ocredentials.get('AccountNumber')}: {my_CatalogueError}")
+		return (False)
+
+
+def filter_disabled_regions(ocredentials, fRegionList):
+	"""
+	Returns the regions from fRegionList that the account can use. Regions the account hasn't opted into (according to
+	its region catalogue), or that we recently found to be disabled, are left out - so we don't waste calls on them.
+	"""
+	import logging
+
+	OptedInRegions = [region_name for region_name, opt_in_status in get_region_catalogue2(ocredentials).items()
+					  if opt_in_status in OPTED_IN_STATUSES]
+	RegionList = [region for region in fRegionList
+				  if region in OptedInRegions and not is_region_disabled(ocredentials['AccountNumber'], region)]
+	if len(RegionList) < len(fRegionList):
+		logging.info(f"Skipping regions {sorted(set(fRegionList) - set(RegionList))} for account {ocredentials['AccountNumber']}, "
+					 f"since they aren't enabled")
+	return (RegionList)
+
+
+def clear_negative_cache():
+	"""
+	Forgets every inaccessible role and disabled region we've recorded, both in memory and on disk.
+	"""
+	with _cache_lock:
+		_negative_cache['Entries'].clear()
+		_negative_cache['Unsaved'].clear()
+		with _locked_cache_file('negative', fWrite=True) as cache_data:
+			cache_data.clear()
+
+
+ORG_CACHE_TTL = 3600  # Seconds we trust an Org's list of accounts before enumerating it again
+_org_memberships = {'Loaded': False, 'Entries': dict()}
+
+
+def _org_page_fingerprint(fAccounts):
+	return ([[account['Id'], account['Status']] for account in fAccounts])
+
+
+def _org_has_new_accounts(fOrgClient, fKnownAccountIds):
+	"""
+	Returns True if Organizations knows of an account that isn't in fKnownAccountIds - one created in the Org (from the
+	CreateAccount statuses it keeps for 90 days) or one that accepted an invitation to join (from the handshakes it
+	keeps for 30 days). New accounts can land on any page of ListAccounts, so the first page alone can't tell us.
+	"""
+	import logging
+	from botocore.exceptions import ClientError
+
+	try:
+		for page in fOrgClient.get_paginator('list_create_account_status').paginate(States=['SUCCEEDED']):
+			for account_status in page['CreateAccountStatuses']:
+				if account_status.get('AccountId') is not None and account_status['AccountId'] not in fKnownAccountIds:
+					return (True)
+		for page in fOrgClient.get_paginator('list_handshakes_for_organization').paginate(Filter={'ActionType': 'INVITE'}):
+			for handshake in page['Handshakes']:
+				if not handshake['State'] == 'ACCEPTED':
+					continue
+				for party in handshake['Parties']:
+					if party['Type'] == 'ACCOUNT' and party['Id'] not in fKnownAccountIds:
+						return (True)
+	except ClientError as my_Error:
+		# Without these, the first page is all we can go on
+		logging.info(f"Couldn't check for new accounts in the Org: {my_Error}")
+	return (False)
+
+
+def get_org_accounts(fOrgId, fOrgClient, fForceRefresh=False, fCheckForChanges=False):
+	"""
+	fOrgId is the Organization ID ('o-xxxxxxxxxx') the accounts are cached under
+	fOrgClient is a function that returns an Organizations client for the management account - it's only called if we
+		need to talk to Organizations.
+	fForceRefresh ignores whatever we have cached, and enumerates the Org again. So does "--recheck" (see
+		set_negative_cache_recheck).
+	fCheckForChanges spends one ListAccounts call to compare the first page with the one we cached, and looks for
+		accounts recently created in (or invited into) the Org that we don't know about (see _org_has_new_accounts).
+		If either turns something up, the Org is enumerated again (starting from that page), even if the cached list
+		hasn't reached ORG_CACHE_TTL yet. Accounts leaving the Org from a later page aren't noticed until it has.
+
+	Returns the list of accounts in the Org, each a dict with 'Id', 'Name', 'Email' and 'Status'.
+	The list is kept (in memory and on disk) for ORG_CACHE_TTL seconds, so it's shared by every script that runs
+	against this Org, and enumerating a large Org again and again doesn't eat into the low Organizations API limits.
+	"""
+	import logging
+	from datetime import datetime, timedelta, timezone
+
+	with _cache_lock:
+		if not _org_memberships['Loaded']:
+			with _locked_cache_file('orgs') as cache_data:
+				_org_memberships['Entries'].update(cache_data)
+			_org_memberships['Loaded'] = True
+		cached_org = _org_memberships['Entries'].get(fOrgId)
+		if _negative_cache['Recheck']:
+			fForceRefresh = True
+	cache_is_fresh = (not fForceRefresh and cached_org is not None and
+					  datetime.fromisoformat(cached_org['Timestamp']) + timedelta(seconds=ORG_CACHE_TTL) > datetime.now(timezone.utc))
+	if cache_is_fresh and not fCheckForChanges:
+		return ([dict(account) for account in cached_org['Accounts']])
+	org_client = fOrgClient()
+	response = org_client.list_accounts()
+	if cache_is_fresh and _org_page_fingerprint(response['Accounts']) == cached_org['FirstPage'] and \
+			not _org_has_new_accounts(org_client, set([account['Id'] for account in cached_org['Accounts']])):
+		logging.info(f"The accounts in Org {fOrgId} haven't changed since we cached them")
+		return ([dict(account) for account in cached_org['Accounts']])
+	logging.info(f"Enumerating the accounts in Org {fOrgId}")
+	first_page = _org_page_fingerprint(response['Accounts'])
+	org_accounts = []
+	while True:
+		org_accounts.extend([{'Id'    : account['Id'],
+							  'Name'  : account.get('Name'),
+							  'Email' : account['Email'],
+							  'Status': account['Status']} for account in response['Accounts']])
+		if 'NextToken' not in response:
+			break
+		response = org_client.list_accounts(NextToken=response['NextToken'])
+	cache_entry = {'Timestamp': datetime.now(timezone.utc).isoformat(),
+				   'FirstPage': first_page,
+				   'Accounts' : org_accounts}
+	with _cache_lock:
+		_org_memberships['Entries'][fOrgId] = cache_entry
+		with _locked_cache_file('orgs', fWrite=True) as cache_data:
+			cache_data[fOrgId] = cache_entry
+	return ([dict(account) for account in org_accounts])
+
+
+def clear_org_cache():
+	"""
+	Removes all cached Org account lists, both in memory and on disk.
+	"""
+	with _cache_lock:
+		_org_memberships['Entries'].clear()
+		with _locked_cache_file('orgs', fWrite=True) as cache_data:
+			cache_data.clear()
+
+
+"""
+Shared sessions - botocore parses the service models and endpoint data once per session, so we keep one process-wide
+session (and its model loader) and inject the credentials into each client we build from it.
+"""
+
+CLIENT_CACHE_SIZE = 512  # Most clients we hold onto before the least recently used ones are dropped
+CLIENT_RETRY_MODE = 'standard'  # botocore's retry mode - 'legacy', 'standard' or 'adaptive'
+CLIENT_MAX_ATTEMPTS = 5  # How many times botocore tries a call (the first go included) before giving up
+CLIENT_CONNECT_TIMEOUT = 10  # Seconds to wait for a connection to be made
+CLIENT_READ_TIMEOUT = 60  # Seconds to wait for an answer, once we're connected
+_client_config = {'RetryMode': None, 'MaxAttempts': None, 'ConnectTimeout': None, 'ReadTimeout': None, 'PoolSize': None}
+REFRESHABLE_SESSION_CACHE_SIZE = 256  # Most sessions for refreshable (assumed role) credentials we hold onto
+_shared_sessions = {'Session': None, 'Loader': None, 'Profiles': dict(), 'Refreshable': OrderedDict()}
+_client_creation_lock = threading.Lock()
+_client_cache = OrderedDict()
+_client_cache_stats = {'Hits': 0, 'Misses': 0, 'Evictions': 0}
+# One lock per client cache key, held while that client is built - so two threads don't build the same client, while
+# clients for other keys get built at the same time. Each lock goes away once nobody's waiting on it.
+_client_key_locks = weakref.WeakValueDictionary()
+
+
+def set_client_config(fRetryMode=None, fMaxAttempts=None, fConnectTimeout=None, fReadTimeout=None, fPoolSize=None):
+	"""
+	Changes how every client we make from here on retries, times out and pools its connections. Anything left as None
+	keeps its default (CLIENT_RETRY_MODE, CLIENT_MAX_ATTEMPTS, CLIENT_CONNECT_TIMEOUT and CLIENT_READ_TIMEOUT).
+	fPoolSize fixes the size of each client's connection pool. Left as None, the pool grows to match however many
+	threads might be sharing the client (see get_client_pool_size).
+	Clients already in the cache keep the settings they were made with, so this is best called before any are made.
+	"""
+	_client_config.update({'RetryMode'     : fRetryMode,
+						   'MaxAttempts'   : fMaxAttempts,
+						   'ConnectTimeout': fConnectTimeout,
+						   'ReadTimeout'   : fReadTimeout,
+						   'PoolSize'      : fPoolSize})
+
+
+def get_client_pool_size():
+	"""
+	Returns how many connections each client should keep - the size given to set_client_config, or else enough for
+	every thread in the biggest sweep and credential pools to use a client at once (and never fewer than botocore's 10).
+	"""
+	if _client_config['PoolSize'] is not None:
+		return (_client_config['PoolSize'])
+	return (max(10, _sweep_pool['MaxWorkers'] or SWEEP_WORKERS, _credential_pool['MaxWorkers'] or CREDENTIAL_WORKERS))
+
+
+def get_client_settings(fPoolSize=None):
+	"""
+	Returns the retry, timeout and connection pool settings for a client, as the keyword arguments that botocore's
+	Config (or aiobotocore's AioConfig) takes.
+	"""
+	return ({'retries'             : {'mode'        : _client_config['RetryMode'] or CLIENT_RETRY_MODE,
+									  'max_attempts': _client_config['MaxAttempts'] or CLIENT_MAX_ATTEMPTS},
+			 'connect_timeout'     : _client_config['ConnectTimeout'] or CLIENT_CONNECT_TIMEOUT,
+			 'read_timeout'        : _client_config['ReadTimeout'] or CLIENT_READ_TIMEOUT,
+			 'max_pool_connections': fPoolSize if fPoolSize is not None else get_client_pool_size()})
+
+
+def get_client_config(fPoolSize=None):
+	"""
+	Returns the botocore Config that all of our clients are made with - see get_client_settings.
+	"""
+	from botocore.config import Config
+
+	return (Config(**get_client_settings(fPoolSize)))
+
+
+def get_shared_session():
+	"""
+	Returns the process-wide boto3 Session. It carries no credentials of its own - those are passed per client.
+	"""
+	import boto3
+
+	with _client_creation_lock:
+		if _shared_sessions['Session'] is None:
+			shared_session = boto3.Session()
+			_shared_sessions['Loader'] = shared_session._session.get_component('data_loader')
+			_shared_sessions['Session'] = shared_session
+		return (_shared_sessions['Session'])
+
+
+def share_model_loader(fSession):
+	"""
+	Points a boto3 Session (for example, one built from a profile) at the process-wide model loader,
+	so that it doesn't parse the service models all over again. Returns the same session.
+	"""
+	get_shared_session()
+	fSession._session.register_component('data_loader', _shared_sessions['Loader'])
+	return (fSession)
+
+
+def _get_profile_session(fProfile):
+	"""
+	Returns a cached boto3 Session for this profile, sharing the process-wide model loader.
+	"""
+	import boto3
+
+	with _client_creation_lock:
+		profile_session = _shared_sessions['Profiles'].get(fProfile)
+	if profile_session is None:
+		profile_session = share_model_loader(boto3.Session(profile_name=fProfile))
+		with _client_creation_lock:
+			profile_session = _shared_sessions['Profiles'].setdefault(fProfile, profile_session)
+	return (profile_session)
+
+
+def get_refreshable_session(fCredentials, fRegion=None):
+	"""
+	Returns a boto3 Session (sharing the process-wide model loader) that uses the botocore credentials object passed in.
+	If that object is a RefreshableCredentials, every client made from this session renews its credentials on its own
+	shortly before they expire, so long-running work doesn't fall over halfway through.
+	"""
+	import boto3
+	import botocore.session
+
+	botocore_session = botocore.session.Session()
+	botocore_session._credentials = fCredentials
+	return (share_model_loader(boto3.Session(botocore_session=botocore_session, region_name=fRegion)))
+
+
+def _get_refreshable_session(ocredentials):
+	"""
+	Returns a cached session for the 'RefreshableCredentials' in this credentials dict. Sessions are kept per
+	(management account, account, role), so getting new credentials for the same role replaces the old session rather
+	than adding another, and at most REFRESHABLE_SESSION_CACHE_SIZE are kept - the least recently used go first.
+	"""
+	cache_key = (ocredentials.get('MgmtAccount'), ocredentials.get('AccountNumber'), ocredentials.get('Role'))
+	with _client_creation_lock:
+		cache_entry = _shared_sessions['Refreshable'].get(cache_key)
+		if cache_entry is not None and cache_entry['Credentials'] is ocredentials['RefreshableCredentials']:
+			_shared_sessions['Refreshable'].move_to_end(cache_key)
+			return (cache_entry['Session'])
+	refreshable_session = get_refreshable_session(ocredentials['RefreshableCredentials'])
+	with _client_creation_lock:
+		_shared_sessions['Refreshable'][cache_key] = {'Credentials': ocredentials['RefreshableCredentials'], 'Session': refreshable_session}
+		_shared_sessions['Refreshable'].move_to_end(cache_key)
+		while len(_shared_sessions['Refreshable']) > REFRESHABLE_SESSION_CACHE_SIZE:
+			_shared_sessions['Refreshable'].popitem(last=False)
+	return (refreshable_session)
+
+
+_sts_clients = weakref.WeakKeyDictionary()
+
+
+def _runner_region(faws_acct):
+	"""
+	Returns the region this machine is set up to use - from AWS_REGION / AWS_DEFAULT_REGION, or the profile's config -
+	rather than whatever region the session was built for. Falls back to us-east-1 if nothing's set.
+	"""
+	import botocore.session
+	from botocore.exceptions import BotoCoreError
+
+	try:
+		runner_region = botocore.session.Session(profile=faws_acct.session.profile_name).get_config_variable('region')
+	except BotoCoreError:
+		runner_region = None
+	return (runner_region if runner_region is not None else 'us-east-1')
+
+
+def _get_sts_client(faws_acct):
+	"""
+	Returns the STS client for this management session, so every AssumeRole re-uses the same warm connections.
+	The client talks to the regional STS endpoint for the region this machine is set up for (see _runner_region),
+	rather than the global one in us-east-1, and its connection pool is as big as the pool of threads calling
+	get_child_access3, so none of them has to wait for, or set up, a connection.
+	It's built from a session of its own (sharing the management session's credentials), so the regional endpoint
+	setting doesn't leak into anything else made from the management session.
+	"""
+	import botocore.session
+
+	pool_size = max(10, _credential_pool['MaxWorkers'] or CREDENTIAL_WORKERS)
+	with _client_creation_lock:
+		cache_entry = _sts_clients.get(faws_acct.session)
+		if cache_entry is not None and cache_entry['PoolSize'] >= pool_size:
+			return (cache_entry['Client'])
+	sts_region = cache_entry['Region'] if cache_entry is not None else _runner_region(faws_acct)
+	sts_session = botocore.session.Session()
+	sts_session._credentials = faws_acct.session._session.get_credentials()
+	get_shared_session()
+	sts_session.register_component('data_loader', _shared_sessions['Loader'])
+	sts_session.set_config_variable('sts_regional_endpoints', 'regional')
+	sts_client = _attach_rate_limiter(sts_session.create_client('sts', region_name=sts_region, config=get_client_config(pool_size)),
+									  'sts', faws_acct.acct_number, sts_region)
+	with _client_creation_lock:
+		_sts_clients[faws_acct.session] = {'Client': sts_client, 'Region': sts_region, 'PoolSize': pool_size}
+	return (sts_client)
+
+
+def _make_refreshable_credentials(faws_acct, fChildAccount, fRole, fRegion, fCredentials, fUseCache=True):
+	"""
+	Wraps credentials for the child account in botocore RefreshableCredentials. When they get close to expiring,
+	botocore assumes the same role again through the management account's session, and carries on with the new ones.
+	"""
+	import logging
+	from botocore.credentials import RefreshableCredentials
+
+	def refresh_credentials():
+		logging.info(f"Refreshing the credentials for account {fChildAccount} using role {fRole}")
+		sts_client = _get_sts_client(faws_acct)
+		new_credentials = sts_client.assume_role(RoleArn=f"arn:aws:iam::{fChildAccount}:role/{fRole}",
+												 RoleSessionName="Test-ChildAccount-Access")['Credentials']
+		if fUseCache:
+			_put_cached_credentials(faws_acct.acct_number, fChildAccount, fRole, new_credentials)
+			save_cached_credentials()
+		return ({'access_key' : new_credentials['AccessKeyId'],
+				 'secret_key' : new_credentials['SecretAccessKey'],
+				 'token'      : new_credentials['SessionToken'],
+				 'expiry_time': new_credentials['Expiration'].isoformat()})
+
+	return (RefreshableCredentials.create_from_metadata(
+		metadata={'access_key' : fCredentials['AccessKeyId'],
+				  'secret_key' : fCredentials['SecretAccessKey'],
+				  'token'      : fCredentials['SessionToken'],
+				  'expiry_time': fCredentials['Expiration'].isoformat()},
+		refresh_using=refresh_credentials,
+		method='sts-assume-role'))
+
+
+def _evict_clients():
+	"""
+	Drops the clients whose credentials have expired, and then the least recently used ones until we're within CLIENT_CACHE_SIZE.
+	Expects the caller to hold _client_creation_lock.
+	"""
+	for cache_key in [cache_key for cache_key, cache_entry in _client_cache.items()
+					  if cache_entry['Expiration'] is not None and not _credentials_still_valid(cache_entry['Expiration'], 0)]:
+		_client_cache.pop(cache_key)
+		_client_cache_stats['Evictions'] += 1
+	while len(_client_cache) > CLIENT_CACHE_SIZE:
+		_client_cache.popitem(last=False)
+		_client_cache_stats['Evictions'] += 1
+
+
+def _get_cached_client(fCacheKey, fPoolSize):
+	"""
+	Returns the cached client for this key if it can still be used - its credentials haven't expired, and its connection
+	pool is big enough - or None. Expects the caller to hold _client_creation_lock.
+	"""
+	cache_entry = _client_cache.get(fCacheKey)
+	if cache_entry is not None and (cache_entry['Expiration'] is None or _credentials_still_valid(cache_entry['Expiration'], 0)) \
+			and cache_entry['PoolSize'] >= fPoolSize:
+		_client_cache.move_to_end(fCacheKey)
+		_client_cache_stats['Hits'] += 1
+		return (cache_entry['Client'])
+	return (None)
+
+
+def get_aws_client(ocredentials, fService, fRegion=None):
+	"""
+	ocredentials is an object with the following structure:
+		- ['AccessKeyId'] holds the AWS_ACCESS_KEY
+		- ['SecretAccessKey'] holds the AWS_SECRET_ACCESS_KEY
+		- ['SessionToken'] holds the AWS_SESSION_TOKEN
+		- ['AccountNumber'] holds the account number
+		- ['Profile'] can hold the profile, instead of the session credentials
+		- ['Expiration'] optionally holds when the credentials expire
+		- ['RefreshableCredentials'] optionally holds a botocore credentials object, which is used instead of the keys
+	fService is the boto3 service name ('ec2', 'logs', etc.)
+	fRegion is the region the client should talk to
+
+	Returns a client built from the shared session, so the service model is only loaded once per process.
+	If the profile supplied belongs to the account we're looking at, the profile is used instead of the credentials.
+	Clients are cached per (access key, region, service), so repeated calls re-use the same connection pool.
+	They're made with get_client_config, and made again if the sweep has grown past the size of their connection pool.
+	The cache holds at most CLIENT_CACHE_SIZE clients, and drops a client once its credentials have expired.
+	Every client waits its turn on the rate limiter for its service, account and region (see RATE_LIMITS).
+	Clients are built outside the cache's lock, so a thread building one client doesn't hold up the threads finding
+	theirs in the cache, or building a different one.
+	"""
+	import logging
+
+	client_session = None
+	if 'Profile' in ocredentials.keys() and ocredentials['Profile'] is not None:
+		ProfileAccountNumber = find_account_number(ocredentials['Profile'])
+		logging.info(
+			f"Profile: {ocredentials['Profile']} | Profile Account Number: {ProfileAccountNumber} | Account Number passed in: {ocredentials['AccountNumber']}")
+		if ProfileAccountNumber == ocredentials['AccountNumber']:
+			client_session = _get_profile_session(ocredentials['Profile'])
+	if client_session is None and ocredentials.get('RefreshableCredentials') is not None:
+		# These credentials renew themselves, so the client never needs to be thrown away
+		client_session = _get_refreshable_session(ocredentials)
+		cache_key = (ocredentials['AccessKeyId'], fRegion, fService)
+		expiration = None
+	elif client_session is None:
+		cache_key = (ocredentials['AccessKeyId'], fRegion, fService)
+		expiration = ocredentials.get('Expiration')
+	else:
+		# Profile sessions refresh their own credentials, so these clients never expire
+		cache_key = (f"Profile:{ocredentials['Profile']}", fRegion, fService)
+		expiration = None
+	shared_session = get_shared_session()
+	pool_size = get_client_pool_size()
+	with _client_creation_lock:
+		aws_client = _get_cached_client(cache_key, pool_size)
+		if aws_client is not None:
+			return (aws_client)
+		key_lock = _client_key_locks.get(cache_key)
+		if key_lock is None:
+			key_lock = threading.Lock()
+			_client_key_locks[cache_key] = key_lock
+	with key_lock:
+		with _client_creation_lock:
+			# Another thread may have built this client while we were waiting for it
+			aws_client = _get_cached_client(cache_key, pool_size)
+			if aws_client is not None:
+				return (aws_client)
+			_client_cache_stats['Misses'] += 1
+		if client_session is None:
+			aws_client = shared_session.client(fService, region_name=fRegion,
+											   aws_access_key_id=ocredentials['AccessKeyId'],
+											   aws_secret_access_key=ocredentials['SecretAccessKey'],
+											   aws_session_token=ocredentials.get('SessionToken'),
+											   config=get_client_config(pool_size))
+		else:
+			aws_client = client_session.client(fService, region_name=fRegion, config=get_client_config(pool_size))
+		_attach_rate_limiter(aws_client, fService, ocredentials.get('AccountNumber'), fRegion)
+		with _client_creation_lock:
+			_client_cache[cache_key] = {'Client': aws_client, 'Expiration': expiration, 'PoolSize': pool_size}
+			_evict_clients()
+	return (aws_client)
+
+
+def get_client_cache_stats():
+	"""
+	Returns a dict with the number of 'Hits', 'Misses' and 'Evictions' that get_aws_client has had in this process.
+	"""
+	with _client_creation_lock:
+		return (dict(_client_cache_stats, Size=len(_client_cache)))
+
+
+def clear_client_cache():
+	"""
+	Drops every cached client. Useful if you've changed credentials underneath a profile.
+	"""
+	with _client_creation_lock:
+		_client_cache.clear()
+
+
+_credential_registry = dict()
+
+
+def register_credentials(ocredentials, fRegion=None):
+	"""
+	Keeps the credentials for this account in one place, and returns a small handle - (account number, region) - for
+	result rows to hold instead of their own copies of the keys. Use get_client_for_handle to get a client back later.
+	Registering the same account again replaces its credentials, so the handle always resolves to the newest ones.
+	"""
+	AccountNumber = ocredentials.get('AccountNumber', ocredentials.get('AccountId'))
+	with _client_creation_lock:
+		_credential_registry[AccountNumber] = ocredentials
+	return ((AccountNumber, fRegion if fRegion is not None else ocredentials.get('Region')))
+
+
+def get_registered_credentials(fHandle):
+	"""
+	Returns the credentials dict that a handle from register_credentials refers to.
+	"""
+	with _client_creation_lock:
+		return (_credential_registry[fHandle[0]])
+
+
+def get_client_for_handle(fHandle, fService):
+	"""
+	Returns the (shared, cached) client for this service, in the account and region that the handle refers to.
+	"""
+	return (get_aws_client(get_registered_credentials(fHandle), fService, fHandle[1]))
+
+
+def clear_credential_registry():
+	with _client_creation_lock:
+		_credential_registry.clear()
+
+
+# Calls per second we allow against each service, per account and region. These are a little under what AWS documents
+# (or what we've seen it throttle at), so a big sweep runs flat out without setting off a storm of retries.
+RATE_LIMITS = {'default'       : 20,
+			   'cloudformation': 4,
+			   'cloudtrail'    : 5,
+			   'config'        : 5,
+			   'ds'            : 5,
+			   'ec2'           : 50,
+			   'guardduty'     : 5,
+			   'iam'           : 5,
+			   'lambda'        : 10,
+			   'logs'          : 5,
+			   'organizations' : 2,
+			   'rds'           : 10,
+			   'route53'       : 4,
+			   'sns'           : 10,
+			   'sts'           : 20}
+# These services aren't regional, so their limit applies across every region in the account
+GLOBAL_SERVICES = ['iam', 'organizations', 'route53']
+# These calls answer for the whole account, even though the rest of their service is regional
+GLOBAL_OPERATIONS = [('s3', 'list_buckets')]
+_rate_limits = {'Rates': dict(RATE_LIMITS), 'Buckets': dict()}
+_rate_limit_lock = threading.Lock()
+
+
+def global_collector(fCollector):
+	"""
+	Marks a collector as looking at something that isn't regional (like IAM, Organizations or Route 53), so the
+	sweeps only run it once in each account, rather than once per region. Works as a decorator, too.
+	"""
+	fCollector.Scope = 'global'
+	return (fCollector)
+
+
+def collector_scope(fCollector):
+	"""
+	Returns 'global' for collectors marked with global_collector (and PagedCollectors of global calls), or else 'regional'.
+	"""
+	return (getattr(fCollector, 'Scope', 'regional'))
+
+
+class _TokenBucket:
+	"""
+	Allows fRate calls per second, with up to a second's worth saved up for a burst.
+	Each caller reserves its token in turn - if there aren't any left, it's told how long to wait for its turn - so
+	callers go in the order they asked, rather than all waking up at once to fight over the next token.
+	"""
+
+	def __init__(self, fRate):
+		from time import monotonic
+
+		self.Rate = fRate
+		self.Capacity = max(1.0, float(fRate))
+		self.Tokens = self.Capacity
+		self.LastRefill = monotonic()
+		self.Lock = threading.Lock()
+
+	def reserve(self):
+		"""
+		Takes a token, and returns how many seconds to wait before using it.
+		"""
+		from time import monotonic
+
+		with self.Lock:
+			now = monotonic()
+			self.Tokens = min(self.Capacity, self.Tokens + (now - self.LastRefill) * self.Rate)
+			self.LastRefill = now
+			self.Tokens -= 1
+			return (0 if self.Tokens >= 0 else -self.Tokens / self.Rate)
+
+	def acquire(self):
+		from time import sleep
+
+		wait_time = self.reserve()
+		if wait_time > 0:
+			sleep(wait_time)
+
+	async def acquire_async(self):
+		import asyncio
+
+		wait_time = self.reserve()
+		if wait_time > 0:
+			await asyncio.sleep(wait_time)
+
+
+def set_rate_limits(fRates=None):
+	"""
+	fRates is a list of "service=calls per second" strings (like the --ratelimit parameter gives us), which replace
+	the rates in RATE_LIMITS for those services. "default" sets the rate for any service that isn't listed, and a rate
+	of 0 turns the limit off for that service.
+	"""
+	import logging
+
+	with _rate_limit_lock:
+		for rate_setting in (fRates if fRates is not None else []):
+			try:
+				service, rate = rate_setting.split('=')
+				_rate_limits['Rates'][service.strip().lower()] = float(rate)
+			except ValueError:
+				logging.error(f"Ignoring the rate limit '{rate_setting}', since it isn't in the form 'service=calls per second'")
+		_rate_limits['Buckets'].clear()
+		logging.info(f"Rate limits (calls per second) are now {_rate_limits['Rates']}")
+
+
+def get_rate_limiter(fService, fAccountNumber, fRegion):
+	"""
+	Returns the token bucket shared by every call to this service, in this account and region (or None if the service
+	isn't limited). Global services share one bucket across all of an account's regions.
+	"""
+	if fService in GLOBAL_SERVICES:
+		fRegion = 'global'
+	with _rate_limit_lock:
+		rate = _rate_limits['Rates'].get(fService, _rate_limits['Rates'].get('default', 0))
+		if not rate > 0:
+			return (None)
+		bucket_key = (fService, fAccountNumber, fRegion)
+		if bucket_key not in _rate_limits['Buckets']:
+			_rate_limits['Buckets'][bucket_key] = _TokenBucket(rate)
+		return (_rate_limits['Buckets'][bucket_key])
+
+
+def _attach_rate_limiter(fClient, fService, fAccountNumber, fRegion, fAsync=False):
+	"""
+	Makes every request the client sends - retries included - wait for a token from its bucket first.
+	The bucket is looked up on each request, so set_rate_limits takes effect on clients we've already made.
+	fAsync is for aiobotocore clients, which await their event handlers, so waiting doesn't hold up the event loop.
+	"""
+
+	def wait_for_token(**kwargs):
+		bucket = get_rate_limiter(fService, fAccountNumber, fRegion)
+		if bucket is not None:
+			bucket.acquire()
+
+	async def wait_for_token_async(**kwargs):
+		bucket = get_rate_limiter(fService, fAccountNumber, fRegion)
+		if bucket is not None:
+			await bucket.acquire_async()
+
+	fClient.meta.events.register('before-send', wait_for_token_async if fAsync else wait_for_token)
+	return (fClient)
+
+
+def get_child_access3(faws_acct, fChildAccount, fRegion='us-east-1', fRoleList=None, fUseCache=True, fSaveCache=True):
 	"""
 	- fAccountObject is a custom class (account_class.aws_acct_access)
 	- fChildAccount expects an AWS account number (ostensibly of a Child Account)
 	- rRegion expects a string representing one of the AWS regions ('us-east-1', 'eu-west-1', etc.)
 	- fRoleList expects a list of roles to try, but defaults to a list of typical roles, in case you don't provide
+		Whichever role last worked for this child account is tried first (see get_learned_roles).
+	- fUseCache determines whether we can re-use credentials from a previous run that haven't expired yet.
+		Cached credentials are keyed by (management account, child account, role), and are dropped
+		CREDENTIAL_CACHE_MARGIN seconds before their 'Expiration'.
+		It also means roles that recently failed for this child account (see is_role_inaccessible) aren't tried again
+		until NEGATIVE_CACHE_TTL has passed, or "--recheck" was given.
+	- fSaveCache determines whether new credentials, and the role that worked, are written to the caches on disk
+		straight away. Anything getting credentials for many accounts at once (like get_credentials_for_accounts_in_org)
+		turns it off, and calls save_caches once it's done.
 
 	The first response object is a dict with account_credentials to pass onto other functions
 	This is the same object as "ocredentials" used in other places in this library file.
@@ -676,7 +1852,12 @@ def get_child_access3(faws_acct, fChildAccount, fRegion='us-east-1', fRoleList=N
 							'SessionToken': None,
 							'AccountNumber': None,
 							'Region': fRegion,
-							'Role': Role that worked to get in}
+							'Role': Role that worked to get in,
+							'RefreshableCredentials': botocore credentials object that renews itself before it expires}
+	The keys in the dict are a snapshot, while 'RefreshableCredentials' (used by get_aws_client and aws_acct_access)
+	assumes the role again when the credentials get close to their expiration - so long-running work can keep going.
+	If none of the roles work, the dict has 'Success' set to False, and 'Throttled' set to True if STS throttled us,
+	in which case it's worth trying again a little later.
 	"""
 	import logging
 	from botocore.exceptions import ClientError
@@ -685,7 +1866,6 @@ def get_child_access3(faws_acct, fChildAccount, fRegion='us-east-1', fRoleList=N
 		fChildAccount = str(fChildAccount)
 	org_status = faws_acct.AccountType
 	ParentAccountId = faws_acct.acct_number
-	sts_client = faws_acct.session.client('sts', region_name=fRegion)
 	if fChildAccount == ParentAccountId:
 		explain_string = (f"We're trying to get access to either the Root Account (which we already have access "
 						  f"to via the profile) or we're trying to gain access to a Standalone account. "
@@ -693,19 +1873,21 @@ def get_child_access3(faws_acct, fChildAccount, fRegion='us-east-1', fRoleList=N
 						  f"instead of trying to do anything fancy.")
 		logging.info(explain_string)
 		# TODO: Wrap this in a try/except loop on the off-chance that the class doesn't work properly
+		parent_credentials = faws_acct.creds  # A consistent snapshot, in case they refresh while we're reading them
 		account_credentials = {'ParentAcctId'   : ParentAccountId,
 							   'MgmtAccount'    : ParentAccountId,
 							   'OrgType'        : org_status,
-							   'AccessKeyId'    : faws_acct.creds.access_key,
-							   'SecretAccessKey': faws_acct.creds.secret_key,
-							   'SessionToken'   : faws_acct.creds.token,
+							   'AccessKeyId'    : parent_credentials.access_key,
+							   'SecretAccessKey': parent_credentials.secret_key,
+							   'SessionToken'   : parent_credentials.token,
 							   'AccountNumber'  : fChildAccount,
 							   'AccountId'      : fChildAccount,
 							   'Region'         : fRegion,
 							   'Role'           : 'Use Profile',
 							   'AccessError'    : False,
 							   'Success'        : True,
-							   'ErrorMessage'   : None}
+							   'ErrorMessage'   : None,
+							   'RefreshableCredentials': faws_acct.session._session.get_credentials()}
 		return (account_credentials)
 	if fRoleList is None:
 		fRoleList = ['AWSCloudFormationStackSetExecutionRole', 'AWSControlTowerExecution',
@@ -713,6 +1895,8 @@ def get_child_access3(faws_acct, fChildAccount, fRegion='us-east-1', fRoleList=N
 	# Initializing the "Negative Use Case" string, returning the whole list instead of only the last role it tried.
 	# This way the operator knows that NONE of the roles supplied worked.
 	return_string = f"{str(fRoleList)} failed. Try Again"
+	fRoleList = _order_roles_by_preference(ParentAccountId, fChildAccount, fRoleList)
+	learned_role = get_learned_roles(ParentAccountId).get(fChildAccount)
 	account_credentials = {'ParentAcctId'   : ParentAccountId,
 						   'MgmtAccount'    : ParentAccountId,
 						   'OrgType'        : org_status,
@@ -726,6 +1910,30 @@ def get_child_access3(faws_acct, fChildAccount, fRegion='us-east-1', fRoleList=N
 						   'AccessError'    : False,
 						   'Success'        : False,
 						   'ErrorMessage'   : None}
+	if fUseCache:
+		for role in fRoleList:
+			cached_credentials = _get_cached_credentials(ParentAccountId, fChildAccount, role)
+			if cached_credentials is not None:
+				logging.info(f"Using cached credentials for account {fChildAccount} and role name {role}")
+				account_credentials.update(cached_credentials)
+				account_credentials['AccountNumber'] = fChildAccount
+				account_credentials['AccountId'] = fChildAccount
+				account_credentials['Role'] = role
+				account_credentials['Success'] = True
+				account_credentials['RefreshableCredentials'] = _make_refreshable_credentials(faws_acct, fChildAccount, role, fRegion,
+																							  cached_credentials, fUseCache)
+				with _cache_lock:
+					_credential_cache_stats['Hits'] += 1
+				return (account_credentials)
+		with _cache_lock:
+			_credential_cache_stats['Misses'] += 1
+	if fUseCache:
+		SkippedRoles = [role for role in fRoleList if is_role_inaccessible(ParentAccountId, fChildAccount, role)]
+		if len(SkippedRoles) > 0:
+			logging.info(f"Skipping roles {SkippedRoles} for account {fChildAccount}, since they recently failed")
+			fRoleList = [role for role in fRoleList if role not in SkippedRoles]
+	sts_client = _get_sts_client(faws_acct)
+	throttled = False
 	for role in fRoleList:
 		try:
 			if faws_acct.session.profile_name:
@@ -749,9 +1957,28 @@ def get_child_access3(faws_acct, fChildAccount, fRegion='us-east-1', fRoleList=N
 			account_credentials['AccessError'] = False
 			account_credentials['ErrorMessage'] = None
 			account_credentials['Success'] = True
+			account_credentials['RefreshableCredentials'] = _make_refreshable_credentials(faws_acct, fChildAccount, role, fRegion,
+																						  account_credentials, fUseCache)
+			if fUseCache:
+				_put_cached_credentials(ParentAccountId, fChildAccount, role, account_credentials)
+			_update_learned_role(ParentAccountId, fChildAccount, role)
+			_forget_dead_end(f"Role:{ParentAccountId}:{fChildAccount}:{role}")
+			if fSaveCache:
+				save_caches()
 			return (account_credentials)
 		except ClientError as my_Error:
 			logging.info(my_Error)
+			if _is_throttling_error(my_Error):
+				# STS is throttling the management account, so trying the other roles now would only make it worse
+				logging.warning(f"Throttled while trying to access account {fChildAccount} using role {role}")
+				throttled = True
+				break
+			if role == learned_role:
+				logging.info(f"Role {role} no longer works for account {fChildAccount}, so we're forgetting it")
+				_update_learned_role(ParentAccountId, fChildAccount, None)
+			# Only a denial means the role's a dead end - anything else (an internal error, say) is worth trying again next time
+			if my_Error.response['Error']['Code'] == 'AccessDenied':
+				record_inaccessible_role(ParentAccountId, fChildAccount, role, my_Error.response['Error']['Code'])
 			continue
 		except Exception as my_Error:
 			logging.info(my_Error)
@@ -761,17 +1988,16 @@ def get_child_access3(faws_acct, fChildAccount, fRegion='us-east-1', fRoleList=N
 	logging.debug(f"Failure:\n"
 				  f"Role list: {fRoleList}\n"
 				  f"account credentials: {account_credentials}")
-	account_credentials = {'AccessError': True, 'Success': False, 'ErrorMessage': "Access Failed"}
+	account_credentials = {'AccessError': True, 'Success': False, 'ErrorMessage': "Access Failed", 'Throttled': throttled}
+	if fSaveCache:
+		save_caches()
 	return (account_credentials)
 
 
 def enable_drift_on_stacks2(ocredentials, fRegion, fStackName):
-	import boto3
 	import logging
 
-	session_cfn = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-		'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	client_cfn = session_cfn.client('cloudformation')
+	client_cfn = get_aws_client(ocredentials, 'cloudformation', fRegion)
 	logging.warning(f"Enabling drift detection on Stack {fStackName} in "
 					f"Account {ocredentials['AccountNumber']} in region {fRegion}")
 	response = client_cfn.detect_stack_drift(StackName=fStackName)
@@ -784,6 +2010,25 @@ Below - Specific functions to specific features
 """
 
 
+def iter_pages(ocredentials, fService, fRegion, fOperation, fResultKey, **kwargs):
+	"""
+	ocredentials is a credentials dict (see get_aws_client)
+	fService, fOperation are the boto3 names of the service and call (like 'ec2' and 'describe_instances')
+	fResultKey is the key in each page that holds the items (like 'Reservations')
+	kwargs are passed on to the call
+
+	Yields the list of items from each page, as soon as that page arrives - so whoever's reading them can get on with
+	the first page while we fetch the next, and only ever needs to hold one page in memory.
+	If the call can't be paginated, its one response is the only page.
+	"""
+	client = get_aws_client(ocredentials, fService, fRegion)
+	if client.can_paginate(fOperation):
+		for page in client.get_paginator(fOperation).paginate(**kwargs):
+			yield (page.get(fResultKey, []))
+	else:
+		yield (getattr(client, fOperation)(**kwargs).get(fResultKey, []))
+
+
 def find_sns_topics2(ocredentials, fRegion, fTopicFrag=None):
 	"""
 	ocredentials is an object with the following structure:
@@ -795,37 +2040,47 @@ def find_sns_topics2(ocredentials, fRegion, fTopicFrag=None):
 	Returns:
 		List of Topic ARNs found that match the fragment sent
 """
-	import boto3
 	import logging
 	if fTopicFrag is None:
 		fTopicFrag = ['all']
-	session_sns = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
-								aws_secret_access_key=ocredentials['SecretAccessKey'],
-								aws_session_token=ocredentials['SessionToken'],
-								region_name=fRegion)
-	client_sns = session_sns.client('sns')
-	# TODO: Enable pagination
-	response = client_sns.list_topics()
-	TopicList = []
-	for item in response['Topics']:
-		TopicList.append(item['TopicArn'])
 	if 'all' in fTopicFrag:
 		logging.warning(f"Looking for all SNS Topics in account {ocredentials['AccountNumber']} from Region {fRegion}")
-		logging.info(f"Topic Arns Returned: {TopicList}")
-		logging.warning(f"We found {len(TopicList)} SNS Topics")
-		return (TopicList)
 	else:
 		logging.warning(
 			f"Looking for specific SNS Topics in account {ocredentials['AccountNumber']} from Region {fRegion}")
-		topic_list2 = []
-		for item in fTopicFrag:
-			for topic in TopicList:
-				logging.info(f"Have {topic} | Looking for {item}")
-				if topic.find(item) >= 0:
-					logging.error(f"Found {topic}")
-					topic_list2.append(topic)
-		logging.warning(f"We found {len(topic_list2)} SNS Topics", )
-		return (topic_list2)
+	return (list(iter_sns_topics2(ocredentials, fRegion, fTopicFrag)))
+
+
+def iter_sns_topics2(ocredentials, fRegion, fTopicFrag=None):
+	"""
+	The streaming version of find_sns_topics2 - yields each matching Topic ARN, a page at a time.
+	"""
+	for page in iter_pages(ocredentials, 'sns', fRegion, 'list_topics', 'Topics'):
+		yield from select_sns_topics([item['TopicArn'] for item in page], fTopicFrag)
+
+
+def select_sns_topics(fTopicList, fTopicFrag=None):
+	"""
+	fTopicList is a list of Topic ARNs
+	fTopicFrag is a list of fragments to look for ("all" keeps every topic)
+
+	Returns:
+		List of Topic ARNs that match the fragment sent
+	"""
+	import logging
+	if fTopicFrag is None or 'all' in fTopicFrag:
+		logging.info(f"Topic Arns Returned: {fTopicList}")
+		logging.warning(f"We found {len(fTopicList)} SNS Topics")
+		return (fTopicList)
+	topic_list2 = []
+	for item in fTopicFrag:
+		for topic in fTopicList:
+			logging.info(f"Have {topic} | Looking for {item}")
+			if topic.find(item) >= 0:
+				logging.error(f"Found {topic}")
+				topic_list2.append(topic)
+	logging.warning(f"We found {len(topic_list2)} SNS Topics", )
+	return (topic_list2)
 
 
 def find_role_names2(ocredentials, fRegion, fRoleNameFrag=None):
@@ -839,15 +2094,10 @@ def find_role_names2(ocredentials, fRegion, fRoleNameFrag=None):
 	Returns:
 		List of Role Names found that match the fragment list sent
 	"""
-	import boto3
 	import logging
 	if fRoleNameFrag is None:
 		fRoleNameFrag = ['all']
-	session_iam = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
-								aws_secret_access_key=ocredentials['SecretAccessKey'],
-								aws_session_token=ocredentials['SessionToken'],
-								region_name=fRegion)
-	client_iam = session_iam.client('iam')
+	client_iam = get_aws_client(ocredentials, 'iam', fRegion)
 	# TODO: Enable pagination
 	response = client_iam.list_roles()['Roles']
 	RoleNameList = []
@@ -883,15 +2133,10 @@ def find_cw_log_group_names2(ocredentials, fRegion, fCWLogGroupFrag=None):
 	Returns:
 		List of CloudWatch Log Group Names found that match the fragment list
 """
-	import boto3
 	import logging
 	if fCWLogGroupFrag is None:
 		fCWLogGroupFrag = ['all']
-	session_cw = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
-							   aws_secret_access_key=ocredentials['SecretAccessKey'],
-							   aws_session_token=ocredentials['SessionToken'],
-							   region_name=fRegion)
-	client_cw = session_cw.client('logs')
+	client_cw = get_aws_client(ocredentials, 'logs', fRegion)
 	# TODO: Enable pagination # Defaults to 50
 	CWLogGroupList = []
 	FirstTime = True
@@ -932,12 +2177,9 @@ def find_account_vpcs2(ocredentials, fRegion, defaultOnly=False):
 		- ['SessionToken'] holds the AWS_SESSION_TOKEN
 		- ['AccountNumber'] holds the account number
 	"""
-	import boto3
 	import logging
 
-	session_vpc = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-		'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	client_vpc = session_vpc.client('ec2')
+	client_vpc = get_aws_client(ocredentials, 'ec2', fRegion)
 	if defaultOnly:
 		logging.warning("Looking for default VPCs in account %s from Region %s", ocredentials['AccountNumber'], fRegion)
 		logging.info("defaultOnly: %s", str(defaultOnly))
@@ -996,11 +2238,8 @@ def find_config_recorders2(ocredentials, fRegion):
 
 	Pagination isn't an issue here since only one config recorder per account / region is allowed.
 	"""
-	import boto3
 	import logging
-	session_cfg = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-		'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	client_cfg = session_cfg.client('config')
+	client_cfg = get_aws_client(ocredentials, 'config', fRegion)
 	logging.warning("Looking for Config Recorders in account %s from Region %s", ocredentials['AccountNumber'], fRegion)
 	response = client_cfg.describe_configuration_recorders()
 	# logging.info(response)
@@ -1017,11 +2256,8 @@ def del_config_recorder2(ocredentials, fRegion, fConfig_recorder_name):
 	fRegion = region
 	fConfig_recorder_name = Config Recorder Name
 	"""
-	import boto3
 	import logging
-	session_cfg = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-		'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	client_cfg = session_cfg.client('config')
+	client_cfg = get_aws_client(ocredentials, 'config', fRegion)
 	logging.error("Deleting Config Recorder %s from Region %s in account %s", fConfig_recorder_name, fRegion,
 				  ocredentials['AccountNumber'])
 	response = client_cfg.delete_configuration_recorder(ConfigurationRecorderName=fConfig_recorder_name)
@@ -1053,12 +2289,9 @@ def find_delivery_channels2(ocredentials, fRegion):
 
 	Pagination isn't an issue here since delivery channels are limited to only one / account / region
 	"""
-	import boto3
 	import logging
 
-	session_cfg = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-		'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	client_cfg = session_cfg.client('config')
+	client_cfg = get_aws_client(ocredentials, 'config', fRegion)
 	logging.warning("Looking for Delivery Channels in account %s from Region %s",
 					ocredentials['AccountNumber'], fRegion)
 
@@ -1076,12 +2309,9 @@ def del_delivery_channel2(ocredentials, fRegion, fDelivery_channel_name):
 	rRegion = region
 	fDelivery_channel_name = delivery channel name
 	"""
-	import boto3
 	import logging
 
-	session_cfg = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-		'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	client_cfg = session_cfg.client('config')
+	client_cfg = get_aws_client(ocredentials, 'config', fRegion)
 	logging.error("Deleting Delivery Channel %s from Region %s in account %s", fDelivery_channel_name, fRegion,
 				  ocredentials['AccountNumber'])
 	response = client_cfg.delete_delivery_channel(DeliveryChannelName=fDelivery_channel_name)
@@ -1123,15 +2353,10 @@ def find_cloudtrails2(ocredentials, fRegion, fCloudTrailnames=None):
 	}
 	CTtrails = Inventory_Modules.find_cloudtrails(account_creds, 'us-east-1', ['AWS-Landing-Zone-BaselineCloudTrail'])
 	"""
-	import boto3
 	import logging
 	from botocore.exceptions import ClientError
 
-	session_ct = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
-							   aws_secret_access_key=ocredentials['SecretAccessKey'],
-							   aws_session_token=ocredentials['SessionToken'],
-							   region_name=fRegion)
-	client_ct = session_ct.client('cloudtrail')
+	client_ct = get_aws_client(ocredentials, 'cloudtrail', fRegion)
 	logging.info(f"Looking for CloudTrail trails in account {ocredentials['AccountNumber']} from Region {fRegion}")
 	fullresponse = []
 	if fCloudTrailnames is None or len(
@@ -1176,12 +2401,9 @@ def del_cloudtrails2(ocredentials, fRegion, fCloudTrail):
 	fRegion = region
 	fCloudTrail = CloudTrail we're deleting
 	"""
-	import boto3
 	import logging
 
-	session_ct = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-		'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	client_ct = session_ct.client('cloudtrail')
+	client_ct = get_aws_client(ocredentials, 'cloudtrail', fRegion)
 	logging.info("Deleting CloudTrail %s in account %s from Region %s", fCloudTrail,
 				 ocredentials['AccountNumber'], fRegion)
 	response = client_ct.delete_trail(Name=fCloudTrail)
@@ -1197,14 +2419,11 @@ def find_gd_invites2(ocredentials, fRegion):
 		- ['AccountNumber'] holds the account number
 	fRegion = region
 	"""
-	import boto3
 	import logging
 
 	from botocore.exceptions import ClientError
 
-	session_gd = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-		'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	client_gd = session_gd.client('guardduty')
+	client_gd = get_aws_client(ocredentials, 'guardduty', fRegion)
 	logging.info("Looking for GuardDuty invitations in account %s from Region %s",
 				 ocredentials['AccountNumber'], fRegion)
 	try:
@@ -1231,14 +2450,11 @@ def delete_gd_invites2(ocredentials, fRegion, fAccountId):
 		- ['AccountNumber'] holds the account number
 	fRegion = region
 	"""
-	import boto3
 	import logging
 
 	from botocore.exceptions import ClientError
 
-	session_gd = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-		'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	client_gd = session_gd.client('guardduty')
+	client_gd = get_aws_client(ocredentials, 'guardduty', fRegion)
 	logging.info("Looking for GuardDuty invitations in account %s in Region %s",
 				 ocredentials['AccountNumber'], fRegion)
 	try:
@@ -1263,31 +2479,18 @@ def find_account_instances2(ocredentials, fRegion='us-east-1'):
 		- ['AccountNumber'] holds the account number
 		- ['Profile'] can hold the profile, instead of the session credentials
 	"""
-	import boto3
 	import logging
 
-	if 'Profile' in ocredentials.keys() and ocredentials['Profile'] is not None:
-		ProfileAccountNumber = find_account_number(ocredentials['Profile'])
-		logging.info(
-			f"Profile: {ocredentials['Profile']} | Profile Account Number: {ProfileAccountNumber} | Account Number passed in: {ocredentials['AccountNumber']}")
-		if ProfileAccountNumber == ocredentials['AccountNumber']:
-			session_ec2 = boto3.Session(profile_name=ocredentials['Profile'], region_name=fRegion)
-		else:
-			session_ec2 = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
-										aws_secret_access_key=ocredentials['SecretAccessKey'],
-										aws_session_token=ocredentials['SessionToken'],
-										region_name=fRegion)
-	else:
-		session_ec2 = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-			'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	instance_info = session_ec2.client('ec2')
 	logging.warning("Looking for instances in account # %s in region %s", ocredentials['AccountNumber'], fRegion)
-	instances = instance_info.describe_instances()
-	AllInstances = instances
-	while 'NextToken' in instances.keys():
-		instances = instance_info.describe_instances(NextToken=instances['NextToken'])
-		AllInstances['Reservations'].extend(instances['Reservations'])
-	return (AllInstances)
+	return ({'Reservations': list(iter_account_instances2(ocredentials, fRegion))})
+
+
+def iter_account_instances2(ocredentials, fRegion='us-east-1'):
+	"""
+	The streaming version of find_account_instances2 - yields each reservation, a page at a time.
+	"""
+	for page in iter_pages(ocredentials, 'ec2', fRegion, 'describe_instances', 'Reservations'):
+		yield from page
 
 
 def find_cw_groups_retention2(ocredentials, fRegion='us-east-1'):
@@ -1299,33 +2502,20 @@ def find_cw_groups_retention2(ocredentials, fRegion='us-east-1'):
 		- ['AccountNumber'] holds the account number
 		- ['Profile'] can hold the profile, instead of the session credentials
 	"""
-	import boto3
 	import logging
 
-	if 'Profile' in ocredentials.keys() and ocredentials['Profile'] is not None:
-		ProfileAccountNumber = find_account_number(ocredentials['Profile'])
-		logging.info(
-			f"Profile: {ocredentials['Profile']} | Profile Account Number: {ProfileAccountNumber} | Account Number passed in: {ocredentials['AccountNumber']}")
-		if ProfileAccountNumber == ocredentials['AccountNumber']:
-			session_cw = boto3.Session(profile_name=ocredentials['Profile'], region_name=fRegion)
-		else:
-			session_cw = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
-									   aws_secret_access_key=ocredentials['SecretAccessKey'],
-									   aws_session_token=ocredentials['SessionToken'],
-									   region_name=fRegion)
-	else:
-		session_cw = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-			'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	log_group_info = session_cw.client('logs')
 	logging.warning(f"Looking for cw_groups in account # {ocredentials['AccountNumber']} in region {fRegion}")
-	log_groups = log_group_info.describe_log_groups()
 	# TODO: Will need to add some kind of string fragment filter here later
 	# TODO: Also want to add a "retention filter" here as well to only find log groups matching a certain retention period
-	AllLogGroups = log_groups
-	while 'NextToken' in log_groups.keys():
-		log_groups = log_group_info.describe_instances(NextToken=log_groups['NextToken'])
-		AllLogGroups['logGroups'].extend(log_groups['logGroups'])
-	return (AllLogGroups)
+	return ({'logGroups': list(iter_cw_groups_retention2(ocredentials, fRegion))})
+
+
+def iter_cw_groups_retention2(ocredentials, fRegion='us-east-1'):
+	"""
+	The streaming version of find_cw_groups_retention2 - yields each log group, a page at a time.
+	"""
+	for page in iter_pages(ocredentials, 'logs', fRegion, 'describe_log_groups', 'logGroups'):
+		yield from page
 
 
 def find_account_rds_instances2(ocredentials, fRegion='us-east-1'):
@@ -1337,31 +2527,18 @@ def find_account_rds_instances2(ocredentials, fRegion='us-east-1'):
 		- ['AccountNumber'] holds the account number
 		- ['Profile'] can hold the profile, instead of the session credentials
 	"""
-	import boto3
 	import logging
 
-	if 'Profile' in ocredentials.keys() and ocredentials['Profile'] is not None:
-		ProfileAccountNumber = find_account_number(ocredentials['Profile'])
-		logging.info(
-			f"Profile: {ocredentials['Profile']} | Profile Account Number: {ProfileAccountNumber} | Account Number passed in: {ocredentials['AccountNumber']}")
-		if ProfileAccountNumber == ocredentials['AccountNumber']:
-			session_rds = boto3.Session(profile_name=ocredentials['Profile'], region_name=fRegion)
-		else:
-			session_rds = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
-										aws_secret_access_key=ocredentials['SecretAccessKey'],
-										aws_session_token=ocredentials['SessionToken'],
-										region_name=fRegion)
-	else:
-		session_rds = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-			'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	instance_info = session_rds.client('rds')
 	logging.warning(f"Looking for RDS instances in account #{ocredentials['AccountNumber']} in region {fRegion}")
-	instances = instance_info.describe_db_instances()
-	AllInstances = instances
-	while 'NextToken' in instances.keys():
-		instances = instance_info.describe_db_instances(NextToken=instances['NextToken'])
-		AllInstances['DBInstances'].extend(instances['DBInstances'])
-	return (AllInstances)
+	return ({'DBInstances': list(iter_account_rds_instances2(ocredentials, fRegion))})
+
+
+def iter_account_rds_instances2(ocredentials, fRegion='us-east-1'):
+	"""
+	The streaming version of find_account_rds_instances2 - yields each DB instance, a page at a time.
+	"""
+	for page in iter_pages(ocredentials, 'rds', fRegion, 'describe_db_instances', 'DBInstances'):
+		yield from page
 
 
 def find_account_cloudtrail2(ocredentials, fRegion='us-east-1'):
@@ -1373,24 +2550,9 @@ def find_account_cloudtrail2(ocredentials, fRegion='us-east-1'):
 		- ['AccountNumber'] holds the account number
 		- ['Profile'] can hold the profile, instead of the session credentials
 	"""
-	import boto3
 	import logging
 
-	if 'Profile' in ocredentials.keys() and ocredentials['Profile'] is not None:
-		ProfileAccountNumber = find_account_number(ocredentials['Profile'])
-		logging.info(
-			f"Profile: {ocredentials['Profile']} | Profile Account Number: {ProfileAccountNumber} | Account Number passed in: {ocredentials['AccountNumber']}")
-		if ProfileAccountNumber == ocredentials['AccountNumber']:
-			session_ct = boto3.Session(profile_name=ocredentials['Profile'], region_name=fRegion)
-		else:
-			session_ct = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
-									   aws_secret_access_key=ocredentials['SecretAccessKey'],
-									   aws_session_token=ocredentials['SessionToken'],
-									   region_name=fRegion)
-	else:
-		session_ct = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-			'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	instance_info = session_ct.client('cloudtrail')
+	instance_info = get_aws_client(ocredentials, 'cloudtrail', fRegion)
 	logging.warning(f"Looking for CloudTrail logging in account #{ocredentials['AccountNumber']} in region {fRegion}")
 	Trails = instance_info.describe_trails(trailNameList=[], includeShadowTrails=True)
 	AllTrails = Trails
@@ -1408,27 +2570,12 @@ def find_account_subnets2(ocredentials, fRegion='us-east-1', fipaddresses=None):
 		- ['SessionToken'] holds the AWS_SESSION_TOKEN
 		- ['AccountNumber'] holds the account number
 		- ['Profile'] can hold the profile, instead of the session credentials
-	"""
-	import boto3
-	from botocore.exceptions import ClientError
-	import logging
-	import ipaddress
-
-	if 'Profile' in ocredentials.keys() and ocredentials['Profile'] is not None:
-		ProfileAccountNumber = find_account_number(ocredentials['Profile'])
-		logging.info(
-			f"Profile: {ocredentials['Profile']} | Profile Account Number: {ProfileAccountNumber} | Account Number passed in: {ocredentials['AccountNumber']}")
-		if ProfileAccountNumber == ocredentials['AccountNumber']:
-			session_ec2 = boto3.Session(profile_name=ocredentials['Profile'], region_name=fRegion)
-		else:
-			session_ec2 = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
-										aws_secret_access_key=ocredentials['SecretAccessKey'],
-										aws_session_token=ocredentials['SessionToken'],
-										region_name=fRegion)
-	else:
-		session_ec2 = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-			'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'], region_name=fRegion)
-	subnet_info = session_ec2.client('ec2')
+	"""
+	from botocore.exceptions import ClientError
+	import logging
+	import ipaddress
+
+	subnet_info = get_aws_client(ocredentials, 'ec2', fRegion)
 	Subnets = {'NextToken': None}
 	AllSubnets = {'Subnets': []}
 
@@ -1464,13 +2611,10 @@ def find_users2(ocredentials):
 		- ['SecretAccessKey'] holds the AWS_SECRET_ACCESS_KEY
 		- ['SessionToken'] holds the AWS_SESSION_TOKEN
 	"""
-	import boto3
 	import logging
 
 	logging.warning("Key ID #: %s ", str(ocredentials['AccessKeyId']))
-	session_iam = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'], aws_secret_access_key=ocredentials[
-		'SecretAccessKey'], aws_session_token=ocredentials['SessionToken'])
-	user_info = session_iam.client('iam')
+	user_info = get_aws_client(ocredentials, 'iam', None)
 	users = user_info.list_users()['Users']
 	# TODO: Consider pagination here
 	return (users)
@@ -1505,30 +2649,35 @@ def find_lambda_functions2(ocredentials, fRegion='us-east-1', fSearchStrings=Non
 	fRegion is a string
 	fSearchString is a list of strings
 	"""
-	import boto3
+	return (list(iter_lambda_functions2(ocredentials, fRegion, fSearchStrings)))
+
+
+def iter_lambda_functions2(ocredentials, fRegion='us-east-1', fSearchStrings=None):
+	"""
+	The streaming version of find_lambda_functions2 - yields each matching function, a page at a time.
+	"""
+	for page in iter_pages(ocredentials, 'lambda', fRegion, 'list_functions', 'Functions'):
+		yield from select_lambda_functions(page, fSearchStrings)
+
+
+def select_lambda_functions(fFunctions, fSearchStrings=None):
+	"""
+	fFunctions is the 'Functions' list from lambda's list_functions
+	fSearchString is a list of strings
+
+	Returns the functions whose names contain any of the search strings (or all of them, for "all"), trimmed down
+	to their name, ARN, role and runtime.
+	"""
 	import logging
-	session_lambda = boto3.Session(region_name=fRegion, aws_access_key_id=ocredentials[
-		'AccessKeyId'], aws_secret_access_key=ocredentials['SecretAccessKey'], aws_session_token=ocredentials[
-		'SessionToken'])
-	client_lambda = session_lambda.client('lambda')
-	functions = client_lambda.list_functions()['Functions']
 	functions2 = []
-	if fSearchStrings is None or 'all' in fSearchStrings:
-		for i in range(len(functions)):
-			logging.warning(f"Found function {functions[i]['FunctionName']}")
-			functions2.append({'FunctionName': functions[i]['FunctionName'],
-							   'FunctionArn' : functions[i]['FunctionArn'],
-							   'Role'        : functions[i]['Role'], 'Runtime': functions[i]['Runtime']})
-		return (functions2)
-	else:
-		for i in range(len(functions)):
-			for searchitem in fSearchStrings:
-				if searchitem in functions[i]['FunctionName']:
-					logging.warning(f"Found function {functions[i]['FunctionName']}")
-					functions2.append({'FunctionName': functions[i]['FunctionName'],
-									   'FunctionArn' : functions[i]['FunctionArn'], 'Role': functions[i]['Role'],
-									   'Runtime'     : functions[i]['Runtime']})
-		return (functions2)
+	for function in fFunctions:
+		if fSearchStrings is None or 'all' in fSearchStrings or \
+				any([searchitem in function['FunctionName'] for searchitem in fSearchStrings]):
+			logging.warning(f"Found function {function['FunctionName']}")
+			functions2.append({'FunctionName': function['FunctionName'],
+							   'FunctionArn' : function['FunctionArn'],
+							   'Role'        : function['Role'], 'Runtime': function['Runtime']})
+	return (functions2)
 
 
 def find_lambda_functions3(faws_acct, fRegion='us-east-1', fSearchStrings=None):
@@ -1643,7 +2792,8 @@ def find_private_hosted_zones(fProfile, fRegion):
 
 def find_private_hosted_zones3(faws_acct, fRegion=None):
 	"""
-	This library script returns the hosted zones within an account and a region
+	This library script returns the hosted zones within an account. Route 53 is a global service, so the zones are the
+	same whichever region is given - it only picks the endpoint we ask.
 	"""
 	import logging
 
@@ -1856,15 +3006,10 @@ def find_stacks2(ocredentials, fRegion, fStackFragment="all", fStatus="active"):
 	fStatus is a string - default to "active"
 	"""
 
-	import boto3
 	import logging
 	logging.error(
 		f"Acct ID #: {str(ocredentials['AccountNumber'])} | Region: {fRegion} | Fragment: {fStackFragment} | Status: {fStatus}")
-	session_cfn = boto3.Session(region_name=fRegion,
-								aws_access_key_id=ocredentials['AccessKeyId'],
-								aws_secret_access_key=ocredentials['SecretAccessKey'],
-								aws_session_token=ocredentials['SessionToken'])
-	client_cfn = session_cfn.client('cloudformation')
+	client_cfn = get_aws_client(ocredentials, 'cloudformation', fRegion)
 	stacks = dict()
 	stacksCopy = []
 	if fStatus.lower() == 'active' and not fStackFragment.lower() == 'all':
@@ -2096,18 +3241,13 @@ def delete_stack2(ocredentials, fRegion, fStackName, **kwargs):
 	RetainResources should be a boolean
 	ResourcesToRetain should be a list
 	"""
-	import boto3
 	import logging
 	RetainResources = False
 	ResourcesToRetain = []
 	if "RetainResources" in kwargs:
 		RetainResources = True
 		ResourcesToRetain = kwargs['ResourcesToRetain']
-	session_cfn = boto3.Session(region_name=fRegion,
-								aws_access_key_id=ocredentials['AccessKeyId'],
-								aws_secret_access_key=ocredentials['SecretAccessKey'],
-								aws_session_token=ocredentials['SessionToken'])
-	client_cfn = session_cfn.client('cloudformation')
+	client_cfn = get_aws_client(ocredentials, 'cloudformation', fRegion)
 	if RetainResources:
 		logging.warning("Account: %s | Region: %s | StackName: %s", ocredentials['AccountNumber'], fRegion, fStackName)
 		logging.warning("	Retaining Resources: %s", ResourcesToRetain)
@@ -2210,6 +3350,7 @@ def find_stacks_in_acct3(faws_acct, fRegion, fStackFragment="all", fStatus="acti
 	return (stacksCopy)
 
 
+@global_collector
 def find_saml_components_in_acct2(ocredentials, fRegion):
 	"""
 	ocredentials is an object with the following structure:
@@ -2220,14 +3361,9 @@ def find_saml_components_in_acct2(ocredentials, fRegion):
 
 	fRegion is a string
 	"""
-	import boto3
 	import logging
 	logging.info(f"Acct ID #: {str(ocredentials['AccountNumber'])} | Region: {fRegion}")
-	session_aws = boto3.Session(region_name=fRegion,
-								aws_access_key_id=ocredentials['AccessKeyId'],
-								aws_secret_access_key=ocredentials['SecretAccessKey'],
-								aws_session_token=ocredentials['SessionToken'])
-	iam_info = session_aws.client('iam')
+	iam_info = get_aws_client(ocredentials, 'iam', fRegion)
 	saml_providers = iam_info.list_saml_providers()['SAMLProviderList']
 	return (saml_providers)
 
@@ -2252,16 +3388,11 @@ def find_stacksets2(ocredentials, fRegion='us-east-1', fStackFragment=None, fSta
 	},
 	]
 	"""
-	import boto3
 	import logging
 
 	logging.info(
 		f"Account ID: {ocredentials['AccountId']} | Region: {fRegion} | Fragment: {fStackFragment} | Status: {fStatus}")
-	session_aws = boto3.Session(region_name=fRegion,
-								aws_access_key_id=ocredentials['AccessKeyId'],
-								aws_secret_access_key=ocredentials['SecretAccessKey'],
-								aws_session_token=ocredentials['SessionToken'])
-	client_cfn = session_aws.client('cloudformation')
+	client_cfn = get_aws_client(ocredentials, 'cloudformation', fRegion)
 	logging.info(f'Creds: {ocredentials}')
 	stacksets2 = []
 	# TODO: Need to enable paging here
@@ -2439,14 +3570,9 @@ def find_stack_instances2(ocredentials, fRegion, fStackSetName, fStatus='CURRENT
 	fStatus is a string, but isn't currently used.
 	TODO: Decide whether to use fStatus, or not
 	"""
-	import boto3
 	import logging
 	logging.info(f"Acct ID #: {str(ocredentials['AccountNumber'])} | Region: {fRegion}")
-	session_aws = boto3.Session(region_name=fRegion,
-								aws_access_key_id=ocredentials['AccessKeyId'],
-								aws_secret_access_key=ocredentials['SecretAccessKey'],
-								aws_session_token=ocredentials['SessionToken'])
-	client_cfn = session_aws.client('cloudformation')
+	client_cfn = get_aws_client(ocredentials, 'cloudformation', fRegion)
 	stack_instances = client_cfn.list_stack_instances(StackSetName=fStackSetName)
 	stack_instances_list = stack_instances['Summaries']
 	while 'NextToken' in stack_instances.keys():  # Get all instance names
@@ -2734,71 +3860,117 @@ def find_ssm_parameters(fProfile, fRegion):
 ############
 
 
-def get_credentials_for_accounts_in_org(faws_acct, fSkipAccounts=[], fRootOnly=False):
+CREDENTIAL_WORKERS = 10  # How many accounts we try to get credentials for at the same time, unless told otherwise
+CREDENTIAL_RETRIES = 5  # How many times we back off and try again when STS throttles us for one account
+# One pool per size asked for, so a caller with a pool in hand never has it shut down under them. 'MaxWorkers' is the largest size asked for.
+_credential_pool = {'Executors': dict(), 'MaxWorkers': None}
+_credential_pool_lock = threading.Lock()
+
+
+class _AdaptiveLimit:
 	"""
-	Note that this function returns the credentials of all the accounts underneath the Org passed to it.
+	A semaphore whose limit halves every time AWS throttles one of the callers, and then grows back by one
+	after every fRampUp successes in a row, until it's back to fMaxLimit.
 	"""
-	import logging
-	from queue import Queue
-	from threading import Thread
-	from botocore.exceptions import ClientError
 
-	class AssembleCredentials(Thread):
+	def __init__(self, fMaxLimit, fRampUp=5):
+		self.max_limit = fMaxLimit
+		self.limit = fMaxLimit
+		self.ramp_up = fRampUp
+		self.active = 0
+		self.successes = 0
+		self.condition = threading.Condition()
+
+	def acquire(self):
+		with self.condition:
+			while self.active >= self.limit:
+				self.condition.wait()
+			self.active += 1
+
+	def release(self, fThrottled=False):
+		import logging
+
+		with self.condition:
+			self.active -= 1
+			if fThrottled:
+				self.limit = max(1, self.limit // 2)
+				self.successes = 0
+				logging.info(f"Throttled - dropping concurrency to {self.limit}")
+			else:
+				self.successes += 1
+				if self.successes >= self.ramp_up and self.limit < self.max_limit:
+					self.limit += 1
+					self.successes = 0
+					logging.info(f"Ramping concurrency back up to {self.limit}")
+			self.condition.notify_all()
 
-		def __init__(self, queue):
-			Thread.__init__(self)
-			self.queue = queue
 
-		def run(self):
-			while True:
-				# Get the work from the queue and expand the tuple
-				account_info = self.queue.get()
-				logging.info(f"De-queued info for account {account_info['AccountId']}")
-				try:
-					logging.info(f"Attempting to connect to {account_info['AccountId']}")
-					faccount_credentials = get_child_access3(faws_acct, account_info['AccountId'])
-					if faccount_credentials['Success']:
-						logging.info(f"Successfully connected to account {account_info['AccountId']}")
-					else:
-						logging.error(f"Error connecting to account {account_info['AccountId']}.\n"
-									  f"Error Message: {faccount_credentials['ErrorMessage']}")
-					AllCreds.append(faccount_credentials)
-				except ClientError as my_Error:
-					if str(my_Error).find("AuthFailure") > 0:
-						logging.error(f"{account['AccountId']}: Authorization failure using role: {account_credentials['Role']}")
-						logging.warning(my_Error)
-					elif str(my_Error).find("AccessDenied") > 0:
-						logging.error(f"{account['AccountId']}: Access Denied failure using role: {account_credentials['Role']}")
-						logging.warning(my_Error)
-					else:
-						logging.error(f"{account['AccountId']}: Other kind of failure using role: {account_credentials['Role']}")
-						logging.warning(my_Error)
-					continue
-				except KeyError as my_Error:
-					logging.error(f"Account Access failed - trying to access {account['AccountId']}")
-					logging.info(f"Actual Error: {my_Error}")
-					pass
-				except AttributeError as my_Error:
-					logging.error(f"Error: Likely that one of the supplied profiles was wrong")
-					logging.warning(my_Error)
-					continue
-				finally:
-					self.queue.task_done()
+def _get_credential_pool(fMaxWorkers):
+	"""
+	Returns the thread pool used by get_credentials_for_accounts_in_org. It's kept between calls, so running against
+	several profiles re-uses the same threads rather than starting a new batch for every Org.
+	Asking for a different size gets a pool of that size - the others are left running, since another thread may
+	still be handing work to them.
+	"""
+	from concurrent.futures import ThreadPoolExecutor
+
+	with _credential_pool_lock:
+		if fMaxWorkers not in _credential_pool['Executors']:
+			_credential_pool['Executors'][fMaxWorkers] = ThreadPoolExecutor(max_workers=fMaxWorkers, thread_name_prefix=f"credentials-{fMaxWorkers}")
+			_credential_pool['MaxWorkers'] = max(fMaxWorkers, _credential_pool['MaxWorkers'] or 0)
+		return (_credential_pool['Executors'][fMaxWorkers])
+
+
+def _get_child_access_with_backoff(faws_acct, fChildAccount, fRoleList, fLimit):
+	"""
+	Calls get_child_access3 within the adaptive limit, backing off (with jitter) and trying again when STS throttles us.
+	Adds the 'Latency' (in seconds) it took to get the credentials, including any time spent backing off.
+	"""
+	import logging
+	from random import uniform
+	from time import sleep, time
+
+	begin_time = time()
+	for attempt in range(CREDENTIAL_RETRIES + 1):
+		fLimit.acquire()
+		throttled = False
+		try:
+			faccount_credentials = get_child_access3(faws_acct, fChildAccount, fRoleList=fRoleList, fSaveCache=False)
+			throttled = faccount_credentials.get('Throttled', False)
+		finally:
+			fLimit.release(throttled)
+		if not throttled:
+			break
+		if attempt < CREDENTIAL_RETRIES:
+			delay = uniform(0, min(30, 2 ** attempt))
+			logging.warning(f"Throttled getting credentials for account {fChildAccount} - trying again in {delay:.1f} seconds")
+			sleep(delay)
+	faccount_credentials.setdefault('AccountId', fChildAccount)
+	faccount_credentials['Latency'] = time() - begin_time
+	return (faccount_credentials)
+
+
+def get_credentials_for_accounts_in_org(faws_acct, fSkipAccounts=[], fRootOnly=False, fRoleList=None, fMaxWorkers=None):
+	"""
+	Note that this function returns the credentials of all the accounts underneath the Org passed to it.
+	fRoleList is passed through to get_child_access3, which tries the role that last worked for each account first.
+	fMaxWorkers is the most accounts we'll try at the same time (defaults to CREDENTIAL_WORKERS). When STS throttles us,
+		we drop the concurrency and back off, and then ramp it back up once things calm down.
+
+	The credentials come back in the same order as the accounts in the Org, and each one has the 'Latency' (in seconds)
+	it took to get them.
+	"""
+	import logging
+	from botocore.exceptions import ClientError
 
+	if fMaxWorkers is None:
+		fMaxWorkers = CREDENTIAL_WORKERS
 	ChildAccounts = faws_acct.ChildAccounts
-	account_credentials = {'Role': 'Nothing'}
+	credential_pool = _get_credential_pool(fMaxWorkers)
+	limit = _AdaptiveLimit(fMaxWorkers)
 	AccountNum = 0
 	AllCreds = []
-	credqueue = Queue()
-	WorkerThreads = len(ChildAccounts) + 4
-
-	# Create x worker threads
-	for x in range(WorkerThreads):
-		worker = AssembleCredentials(credqueue)
-		# Setting daemon to True will let the main thread exit even though the workers are blocking
-		worker.daemon = True
-		worker.start()
-
+	credential_futures = []
 	for account in ChildAccounts:
 		if account['AccountId'] in fSkipAccounts:
 			continue
@@ -2806,120 +3978,1448 @@ def get_credentials_for_accounts_in_org(faws_acct, fSkipAccounts=[], fRootOnly=F
 			continue
 		AccountNum += 1
 		logging.info(f"Queuing account info for {AccountNum} / {len(ChildAccounts)} accounts")
-		credqueue.put(account)
-	credqueue.join()
+		credential_futures.append((account, credential_pool.submit(_get_child_access_with_backoff, faws_acct,
+																   account['AccountId'], fRoleList, limit)))
+	for account, credential_future in credential_futures:
+		try:
+			faccount_credentials = credential_future.result()
+			if faccount_credentials['Success']:
+				logging.info(f"Successfully connected to account {account['AccountId']} in {faccount_credentials['Latency']:.2f} seconds")
+			else:
+				logging.error(f"Error connecting to account {account['AccountId']}.\n"
+							  f"Error Message: {faccount_credentials['ErrorMessage']}")
+			AllCreds.append(faccount_credentials)
+		except ClientError as my_Error:
+			if str(my_Error).find("AuthFailure") > 0:
+				logging.error(f"{account['AccountId']}: Authorization failure")
+				logging.warning(my_Error)
+			elif str(my_Error).find("AccessDenied") > 0:
+				logging.error(f"{account['AccountId']}: Access Denied failure")
+				logging.warning(my_Error)
+			else:
+				logging.error(f"{account['AccountId']}: Other kind of failure")
+				logging.warning(my_Error)
+			continue
+		except KeyError as my_Error:
+			logging.error(f"Account Access failed - trying to access {account['AccountId']}")
+			logging.info(f"Actual Error: {my_Error}")
+			pass
+		except AttributeError as my_Error:
+			logging.error(f"Error: Likely that one of the supplied profiles was wrong")
+			logging.warning(my_Error)
+			continue
+	# The accounts' credentials are written to the cache on disk all at once, rather than one file rewrite per account
+	save_caches()
 	return (AllCreds)
 
 
-def get_org_accounts_from_profiles(fProfileList, progress_bar=False):
+PROFILE_WORKERS = 25  # How many profiles we resolve at the same time in iter_org_accounts_from_profiles
+
+
+def get_org_accounts_from_profiles(fProfileList, progress_bar=False, fMaxWorkers=None):
+	"""
+	Note that this function returns the account information from the list of profiles passed to it, in the same order
+	as the profiles. See iter_org_accounts_from_profiles, which hands each one back as soon as it's ready.
+	"""
+	ProfileOrder = dict()
+	for profile_number, profile in enumerate(fProfileList):
+		ProfileOrder.setdefault(profile, profile_number)
+	return (sorted(iter_org_accounts_from_profiles(fProfileList, fMaxWorkers), key=lambda Account: ProfileOrder[Account['profile']]))
+
+
+def iter_org_accounts_from_profiles(fProfileList, fMaxWorkers=None):
 	"""
-	Note that this function returns the account information from the list of profiles passed to it
+	Yields the account information for each of the profiles passed to it, as soon as each one is ready - so a script
+	can start showing results while the rest of the profiles are still being looked at.
+
+	Each profile goes through three steps, arranged so the cost follows the number of Orgs, rather than the number of profiles:
+		1. The profile is resolved to its account number (one STS call).
+		2. The first profile to reach an account looks up the Org attributes - any others into the same account wait,
+			and then re-use what it found.
+		3. If that account is a root account, the same profile enumerates the accounts in its Org, before the others re-use them.
+	fMaxWorkers is how many profiles we work on at the same time (defaults to PROFILE_WORKERS).
 	"""
 	import logging
-	from queue import Queue
-	from threading import Thread
+	from concurrent.futures import ThreadPoolExecutor, as_completed
 	from account_class import aws_acct_access
 	from botocore.exceptions import ClientError, InvalidConfigError, NoCredentialsError
 
-	class AssembleCredentials(Thread):
+	def new_account(profile):
+		Account = dict()
+		Account['ErrorFlag'] = Account['Success'] = Account['RootAcct'] = False
+		Account['MgmtAcct'] = Account['Email'] = Account['ErrorMessage'] = Account['OrgId'] = None
+		Account['profile'] = profile
+		return (Account)
+
+	def assemble_account(profile, fStep, fResolveOrg=True):
+		"""
+		Runs fStep (which returns the aws_acct object for the profile), and turns it into the Account dict, or the error.
+		If fResolveOrg is False, we stop once we know the profile works, without asking Organizations anything.
+		"""
+		Account = new_account(profile)
+		try:
+			logging.info(f"Trying profile {profile}")
+			aws_acct = fStep()
+			Account['aws_acct'] = aws_acct
+			if aws_acct.acct_number in ['Unknown', 'Failure']:
+				Account['ErrorFlag'] = True
+				logging.info(f"Access to the profile {profile} has failed")
+				pass
+			elif not fResolveOrg:
+				pass
+			elif aws_acct.AccountType.lower() == 'root':  # The Account is deemed to be a Management Account
+				logging.info(f"AccountNumber: {aws_acct.acct_number}")
+				Account['MgmtAcct'] = aws_acct.MgmtAccount
+				Account['Email'] = aws_acct.MgmtEmail
+				Account['OrgId'] = aws_acct.OrgID
+				Account['Success'] = True
+				Account['RootAcct'] = True
+			elif aws_acct.AccountType.lower() in ['standalone', 'child']:
+				Account['MgmtAcct'] = aws_acct.MgmtAccount
+				Account['Email'] = aws_acct.MgmtEmail
+				Account['OrgId'] = aws_acct.OrgID
+				Account['Success'] = True
+				Account['RootAcct'] = False
+		except ClientError as my_Error:
+			Account['ErrorFlag'] = True
+			Account['ErrorMessage'] = my_Error
+			if str(my_Error).find("AWSOrganizationsNotInUseException") > 0:
+				Account['MgmtAcct'] = "Not an Org Account"
+			elif str(my_Error).find("AccessDenied") > 0:
+				Account['MgmtAcct'] = "Acct not auth for Org API."
+			elif str(my_Error).find("InvalidClientTokenId") > 0:
+				Account['MgmtAcct'] = "Credentials Invalid."
+			elif str(my_Error).find("ExpiredToken") > 0:
+				Account['MgmtAcct'] = "Token Expired."
+			else:
+				logging.error("Client Error")
+				Account['ErrorMessage'] = my_Error
+				logging.error(my_Error)
+		except InvalidConfigError as my_Error:
+			Account['ErrorFlag'] = True
+			Account['ErrorMessage'] = my_Error
+			if str(my_Error).find("does not exist") > 0:
+				logging.error("Source profile error")
+				logging.error(my_Error)
+			else:
+				logging.error("Credentials Error")
+				logging.error(my_Error)
+		except NoCredentialsError as my_Error:
+			Account['ErrorFlag'] = True
+			Account['ErrorMessage'] = my_Error
+			if str(my_Error).find("Unable to locate credentials") > 0:
+				Account['MgmtAcct'] = "This profile doesn't have credentials."
+			else:
+				logging.error("Credentials Error")
+				logging.error(my_Error)
+		except Exception as my_Error:
+			Account['ErrorFlag'] = True
+			Account['ErrorMessage'] = my_Error
+			if str(my_Error).find("object has no attribute") > 0:
+				Account['MgmtAcct'] = "This profile's credentials don't work."
+				logging.error(my_Error)
+			else:
+				logging.error("Credentials Error")
+				logging.error(my_Error)
+		return (Account)
+
+	AccountDetails = dict()
+	account_details_lock = threading.Lock()
+
+	def resolve_profile(profile):
+		# Step 1 - One STS call, to find the account the profile gets us into
+		Account = assemble_account(profile, lambda: aws_acct_access(profile), False)
+		# If the profile failed before we even had its account number, there's nothing more to find out
+		if 'aws_acct' not in Account.keys() or getattr(Account['aws_acct'], 'acct_number', 'Failure') in ['Unknown', 'Failure']:
+			Account['ErrorFlag'] = True
+			return (Account)
+		aws_acct = Account['aws_acct']
+		with account_details_lock:
+			account_entry = AccountDetails.setdefault(aws_acct.acct_number, {'Lock': threading.Lock(), 'Representative': None, 'Details': None})
+		with account_entry['Lock']:
+			if account_entry['Details'] is None:
+				# Step 2 - Only one profile per account asks Organizations about the account
+				account_entry['Details'] = assemble_account(profile, lambda: aws_acct)
+				account_entry['Representative'] = aws_acct
+				if account_entry['Details']['RootAcct']:
+					# Step 3 - and only one root profile per Org enumerates the accounts in the Org
+					logging.info(f"Enumerating the accounts within the Org managed by {aws_acct.acct_number}")
+					aws_acct.ChildAccounts
+				return (account_entry['Details'])
+		if account_entry['Details']['Success']:
+			aws_acct.copy_org_details(account_entry['Representative'])
+		return (assemble_account(profile, lambda: aws_acct))
+
+	if fMaxWorkers is None:
+		fMaxWorkers = PROFILE_WORKERS
+	logging.info(f"Resolving {len(fProfileList)} profiles to their accounts")
+	with ThreadPoolExecutor(max_workers=max(1, min(fMaxWorkers, len(fProfileList)))) as profile_pool:
+		ProfileFutures = {profile_pool.submit(resolve_profile, profile): profile for profile in fProfileList}
+		for profile_future in as_completed(ProfileFutures):
+			try:
+				Account = profile_future.result()
+			except Exception as my_Error:
+				# One bad profile is flagged, rather than stopping all the others
+				logging.error(f"Profile {ProfileFutures[profile_future]} failed: {my_Error}")
+				Account = new_account(ProfileFutures[profile_future])
+				Account['ErrorFlag'] = True
+				Account['ErrorMessage'] = my_Error
+			yield (Account)
+	logging.info(f"The {len(fProfileList)} profiles led to {len(AccountDetails)} distinct accounts")
+
+
+TIMING_HISTORY_TTL = 30 * 86400  # Seconds before what we learnt about how long a collector takes is too old to go on
+_task_timings = {'Loaded': False, 'Entries': dict(), 'Unsaved': dict()}
+
+
+def _collector_name(fCollector):
+	return (getattr(fCollector, '__name__', type(fCollector).__name__))
+
+
+def record_task_timing(fCollector, fAccountNumber, fRegion, fDuration, fCount=None):
+	"""
+	Remembers how long the collector took in this account and region, and how many things it found there (fCount), so
+	the next sweep can start the slowest ones first. Nothing is written to disk until save_task_timings is called.
+	"""
+	from datetime import datetime, timezone
+
+	cache_key = f"{_collector_name(fCollector)}:{fAccountNumber}:{fRegion}"
+	cache_entry = {'Collector': _collector_name(fCollector),
+				   'AccountId': fAccountNumber,
+				   'Region'   : fRegion,
+				   'Duration' : fDuration,
+				   'Count'    : fCount,
+				   'Timestamp': datetime.now(timezone.utc).isoformat()}
+	with _cache_lock:
+		_task_timings['Entries'][cache_key] = cache_entry
+		_task_timings['Unsaved'][cache_key] = cache_entry
+
+
+def save_task_timings():
+	"""
+	Writes the timings recorded since the last save to the 'timings' cache on disk.
+	"""
+	with _cache_lock:
+		if len(_task_timings['Unsaved']) == 0:
+			return
+		with _locked_cache_file('timings', fWrite=True) as cache_data:
+			cache_data.update(_task_timings['Unsaved'])
+		_task_timings['Unsaved'].clear()
+
+
+def save_caches():
+	"""
+	Writes everything the caches have picked up since they were last saved to disk - each cache file is rewritten (at
+	most) once, rather than once for every account. The sweeps call this when they finish.
+	"""
+	save_task_timings()
+	save_cached_credentials()
+	save_role_preferences()
+	save_negative_cache()
+	save_region_catalogues()
+
+
+def order_longest_first(fCollector, fPlaces):
+	"""
+	fPlaces is a list of (ocredentials, account number, region) for the collector to look in.
+	Returns the same list, sorted so the ones we expect to take longest come first - that way one huge account isn't
+	left until the end, with everything else finished and waiting on it. How long we expect each one to take is:
+		- how long this collector took there last time, or failing that
+		- how many things any collector found there last time, times how long this collector usually takes per thing, or
+		- how long this collector usually takes anywhere, or
+		- nothing at all, if we've never run this collector before (in which case the order doesn't change)
+	"""
+	from datetime import datetime, timedelta, timezone
+
+	with _cache_lock:
+		if not _task_timings['Loaded']:
+			with _locked_cache_file('timings') as cache_data:
+				_task_timings['Entries'].update(cache_data)
+			_task_timings['Loaded'] = True
+		oldest_allowed = (datetime.now(timezone.utc) - timedelta(seconds=TIMING_HISTORY_TTL)).isoformat()
+		TimingHistory = [cache_entry for cache_entry in _task_timings['Entries'].values() if cache_entry['Timestamp'] > oldest_allowed]
+	collector_name = _collector_name(fCollector)
+	PastDurations = dict()
+	PastCounts = dict()
+	for cache_entry in TimingHistory:
+		place = (cache_entry['AccountId'], cache_entry['Region'])
+		if cache_entry['Collector'] == collector_name:
+			PastDurations[place] = cache_entry['Duration']
+		if cache_entry['Count'] is not None:
+			PastCounts[place] = max(cache_entry['Count'], PastCounts.get(place, 0))
+	if len(PastDurations) == 0:
+		return (list(fPlaces))
+	average_duration = sum(PastDurations.values()) / len(PastDurations)
+	counted_places = [place for place in PastDurations.keys() if PastCounts.get(place, 0) > 0]
+	time_per_thing = sum([PastDurations[place] for place in counted_places]) / sum([PastCounts[place] for place in counted_places]) \
+		if len(counted_places) > 0 else None
+
+	def expected_duration(fPlace):
+		place = (fPlace[1], fPlace[2])
+		if place in PastDurations:
+			return (PastDurations[place])
+		if time_per_thing is not None and place in PastCounts:
+			return (PastCounts[place] * time_per_thing)
+		return (average_duration)
+
+	return (sorted(fPlaces, key=expected_duration, reverse=True))
+
+
+def clear_task_timings():
+	"""
+	Forgets every timing we've recorded, both in memory and on disk.
+	"""
+	with _cache_lock:
+		_task_timings['Entries'].clear()
+		_task_timings['Unsaved'].clear()
+		with _locked_cache_file('timings', fWrite=True) as cache_data:
+			cache_data.clear()
+
+
+SWEEP_WORKERS = 25  # How many (account, region) pairs we look at the same time, unless told otherwise
+SWEEP_TIMEOUT = 300  # Seconds we wait on any one (account, region) pair, unless told otherwise
+# One pool per size asked for, so a caller with a pool in hand never has it shut down under them. 'MaxWorkers' is the largest size asked for.
+_sweep_pool = {'Executors': dict(), 'MaxWorkers': None}
+_sweep_pool_lock = threading.Lock()
+
+
+def _get_sweep_pool(fMaxWorkers):
+	"""
+	Returns the thread pool used by run_across_accounts_and_regions. It's kept between calls, so a script that sweeps
+	more than once (or more than one service) re-uses the same threads.
+	Asking for a different size gets a pool of that size - the others are left running, since another thread may
+	still be handing work to them.
+	"""
+	from concurrent.futures import ThreadPoolExecutor
+
+	with _sweep_pool_lock:
+		if fMaxWorkers not in _sweep_pool['Executors']:
+			_sweep_pool['Executors'][fMaxWorkers] = ThreadPoolExecutor(max_workers=fMaxWorkers, thread_name_prefix=f"sweep-{fMaxWorkers}")
+			_sweep_pool['MaxWorkers'] = max(fMaxWorkers, _sweep_pool['MaxWorkers'] or 0)
+		return (_sweep_pool['Executors'][fMaxWorkers])
+
+
+def _run_collector(fCollector, ocredentials, fRegion, fStartTimes, fTaskNumber):
+	from time import time
+
+	fStartTimes[fTaskNumber] = time()
+	return (fCollector(ocredentials, fRegion))
+
+
+def _places_to_look(fCredentialList, fRegionList):
+	"""
+	Returns a (ocredentials, account number, region) for every region of every account we have credentials for.
+	"""
+	import logging
+
+	Places = []
+	for ocredentials in fCredentialList:
+		AccountNumber = ocredentials.get('AccountNumber', ocredentials.get('AccountId'))
+		if not ocredentials.get('Success', True):
+			logging.info(f"Skipping account {AccountNumber}, since we couldn't get credentials for it")
+			continue
+		for region in (fRegionList.get(AccountNumber, []) if isinstance(fRegionList, dict) else fRegionList):
+			Places.append((ocredentials, AccountNumber, region))
+	return (Places)
+
+
+def _regions_for_global_collector(fCollector, fCredentialList, fRegionList):
+	"""
+	For a global collector, returns ({account number: [the one region to run it in]}, {account number: [every region
+	asked for]}) - or None if the collector's regional, or no account was asked for more than one region anyway.
+	"""
+	if not collector_scope(fCollector) == 'global':
+		return (None)
+	AllRegions = dict()
+	for ocredentials in fCredentialList:
+		AccountNumber = ocredentials.get('AccountNumber', ocredentials.get('AccountId'))
+		AllRegions[AccountNumber] = list(fRegionList.get(AccountNumber, []) if isinstance(fRegionList, dict) else fRegionList)
+	if not any([len(regions) > 1 for regions in AllRegions.values()]):
+		return (None)
+	return ({AccountNumber: regions[:1] for AccountNumber, regions in AllRegions.items()}, AllRegions)
+
+
+def _attach_to_all_regions(fResults, fAllRegions):
+	"""
+	Takes the results of a global collector, run in one region of each account, and yields a copy of each one for
+	every region that was asked for in that account - all of them sharing the one 'Result'.
+	"""
+	for task in fResults:
+		for region in fAllRegions.get(task['AccountId'], [task['Region']]):
+			yield (dict(task, Region=region))
 
-		def __init__(self, queue):
-			Thread.__init__(self)
-			self.queue = queue
 
-		def run(self):
-			Account = dict()
-			Account['ErrorFlag'] = Account['Success'] = Account['RootAcct'] = False
-			Account['MgmtAcct'] = Account['Email'] = Account['ErrorMessage'] = Account['OrgId'] = None
-			while True:
-				# Get the work from the queue and expand the tuple
-				profile = self.queue.get()
-				logging.info(f"De-queued info for account {profile}")
+def run_across_accounts_and_regions(fCredentialList, fRegionList, fCollector, fMaxWorkers=None, fTimeout=None, fEngine=None,
+									fJournal=None):
+	"""
+	fCredentialList is a list of credentials dicts (like get_credentials_for_accounts_in_org returns). Those whose
+		'Success' is False are skipped.
+	fRegionList is either the list of regions to look in for every account, or a dict of {account number: [regions]}
+		(like one service out of get_service_region_matrix), for when each account has its own regions.
+	fCollector is called as fCollector(ocredentials, region) for each account and region, and returns whatever it found.
+	fMaxWorkers is the most (account, region) pairs we look at the same time (defaults to SWEEP_WORKERS)
+	fTimeout is how many seconds we wait on any one pair, once it's started (defaults to SWEEP_TIMEOUT)
+	fEngine is either "threads" (the default) or "asyncio". The asyncio engine (see run_across_accounts_and_regions_async)
+		only works with collectors that know how to run there, like a PagedCollector - anything else runs on threads.
+	fJournal is an optional SweepJournal. Each pair that finishes is written to it, and any pair it says has already
+		finished (when it was opened to resume) isn't looked at again - its result comes straight back from the journal,
+		with 'Resumed' set to True.
+
+	The pairs that took longest last time are started first (see order_longest_first), and how long each one takes
+	this time is saved for next time - including the ones that failed, and the ones that ran out of time (which took at
+	least fTimeout).
+	A global collector (see global_collector) is only run in the first region of each account, and what it finds is
+	handed back for every region asked for.
+
+	This is a generator - it yields a dict for each (account, region) pair as soon as it's done, in whatever order they finish:
+		{'MgmtAccount', 'AccountId', 'Region', 'Success', 'Result', 'ErrorMessage', 'Duration'}
+	'Result' is whatever fCollector returned. A collector that raises (or takes longer than fTimeout) doesn't stop the
+	others - its pair comes back with 'Success' set to False and the 'ErrorMessage' saying what went wrong.
+	Python can't stop a thread part-way through, so a pair that runs out of time carries on in the background,
+	but whatever it finds is ignored.
+	"""
+	import logging
+	from concurrent.futures import wait, FIRST_COMPLETED
+	from time import time
+
+	global_regions = _regions_for_global_collector(fCollector, fCredentialList, fRegionList)
+	if global_regions is not None:
+		CallRegions, AllRegions = global_regions
+		yield from _attach_to_all_regions(run_across_accounts_and_regions(fCredentialList, CallRegions, fCollector, fMaxWorkers, fTimeout,
+																		  fEngine, fJournal), AllRegions)
+		return
+	if fEngine == 'asyncio':
+		if not hasattr(fCollector, 'collect_async'):
+			logging.warning(f"The collector {getattr(fCollector, '__name__', fCollector)} can only run on threads, so that's what we'll use")
+		elif not _aiobotocore_available():
+			logging.warning("The asyncio engine needs the aiobotocore package, which isn't installed, so we'll use threads instead")
+		else:
+			yield from run_across_accounts_and_regions_async(fCredentialList, fRegionList, fCollector, fMaxWorkers, fTimeout,
+															 fJournal=fJournal)
+			return
+	if fMaxWorkers is None:
+		fMaxWorkers = SWEEP_WORKERS
+	if fTimeout is None:
+		fTimeout = SWEEP_TIMEOUT
+	sweep_pool = _get_sweep_pool(fMaxWorkers)
+	start_times = dict()
+	pending = dict()
+	ResumedTasks, PlacesLeft = _resume_from_journal(fJournal, fCollector, _places_to_look(fCredentialList, fRegionList))
+	for ocredentials, AccountNumber, region in order_longest_first(fCollector, PlacesLeft):
+		task_number = len(pending)
+		pending[sweep_pool.submit(_run_collector, fCollector, ocredentials, region, start_times, task_number)] = \
+			(task_number, {'MgmtAccount': ocredentials.get('MgmtAccount'), 'AccountId': AccountNumber, 'Region': region})
+	logging.info(f"Queued {len(pending)} account / region pairs across {fMaxWorkers} workers")
+	try:
+		for task in ResumedTasks:
+			yield (task)
+		while len(pending) > 0:
+			done, _ = wait(pending.keys(), timeout=min(1, fTimeout), return_when=FIRST_COMPLETED)
+			now = time()
+			for future in done:
+				task_number, task = pending.pop(future)
+				task['Duration'] = now - start_times.get(task_number, now)
 				try:
-					logging.info(f"Trying profile {profile}")
-					aws_acct = aws_acct_access(profile)
-					Account['profile'] = profile
-					Account['aws_acct'] = aws_acct
-					if aws_acct.acct_number == 'Unknown':
-						Account['ErrorFlag'] = True
-						logging.info(f"Access to the profile {profile} has failed")
-						pass
-					elif aws_acct.AccountType.lower() == 'root':  # The Account is deemed to be a Management Account
-						logging.info(f"AccountNumber: {aws_acct.acct_number}")
-						Account['MgmtAcct'] = aws_acct.MgmtAccount
-						Account['Email'] = aws_acct.MgmtEmail
-						Account['OrgId'] = aws_acct.OrgID
-						Account['Success'] = True
-						Account['RootAcct'] = True
-					elif aws_acct.AccountType.lower() in ['standalone', 'child']:
-						Account['MgmtAcct'] = aws_acct.MgmtAccount
-						Account['Email'] = aws_acct.MgmtEmail
-						Account['OrgId'] = aws_acct.OrgID
-						Account['Success'] = True
-						Account['RootAcct'] = False
-				except ClientError as my_Error:
-					Account['ErrorFlag'] = True
-					Account['ErrorMessage'] = my_Error
-					if str(my_Error).find("AWSOrganizationsNotInUseException") > 0:
-						Account['MgmtAcct'] = "Not an Org Account"
-					elif str(my_Error).find("AccessDenied") > 0:
-						Account['MgmtAcct'] = "Acct not auth for Org API."
-					elif str(my_Error).find("InvalidClientTokenId") > 0:
-						Account['MgmtAcct'] = "Credentials Invalid."
-					elif str(my_Error).find("ExpiredToken") > 0:
-						Account['MgmtAcct'] = "Token Expired."
-					else:
-						logging.error("Client Error")
-						Account['ErrorMessage'] = my_Error
-						logging.error(my_Error)
-				except InvalidConfigError as my_Error:
-					Account['ErrorFlag'] = True
-					Account['ErrorMessage'] = my_Error
-					if str(my_Error).find("does not exist") > 0:
-						logging.error("Source profile error")
-						logging.error(my_Error)
-					else:
-						logging.error("Credentials Error")
-						logging.error(my_Error)
-				except NoCredentialsError as my_Error:
-					Account['ErrorFlag'] = True
-					Account['ErrorMessage'] = my_Error
-					if str(my_Error).find("Unable to locate credentials") > 0:
-						Account['MgmtAcct'] = "This profile doesn't have credentials."
-					else:
-						logging.error("Credentials Error")
-						logging.error(my_Error)
-				except AttributeError or Exception as my_Error:
-					Account['ErrorFlag'] = True
-					Account['ErrorMessage'] = my_Error
-					if str(my_Error).find("object has no attribute") > 0:
-						Account['MgmtAcct'] = "This profile's credentials don't work."
-						logging.error(my_Error)
-					else:
-						logging.error("Credentials Error")
-						logging.error(my_Error)
-				finally:
-					self.queue.task_done()
-				AllAccounts.append(Account)
-
-	AllAccounts = []
-	profilequeue = Queue()
-	# WorkerThreads = 9
-	WorkerThreads = len(fProfileList)
-
-	# Create x worker threads
-	for x in range(WorkerThreads):
-		# if progress_bar:
-		# 	print(f"{x}", end='')
-		worker = AssembleCredentials(profilequeue)
-		# Setting daemon to True will let the main thread exit even though the workers are blocking
-		worker.daemon = True
-		worker.start()
-
-	for profile_item in fProfileList:
-		logging.info(f"Queuing profile {profile_item} / {len(fProfileList)} profiles")
-		# if progress_bar:
-		# 	print("\b\b!", end='')
-		profilequeue.put(profile_item)
-	profilequeue.join()
-	return (AllAccounts)
+					task.update({'Success': True, 'Result': future.result(), 'ErrorMessage': None})
+					record_task_timing(fCollector, task['AccountId'], task['Region'], task['Duration'],
+									   len(task['Result']) if isinstance(task['Result'], list) else None)
+					if fJournal is not None:
+						fJournal.record(fCollector, task)
+				except Exception as my_Error:
+					logging.warning(f"Failed to look in account {task['AccountId']} in region {task['Region']}: {my_Error}")
+					task.update({'Success': False, 'Result': None, 'ErrorMessage': str(my_Error)})
+					record_task_timing(fCollector, task['AccountId'], task['Region'], task['Duration'])
+				yield (task)
+			for future in [future for future, (task_number, task) in pending.items()
+						   if task_number in start_times and now - start_times[task_number] > fTimeout]:
+				task_number, task = pending.pop(future)
+				logging.warning(f"Gave up on account {task['AccountId']} in region {task['Region']} after {fTimeout} seconds")
+				task.update({'Success': False, 'Result': None, 'Duration': now - start_times[task_number],
+							 'ErrorMessage': f"Timed out after {fTimeout} seconds"})
+				# It took at least this long - so next time, it's one of the first to start
+				record_task_timing(fCollector, task['AccountId'], task['Region'], task['Duration'])
+				yield (task)
+	finally:
+		# If whoever's reading the results stops early, there's no point running the pairs that haven't started yet
+		for future in pending.keys():
+			future.cancel()
+		save_caches()
+
+
+class SweepJournal:
+	"""
+	An append-only record of the (collector, account, region) tasks a sweep has finished, and what they found, so a
+	sweep that dies part-way through can pick up where it left off.
+	fName names the journal - it should include whatever makes this sweep different from others (the script, the
+		management account, any filters), since resuming hands back the results the journal holds.
+	fResume keeps (and re-uses) what's already in the journal. Otherwise the journal starts out empty.
+
+	Each finished task is written (and flushed) as its own line of JSON the moment it's done, so a crash can only lose
+	the tasks that were still running. A half-written last line, from a crash mid-write, is ignored.
+	Results come back from the journal as they went in, except that anything JSON can't hold (like a datetime)
+	comes back as a string. Only successful tasks are journaled, so anything that failed is tried again.
+	"""
+
+	def __init__(self, fName, fResume=False):
+		import json
+		import logging
+		import os
+		import re
+
+		journal_dir = os.path.join(os.path.dirname(_cache_file_path('journals')), 'journals')
+		os.makedirs(journal_dir, mode=0o700, exist_ok=True)
+		self.Path = os.path.join(journal_dir, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', fName)}.jsonl")
+		self.Finished = dict()
+		self.Lock = threading.Lock()
+		if fResume and os.path.exists(self.Path):
+			with open(self.Path) as journal_contents:
+				for line in journal_contents:
+					if len(line.strip()) == 0:
+						continue
+					try:
+						entry = json.loads(line)
+					except ValueError:
+						logging.info(f"Skipping a partial line in the journal {self.Path}")
+						continue
+					self.Finished[(entry['Collector'], entry['AccountId'], entry['Region'])] = entry
+			logging.warning(f"Resuming from {len(self.Finished)} finished tasks in the journal {self.Path}")
+		self.File = open(os.open(self.Path, os.O_WRONLY | os.O_CREAT | (os.O_APPEND if fResume else os.O_TRUNC), 0o600), 'a')
+		if fResume and self.File.tell() > 0:
+			# Makes sure a partial last line doesn't swallow the first line we add
+			self.File.write("\n")
+			self.File.flush()
+
+	def finished_task(self, fCollector, fAccountNumber, fRegion):
+		"""
+		Returns the journal's entry for this task, or None if it hasn't been finished yet.
+		"""
+		return (self.Finished.get((_collector_name(fCollector), fAccountNumber, fRegion)))
+
+	def record(self, fCollector, fTask):
+		"""
+		Writes the finished task (one of the result dicts the sweep yields) to the journal.
+		"""
+		import json
+
+		entry = {'Collector'  : _collector_name(fCollector),
+				 'MgmtAccount': fTask['MgmtAccount'],
+				 'AccountId'  : fTask['AccountId'],
+				 'Region'     : fTask['Region'],
+				 'Duration'   : fTask.get('Duration'),
+				 'Result'     : fTask['Result']}
+		line = json.dumps(entry, default=str)
+		with self.Lock:
+			self.File.write(f"{line}\n")
+			self.File.flush()
+			self.Finished[(entry['Collector'], entry['AccountId'], entry['Region'])] = entry
+
+	def close(self):
+		with self.Lock:
+			self.File.close()
+
+
+def _resume_from_journal(fJournal, fCollector, fPlaces):
+	"""
+	Splits the places to look into those the journal says are already done (returned as the result dicts the sweep
+	would have yielded for them), and those still to do.
+	"""
+	if fJournal is None:
+		return ([], fPlaces)
+	ResumedTasks = []
+	PlacesLeft = []
+	for ocredentials, AccountNumber, region in fPlaces:
+		entry = fJournal.finished_task(fCollector, AccountNumber, region)
+		if entry is None:
+			PlacesLeft.append((ocredentials, AccountNumber, region))
+		else:
+			ResumedTasks.append({'MgmtAccount': entry['MgmtAccount'], 'AccountId': AccountNumber, 'Region': region, 'Success': True,
+								 'Result'     : entry['Result'], 'ErrorMessage': None, 'Duration': entry['Duration'], 'Resumed': True})
+	return (ResumedTasks, PlacesLeft)
+
+
+STREAM_QUEUE_SIZE = 1000  # The most records stream_across_accounts_and_regions holds, waiting for whoever's reading them
+
+
+def _put_until_stopped(fQueue, fItem, fStop):
+	"""
+	Puts fItem on the (bounded) queue, waiting for room - unless fStop is set while we wait, when it gives up and returns False.
+	"""
+	from queue import Full
+
+	while not fStop.is_set():
+		try:
+			fQueue.put(fItem, timeout=1)
+			return (True)
+		except Full:
+			continue
+	return (False)
+
+
+def _stream_collector(fCollector, ocredentials, fAccountNumber, fRegion, fQueue, fStop):
+	from time import time
+
+	place = {'MgmtAccount': ocredentials.get('MgmtAccount'), 'AccountId': fAccountNumber, 'Region': fRegion}
+	begin_time = time()
+	RecordCount = 0
+	try:
+		for record in (fCollector.iter_items(ocredentials, fRegion) if hasattr(fCollector, 'iter_items') else fCollector(ocredentials, fRegion)):
+			if not _put_until_stopped(fQueue, dict(place, Success=True, Result=record, Finished=False), fStop):
+				return
+			RecordCount += 1
+		finished = dict(place, Success=True, ErrorMessage=None)
+		record_task_timing(fCollector, fAccountNumber, fRegion, time() - begin_time, RecordCount)
+	except Exception as my_Error:
+		finished = dict(place, Success=False, ErrorMessage=str(my_Error))
+		record_task_timing(fCollector, fAccountNumber, fRegion, time() - begin_time, RecordCount)
+	finished.update({'Result': None, 'Finished': True, 'Duration': time() - begin_time, 'Count': RecordCount})
+	_put_until_stopped(fQueue, finished, fStop)
+
+
+def stream_across_accounts_and_regions(fCredentialList, fRegionList, fCollector, fMaxWorkers=None):
+	"""
+	The streaming version of run_across_accounts_and_regions. It takes the same fCredentialList, fRegionList and
+	fMaxWorkers, but fCollector is either something with an iter_items method (like a PagedCollector), or is called as
+	fCollector(ocredentials, region) and returns an iterator (like the iter_* functions) - and each record is passed
+	on as soon as its page arrives, rather than once the whole account and region is done.
+
+	This is a generator - it merges the records from every account and region into one stream of dicts:
+		{'MgmtAccount', 'AccountId', 'Region', 'Success': True, 'Result': <one record>, 'Finished': False}
+	and once each account and region is done (or has failed), one more for it:
+		{'MgmtAccount', 'AccountId', 'Region', 'Success', 'Result': None, 'Finished': True, 'ErrorMessage', 'Duration', 'Count'}
+	At most STREAM_QUEUE_SIZE records wait to be read - if whoever's reading falls behind, the workers wait for them,
+	so memory follows the page size and the number of workers, rather than the size of the Org.
+	There's no time limit on any one account and region, since a big one can legitimately stream for a long time.
+	Like run_across_accounts_and_regions, a global collector only runs once in each account, and each of its records
+	is handed back for every region asked for.
+	"""
+	import logging
+	from queue import Queue
+
+	global_regions = _regions_for_global_collector(fCollector, fCredentialList, fRegionList)
+	if global_regions is not None:
+		CallRegions, AllRegions = global_regions
+		yield from _attach_to_all_regions(stream_across_accounts_and_regions(fCredentialList, CallRegions, fCollector, fMaxWorkers), AllRegions)
+		return
+	if fMaxWorkers is None:
+		fMaxWorkers = SWEEP_WORKERS
+	sweep_pool = _get_sweep_pool(fMaxWorkers)
+	record_queue = Queue(maxsize=STREAM_QUEUE_SIZE)
+	stop_streaming = threading.Event()
+	Places = order_longest_first(fCollector, _places_to_look(fCredentialList, fRegionList))
+	futures = [sweep_pool.submit(_stream_collector, fCollector, ocredentials, AccountNumber, region, record_queue, stop_streaming)
+			   for ocredentials, AccountNumber, region in Places]
+	logging.info(f"Streaming from {len(Places)} account / region pairs across {fMaxWorkers} workers")
+	PlacesFinished = 0
+	try:
+		while PlacesFinished < len(Places):
+			record = record_queue.get()
+			if record['Finished']:
+				PlacesFinished += 1
+				if not record['Success']:
+					logging.warning(f"Failed to look in account {record['AccountId']} in region {record['Region']}: {record['ErrorMessage']}")
+			yield (record)
+	finally:
+		# If whoever's reading stops early, let the workers go, and don't start any more
+		stop_streaming.set()
+		for future in futures:
+			future.cancel()
+		save_caches()
+
+
+class PagedCollector:
+	"""
+	A collector for run_across_accounts_and_regions that's just one (possibly paginated) list call, which means it can
+	run on either engine - threads, or asyncio.
+	fService and fOperation are the boto3 names of the service and call (like 'lambda' and 'list_functions')
+	fResultKey is the key in each response (or page) that holds the items (like 'Functions')
+	fArguments are any arguments the call needs
+	fPostProcess, if given, is called as fPostProcess(ocredentials, region, items), and whatever it returns is the result.
+		Otherwise the result is the list of items.
+	Calls to a global service (GLOBAL_SERVICES, or one of the GLOBAL_OPERATIONS) make it a global collector.
+	"""
+
+	def __init__(self, fService, fOperation, fResultKey, fArguments=None, fPostProcess=None):
+		self.Service = fService
+		self.Operation = fOperation
+		if fService in GLOBAL_SERVICES or (fService, fOperation) in GLOBAL_OPERATIONS:
+			self.Scope = 'global'
+		self.ResultKey = fResultKey
+		self.Arguments = fArguments if fArguments is not None else dict()
+		self.PostProcess = fPostProcess
+		self.__name__ = f"{fService}.{fOperation}"
+
+	def _finish(self, ocredentials, fRegion, fItems):
+		if self.PostProcess is None:
+			return (fItems)
+		return (self.PostProcess(ocredentials, fRegion, fItems))
+
+	def __call__(self, ocredentials, fRegion):
+		"""
+		The threaded engine calls this, just like any other collector.
+		"""
+		Items = []
+		for page in iter_pages(ocredentials, self.Service, fRegion, self.Operation, self.ResultKey, **self.Arguments):
+			Items.extend(page)
+		return (self._finish(ocredentials, fRegion, Items))
+
+	def iter_items(self, ocredentials, fRegion):
+		"""
+		stream_across_accounts_and_regions calls this - it yields what's found a page at a time, with fPostProcess
+		run on each page in turn (so it needs to be happy working on part of the list at a time).
+		"""
+		for page in iter_pages(ocredentials, self.Service, fRegion, self.Operation, self.ResultKey, **self.Arguments):
+			yield from self._finish(ocredentials, fRegion, page)
+
+	async def collect_async(self, fGetClient, ocredentials, fRegion):
+		"""
+		The asyncio engine calls this instead. fGetClient(service) gives back an aiobotocore client for this account
+		and region.
+		"""
+		client = await fGetClient(self.Service)
+		Items = []
+		if client.can_paginate(self.Operation):
+			async for page in client.get_paginator(self.Operation).paginate(**self.Arguments):
+				Items.extend(page.get(self.ResultKey, []))
+		else:
+			Items.extend((await getattr(client, self.Operation)(**self.Arguments)).get(self.ResultKey, []))
+		return (self._finish(ocredentials, fRegion, Items))
+
+
+ASYNC_WORKERS = 1000  # How many (account, region) pairs the asyncio engine looks at the same time, unless told otherwise
+ASYNC_PER_SERVICE = 500  # The most calls in flight against any one service at once
+ASYNC_PER_ACCOUNT = 10  # The most pairs in flight within any one account at once
+
+
+def _aiobotocore_available():
+	from importlib.util import find_spec
+
+	return (find_spec('aiobotocore') is not None)
+
+
+def _create_aio_client(fSession, ocredentials, fService, fRegion, fMaxConnections):
+	"""
+	Returns the (async context manager for an) aiobotocore client for these credentials.
+	aiobotocore can't use botocore's RefreshableCredentials, so we take a frozen copy of the keys as they are right now.
+	Credentials with neither keys nor a 'Profile' raise a ValueError, rather than quietly falling back to the default
+	credentials - which would look in whichever account those happen to belong to.
+	"""
+	from aiobotocore.config import AioConfig
+	from aiobotocore.session import AioSession
+
+	if ocredentials.get('RefreshableCredentials') is not None:
+		frozen = ocredentials['RefreshableCredentials'].get_frozen_credentials()
+		keys = {'aws_access_key_id'    : frozen.access_key,
+				'aws_secret_access_key': frozen.secret_key,
+				'aws_session_token'    : frozen.token}
+	elif ocredentials.get('AccessKeyId') is not None:
+		keys = {'aws_access_key_id'    : ocredentials['AccessKeyId'],
+				'aws_secret_access_key': ocredentials['SecretAccessKey'],
+				'aws_session_token'    : ocredentials['SessionToken']}
+	elif ocredentials.get('Profile') is not None:
+		# A profile, rather than keys - a session of its own picks those up
+		fSession = AioSession(profile=ocredentials['Profile'])
+		keys = dict()
+	else:
+		raise ValueError(f"The credentials for account {ocredentials.get('AccountNumber')} have neither keys nor a profile")
+	return (fSession.create_client(fService, region_name=fRegion, config=AioConfig(**get_client_settings(fMaxConnections)), **keys))
+
+
+def _limit_api_calls_async(fClient, fSemaphore):
+	"""
+	Makes every call the (aiobotocore) client makes - paginated or not - wait for a place on fSemaphore first.
+	The generated methods and the paginators all go through _make_api_call, so that's the one place to wrap.
+	"""
+	make_api_call = fClient._make_api_call
+
+	async def limited_api_call(operation_name, api_params):
+		async with fSemaphore:
+			return (await make_api_call(operation_name, api_params))
+
+	fClient._make_api_call = limited_api_call
+	return (fClient)
+
+
+def run_across_accounts_and_regions_async(fCredentialList, fRegionList, fCollector, fMaxWorkers=None, fTimeout=None,
+										  fPerService=None, fPerAccount=None, fJournal=None):
+	"""
+	The asyncio version of run_across_accounts_and_regions - it takes the same arguments and yields the same dicts, in
+	whatever order they finish, so a script doesn't need to care which engine it's reading from.
+	fCollector needs a collect_async method, called as "await fCollector.collect_async(get_client, ocredentials, region)",
+		where "await get_client(service)" gives back an aiobotocore client (see PagedCollector).
+	fMaxWorkers is the most pairs in flight at once (defaults to ASYNC_WORKERS)
+	fPerService is the most calls in flight against any one service (defaults to ASYNC_PER_SERVICE) - counted by the
+		service each client actually talks to, so a collector that uses more than one service is limited in each.
+	fPerAccount is the most pairs in flight within any one account (defaults to ASYNC_PER_ACCOUNT), which keeps
+		a big sweep from tripping any one account's API throttling.
+
+	The event loop runs on a thread of its own, and the results come back to us through a queue as they finish.
+	Unlike threads, a pair that runs out of time really is stopped.
+	Each account / region / service gets one client, which is closed once the sweep is done, and which shares the
+	rate limiter (see RATE_LIMITS) with the threaded engine's clients.
+	"""
+	import asyncio
+	import logging
+	from queue import Queue
+	from time import time
+
+	global_regions = _regions_for_global_collector(fCollector, fCredentialList, fRegionList)
+	if global_regions is not None:
+		CallRegions, AllRegions = global_regions
+		yield from _attach_to_all_regions(run_across_accounts_and_regions_async(fCredentialList, CallRegions, fCollector, fMaxWorkers, fTimeout,
+																				fPerService, fPerAccount, fJournal), AllRegions)
+		return
+	if fMaxWorkers is None:
+		fMaxWorkers = ASYNC_WORKERS
+	if fTimeout is None:
+		fTimeout = SWEEP_TIMEOUT
+	if fPerService is None:
+		fPerService = ASYNC_PER_SERVICE
+	if fPerAccount is None:
+		fPerAccount = ASYNC_PER_ACCOUNT
+	ResumedTasks, PlacesLeft = _resume_from_journal(fJournal, fCollector, _places_to_look(fCredentialList, fRegionList))
+	Places = order_longest_first(fCollector, PlacesLeft)
+	logging.info(f"Queued {len(Places)} account / region pairs, {fMaxWorkers} at a time, on the asyncio engine")
+	result_queue = Queue()
+	finished = object()
+	sweep_state = {'Loop': None, 'Sweep': None, 'Error': None}
+
+	async def sweep():
+		from contextlib import AsyncExitStack
+
+		all_limit = asyncio.Semaphore(fMaxWorkers)
+		service_limits = dict()
+		account_limits = dict()
+		clients = dict()
+		client_locks = dict()
+		aio_session = dict()
+		async with AsyncExitStack() as open_clients:
+			async def get_client(ocredentials, fAccountNumber, fRegion, fService):
+				key = (fAccountNumber, fRegion, fService)
+				async with client_locks.setdefault(key, asyncio.Lock()):
+					if key not in clients:
+						if 'Session' not in aio_session:
+							from aiobotocore.session import get_session
+							aio_session['Session'] = get_session()
+						clients[key] = _limit_api_calls_async(_attach_rate_limiter(await open_clients.enter_async_context(
+							_create_aio_client(aio_session['Session'], ocredentials, fService, fRegion, fPerAccount)),
+							fService, fAccountNumber, fRegion, fAsync=True), service_limits.setdefault(fService, asyncio.Semaphore(fPerService)))
+				return (clients[key])
+
+			async def run_one(ocredentials, fAccountNumber, fRegion):
+				task = {'MgmtAccount': ocredentials.get('MgmtAccount'), 'AccountId': fAccountNumber, 'Region': fRegion}
+				account_limit = account_limits.setdefault(fAccountNumber, asyncio.Semaphore(fPerAccount))
+				async with all_limit, account_limit:
+					begin_time = time()
+					try:
+						result = await asyncio.wait_for(
+							fCollector.collect_async(lambda service: get_client(ocredentials, fAccountNumber, fRegion, service), ocredentials, fRegion),
+							fTimeout)
+						task.update({'Success': True, 'Result': result, 'ErrorMessage': None})
+						record_task_timing(fCollector, fAccountNumber, fRegion, time() - begin_time, len(result) if isinstance(result, list) else None)
+						if fJournal is not None:
+							fJournal.record(fCollector, dict(task, Duration=time() - begin_time))
+					except asyncio.TimeoutError:
+						logging.warning(f"Gave up on account {fAccountNumber} in region {fRegion} after {fTimeout} seconds")
+						task.update({'Success': False, 'Result': None, 'ErrorMessage': f"Timed out after {fTimeout} seconds"})
+						# It took at least this long - so next time, it's one of the first to start
+						record_task_timing(fCollector, fAccountNumber, fRegion, max(fTimeout, time() - begin_time))
+					except Exception as my_Error:
+						logging.warning(f"Failed to look in account {fAccountNumber} in region {fRegion}: {my_Error}")
+						task.update({'Success': False, 'Result': None, 'ErrorMessage': str(my_Error)})
+						record_task_timing(fCollector, fAccountNumber, fRegion, time() - begin_time)
+					task['Duration'] = time() - begin_time
+				result_queue.put(task)
+
+			await asyncio.gather(*[run_one(*place) for place in Places])
+
+	def run_loop():
+		loop = asyncio.new_event_loop()
+		sweep_state['Loop'] = loop
+		try:
+			sweep_state['Sweep'] = loop.create_task(sweep())
+			loop.run_until_complete(sweep_state['Sweep'])
+		except asyncio.CancelledError:
+			pass
+		except Exception as my_Error:
+			sweep_state['Error'] = my_Error
+		finally:
+			loop.close()
+			result_queue.put(finished)
+
+	for task in ResumedTasks:
+		yield (task)
+	loop_thread = threading.Thread(target=run_loop, name='sweep-asyncio', daemon=True)
+	loop_thread.start()
+	try:
+		while True:
+			task = result_queue.get()
+			if task is finished:
+				break
+			yield (task)
+		if sweep_state['Error'] is not None:
+			raise sweep_state['Error']
+	finally:
+		# If whoever's reading the results stops early, cancel everything that's still running
+		save_caches()
+		if loop_thread.is_alive() and sweep_state['Sweep'] is not None:
+			try:
+				sweep_state['Loop'].call_soon_threadsafe(sweep_state['Sweep'].cancel)
+			except RuntimeError:
+				# The loop finished (and closed) on its own in the meantime
+				pass
+
+
+def _reset_process_state():
+	"""
+	Called first thing in a forked worker process. The worker gets a copy of our memory, but not our threads - so any
+	lock a thread happened to be holding would stay locked forever, and the pools' threads aren't there any more.
+	We start the worker off with fresh locks, pools, sessions and clients of its own.
+	The on-disk caches are left alone, since they're already safe to share between processes.
+	"""
+	global _caller_identity_lock, _cache_lock, _client_creation_lock, _credential_pool_lock, _sweep_pool_lock, _rate_limit_lock
+
+	_caller_identity_lock = threading.Lock()
+	_cache_lock = threading.RLock()
+	_client_creation_lock = threading.Lock()
+	_credential_pool_lock = threading.Lock()
+	_sweep_pool_lock = threading.Lock()
+	_rate_limit_lock = threading.Lock()
+	_caller_identities['Locks'].clear()
+	# Each worker gets its own buckets, which is fine since the shards are split by account
+	_rate_limits['Buckets'].clear()
+	_shared_sessions.update({'Session': None, 'Loader': None, 'Profiles': dict(), 'Refreshable': OrderedDict()})
+	_client_cache.clear()
+	_client_key_locks.clear()
+	_sts_clients.clear()
+	_credential_pool.update({'Executors': dict(), 'MaxWorkers': None})
+	_sweep_pool.update({'Executors': dict(), 'MaxWorkers': None})
+
+
+def make_picklable(fItem):
+	"""
+	Returns a copy of fItem (and any dicts, lists or tuples inside it) without the 'RefreshableCredentials' that
+	credentials dicts carry, since botocore's refreshable credentials can't be pickled to send to another process.
+	The static keys are still there, so clients can still be made from what's left - they just can't refresh themselves.
+	"""
+	if isinstance(fItem, dict):
+		return ({key: make_picklable(value) for key, value in fItem.items() if not key == 'RefreshableCredentials'})
+	elif isinstance(fItem, list):
+		return ([make_picklable(value) for value in fItem])
+	elif isinstance(fItem, tuple):
+		return (tuple([make_picklable(value) for value in fItem]))
+	return (fItem)
+
+
+def shard_by_account_hash(fCredentialList, fShardCount):
+	"""
+	Splits a list of credentials dicts into fShardCount lists. An account always lands in the same shard (it's a crc32
+	of the account number, rather than python's hash(), which changes between runs).
+	"""
+	from zlib import crc32
+
+	Shards = [[] for _ in range(fShardCount)]
+	for ocredentials in fCredentialList:
+		AccountNumber = ocredentials.get('AccountNumber', ocredentials.get('AccountId'))
+		Shards[crc32(str(AccountNumber).encode()) % fShardCount].append(ocredentials)
+	return ([shard for shard in Shards if len(shard) > 0])
+
+
+def _run_shard_worker(fWorkerNumber, fShards, fShardWorker, fResultQueue):
+	import logging
+
+	_reset_process_state()
+	for shard in fShards:
+		try:
+			for item in fShardWorker(shard):
+				fResultQueue.put(('Item', make_picklable(item)))
+		except Exception as my_Error:
+			logging.error(f"Worker process {fWorkerNumber} failed on one of its shards: {my_Error}")
+	fResultQueue.put(('Done', fWorkerNumber))
+
+
+def run_in_process_shards(fShards, fShardWorker, fProcesses=None):
+	"""
+	fShards is a list of pieces of work - a profile per management account, say, or a list of credentials from
+		shard_by_account_hash.
+	fShardWorker is called as fShardWorker(shard) in a worker process, and returns (or yields) the things it found.
+	fProcesses is how many worker processes to split the shards across (defaults to the number of CPUs)
+
+	This is a generator - it yields each thing found, as soon as a worker sends it back, so the results from all the
+	workers stream back together rather than waiting for the slowest one. Each worker has its own sessions, clients
+	and thread pools, and its own GIL, so the parsing of all those responses gets spread across the cores.
+	What comes back goes through make_picklable on its way.
+
+	The workers are forked, since our scripts do all their work at the top level and can't be re-imported by a
+	spawned process - so where there's no fork (Windows), the shards just run one after the other in this process.
+	A shard that fails is logged, and the rest carry on.
+	"""
+	import logging
+	import os
+	from multiprocessing import get_all_start_methods, get_context
+	from queue import Empty
+
+	if 'fork' not in get_all_start_methods():
+		logging.warning("This platform can't fork, so we'll work through the shards in this process instead")
+		for shard in fShards:
+			yield from fShardWorker(shard)
+		return
+	if fProcesses is None:
+		fProcesses = os.cpu_count() or 1
+	fProcesses = max(1, min(fProcesses, len(fShards)))
+	mp_context = get_context('fork')
+	result_queue = mp_context.Queue()
+	WorkerProcesses = []
+	for worker_number in range(fProcesses):
+		worker_process = mp_context.Process(target=_run_shard_worker, name=f"shard-{worker_number}",
+											args=(worker_number, fShards[worker_number::fProcesses], fShardWorker, result_queue))
+		worker_process.start()
+		WorkerProcesses.append(worker_process)
+	logging.info(f"Split {len(fShards)} shards across {fProcesses} worker processes")
+	Finished = set()
+	try:
+		while len(Finished) < fProcesses:
+			try:
+				kind, payload = result_queue.get(timeout=1)
+			except Empty:
+				# A worker that died without saying it was done isn't going to send anything else
+				for worker_number, worker_process in enumerate(WorkerProcesses):
+					if worker_number not in Finished and not worker_process.is_alive() and result_queue.empty():
+						logging.error(f"Worker process {worker_number} exited ({worker_process.exitcode}) before it finished")
+						Finished.add(worker_number)
+				continue
+			if kind == 'Item':
+				yield (payload)
+			elif kind == 'Done':
+				Finished.add(payload)
+	finally:
+		for worker_process in WorkerProcesses:
+			if worker_process.is_alive() and len(Finished) < fProcesses:
+				worker_process.terminate()
+			worker_process.join()
+
+
+WORK_QUEUE_LEASE = 300  # Seconds a worker holds a task for, before another worker may take it over (heartbeats renew it)
+WORK_QUEUE_HEARTBEAT = 30  # Seconds between a worker renewing the leases on the tasks it's running
+WORK_QUEUE_ATTEMPTS = 3  # How many leases a task may run out of (from workers dying part-way through) before we give up on it
+WORK_QUEUE_POLL = 1  # Seconds between looking for new tasks (as a worker) or finished ones (as the coordinator)
+WORK_QUEUE_IDLE = 300  # Seconds a stand-alone worker waits for something to do, before it decides the sweeps are over
+WORK_QUEUE_STALL = 900  # Seconds the coordinator waits with tasks left but no worker on any of them, before it gives up on them
+
+
+class WorkQueue:
+	"""
+	A queue of (collector, account, region) tasks, kept in a SQLite file, so one sweep can be split across several
+	runner boxes that can all see the same file (a shared volume, say).
+	The coordinator (see run_through_work_queue) puts a sweep's tasks in and takes the results out, while the workers
+	(see run_work_queue_worker) lease the tasks, keep their leases alive while they're running them, and post back
+	what they found. A task whose lease runs out - because its worker died - goes back to the other workers, up to
+	WORK_QUEUE_ATTEMPTS times.
+
+	The credentials aren't put in the queue - each worker gets its own, from its own profile. The results are, though,
+	so the file is only readable by its owner. SQLite's locking needs a file system that supports it properly, which
+	most NFS and SMB mounts do, but not all of them.
+	"""
+
+	def __init__(self, fPath):
+		import os
+
+		self.Path = os.path.abspath(os.path.expanduser(fPath))
+		self.Local = threading.local()
+		if not os.path.exists(self.Path):
+			os.close(os.open(self.Path, os.O_WRONLY | os.O_CREAT, 0o600))
+		with self._transaction() as db:
+			db.execute("CREATE TABLE IF NOT EXISTS sweeps (sweep TEXT PRIMARY KEY, mgmt TEXT, state TEXT, created REAL)")
+			db.execute("CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, sweep TEXT, collector TEXT, "
+					   "mgmt TEXT, account TEXT, region TEXT, state TEXT, worker TEXT, lease_expires REAL, "
+					   "attempts INTEGER DEFAULT 0, result TEXT, error TEXT, duration REAL, reported INTEGER DEFAULT 0)")
+			db.execute("CREATE INDEX IF NOT EXISTS tasks_by_state ON tasks (sweep, state)")
+
+	def _connection(self):
+		"""
+		SQLite connections can't be shared between threads (or across a fork), so each thread in each process has its own.
+		"""
+		import os
+		import sqlite3
+
+		if getattr(self.Local, 'Pid', None) != os.getpid():
+			self.Local.Connection = sqlite3.connect(self.Path, timeout=60, isolation_level=None)
+			self.Local.Pid = os.getpid()
+		return (self.Local.Connection)
+
+	@contextmanager
+	def _transaction(self):
+		# "IMMEDIATE" takes the write lock up front, so two workers can't both read the same task as free and lease it
+		db = self._connection()
+		db.execute("BEGIN IMMEDIATE")
+		try:
+			yield (db)
+			db.execute("COMMIT")
+		except BaseException:
+			db.execute("ROLLBACK")
+			raise
+
+	@staticmethod
+	def _give_up_on_expired(db, fNow):
+		db.execute("UPDATE tasks SET state = 'failed', error = ? WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+				   (f"Gave up after {WORK_QUEUE_ATTEMPTS} workers took it on without finishing", fNow, WORK_QUEUE_ATTEMPTS))
+
+	def start_sweep(self, fMgmtAccount, fTasks):
+		"""
+		fTasks is a list of (collector name, account number, region), in the order they should be handed out.
+		Returns the new sweep's id.
+		"""
+		import uuid
+		from time import time
+
+		sweep_id = uuid.uuid4().hex
+		with self._transaction() as db:
+			db.execute("INSERT INTO sweeps VALUES (?, ?, 'open', ?)", (sweep_id, fMgmtAccount, time()))
+			db.executemany("INSERT INTO tasks (sweep, collector, mgmt, account, region, state) VALUES (?, ?, ?, ?, ?, 'pending')",
+						   [(sweep_id, collector_name, fMgmtAccount, AccountNumber, region) for collector_name, AccountNumber, region in fTasks])
+		return (sweep_id)
+
+	def end_sweep(self, fSweep, fState='closed'):
+		"""
+		Stops the sweep's tasks being handed out, and tidies them away - the results should already have been taken.
+		"""
+		with self._transaction() as db:
+			db.execute("UPDATE sweeps SET state = ? WHERE sweep = ?", (fState, fSweep))
+			db.execute("DELETE FROM tasks WHERE sweep = ?", (fSweep,))
+
+	def sweep_is_open(self, fSweep):
+		row = self._connection().execute("SELECT state FROM sweeps WHERE sweep = ?", (fSweep,)).fetchone()
+		return (row is not None and row[0] == 'open')
+
+	def leases_held(self, fSweep):
+		"""
+		Returns how many of the sweep's tasks a worker is working on right now (with a lease that hasn't run out).
+		"""
+		from time import time
+
+		return (self._connection().execute("SELECT COUNT(*) FROM tasks WHERE sweep = ? AND state = 'leased' AND lease_expires >= ?",
+										   (fSweep, time())).fetchone()[0])
+
+	def give_up(self, fSweep, fErrorMessage):
+		"""
+		Fails every task of the sweep that hasn't finished yet, with fErrorMessage - the next take_results hands them back.
+		"""
+		with self._transaction() as db:
+			db.execute("UPDATE tasks SET state = 'failed', error = ? WHERE sweep = ? AND state IN ('pending', 'leased')",
+					   (fErrorMessage, fSweep))
+
+	def lease(self, fWorker, fCollectorNames, fMgmtAccount=None, fSweep=None):
+		"""
+		Hands the next free task - one of the collectors named in fCollectorNames, from an open sweep (only fSweep, if
+		it's given) for fMgmtAccount (any, if it's not) - to fWorker for the next WORK_QUEUE_LEASE seconds.
+		Returns the task as a dict of {'Id', 'Sweep', 'Collector', 'MgmtAccount', 'AccountId', 'Region'}, or None if
+		there's nothing to do.
+		"""
+		from time import time
+
+		now = time()
+		query = ("SELECT tasks.id, tasks.sweep, tasks.collector, tasks.mgmt, tasks.account, tasks.region FROM tasks "
+				 "JOIN sweeps ON tasks.sweep = sweeps.sweep WHERE sweeps.state = 'open' "
+				 "AND (tasks.state = 'pending' OR (tasks.state = 'leased' AND tasks.lease_expires < ?)) "
+				 f"AND tasks.collector IN ({', '.join(['?'] * len(fCollectorNames))})")
+		parameters = [now] + list(fCollectorNames)
+		if fMgmtAccount is not None:
+			query += " AND tasks.mgmt = ?"
+			parameters.append(fMgmtAccount)
+		if fSweep is not None:
+			query += " AND tasks.sweep = ?"
+			parameters.append(fSweep)
+		with self._transaction() as db:
+			self._give_up_on_expired(db, now)
+			row = db.execute(f"{query} ORDER BY tasks.id LIMIT 1", parameters).fetchone()
+			if row is None:
+				return (None)
+			db.execute("UPDATE tasks SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+					   (fWorker, now + WORK_QUEUE_LEASE, row[0]))
+		return (dict(zip(['Id', 'Sweep', 'Collector', 'MgmtAccount', 'AccountId', 'Region'], row)))
+
+	def heartbeat(self, fTaskId, fWorker):
+		"""
+		Renews fWorker's lease on the task. Returns False if the lease has already gone to another worker.
+		"""
+		from time import time
+
+		with self._transaction() as db:
+			renewed = db.execute("UPDATE tasks SET lease_expires = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+								 (time() + WORK_QUEUE_LEASE, fTaskId, fWorker)).rowcount
+		return (renewed == 1)
+
+	def finish(self, fTaskId, fWorker, fResult=None, fErrorMessage=None, fDuration=None):
+		"""
+		Posts what fWorker found for the task (fResult is turned into JSON), or the fErrorMessage saying why it couldn't.
+		Returns False if the lease had already gone to another worker, in which case nothing's changed.
+		"""
+		import json
+
+		with self._transaction() as db:
+			finished = db.execute("UPDATE tasks SET state = ?, result = ?, error = ?, duration = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+								  ('failed' if fErrorMessage is not None else 'done', json.dumps(fResult, default=str),
+								   fErrorMessage, fDuration, fTaskId, fWorker)).rowcount
+		return (finished == 1)
+
+	def take_results(self, fSweep):
+		"""
+		Returns the sweep's tasks that have finished (or failed) since the last time this was called, as the result
+		dicts the sweep yields, along with how many tasks are still to do.
+		"""
+		import json
+		from time import time
+
+		with self._transaction() as db:
+			self._give_up_on_expired(db, time())
+			rows = db.execute("SELECT id, mgmt, account, region, state, worker, result, error, duration FROM tasks "
+							  "WHERE sweep = ? AND state IN ('done', 'failed') AND reported = 0", (fSweep,)).fetchall()
+			db.executemany("UPDATE tasks SET reported = 1 WHERE id = ?", [(row[0],) for row in rows])
+			remaining = db.execute("SELECT COUNT(*) FROM tasks WHERE sweep = ? AND state IN ('pending', 'leased')", (fSweep,)).fetchone()[0]
+		Results = [{'MgmtAccount' : mgmt,
+					'AccountId'   : AccountNumber,
+					'Region'      : region,
+					'Success'     : state == 'done',
+					'Result'      : json.loads(result) if state == 'done' else None,
+					'ErrorMessage': error,
+					'Duration'    : duration,
+					'Worker'      : worker}
+				   for _, mgmt, AccountNumber, region, state, worker, result, error, duration in rows]
+		return (Results, remaining)
+
+
+def run_work_queue_worker(fWorkQueue, fCollectors, fGetCredentials, fMaxWorkers=None, fTimeout=None, fMgmtAccount=None,
+						  fSweep=None):
+	"""
+	Works through tasks from the queue until there's nothing left to do.
+	fWorkQueue is a WorkQueue.
+	fCollectors is a dict of {collector name: collector} - the tasks this worker knows how to do. The names need to
+		match what the coordinator used, and so should whatever else the collectors depend on (like a script's filters).
+	fGetCredentials is called as fGetCredentials(account number), and returns the credentials to look in that account
+		with (like get_child_access3 does). They're kept for the rest of the run.
+	fMaxWorkers is how many tasks this worker runs at the same time (defaults to SWEEP_WORKERS)
+	fTimeout is how many seconds any one task may run for, before it's posted as failed (defaults to SWEEP_TIMEOUT)
+	fMgmtAccount, if it's given, means only tasks for that management account are taken.
+	fSweep, if it's given, means only that sweep's tasks are taken, and the worker stops as soon as that sweep's over.
+		Otherwise it takes tasks from any open sweep, and stops once it's found nothing to do for WORK_QUEUE_IDLE seconds.
+
+	If the queue file can't be reached for a moment (it's locked, or on a share that's gone away), the worker logs it
+	and tries again, and only gives up after WORK_QUEUE_IDLE seconds of failing.
+
+	Returns how many tasks it finished.
+	"""
+	import logging
+	import os
+	import socket
+	import sqlite3
+	from time import sleep, time
+
+	if fMaxWorkers is None:
+		fMaxWorkers = SWEEP_WORKERS
+	if fTimeout is None:
+		fTimeout = SWEEP_TIMEOUT
+	# Each thread leases tasks under an id of its own (this one, with its thread number on the end), so the queue can
+	# tell which thread holds which lease
+	worker_id = f"{socket.gethostname()}:{os.getpid()}"
+	Credentials = dict()
+	credential_lock = threading.Lock()
+	AccountLocks = dict()
+	Running = dict()
+	running_lock = threading.Lock()
+	Finished = []
+	stop = threading.Event()
+
+	def credentials_for(fAccountNumber):
+		# Only one thread gets the credentials for an account, while the others wait for it - but getting them for
+		# one account doesn't hold up any other account
+		with credential_lock:
+			account_lock = AccountLocks.setdefault(fAccountNumber, threading.Lock())
+		with account_lock:
+			if fAccountNumber not in Credentials:
+				ocredentials = fGetCredentials(fAccountNumber)
+				ocredentials.setdefault('AccountId', fAccountNumber)
+				Credentials[fAccountNumber] = ocredentials
+			return (Credentials[fAccountNumber])
+
+	def from_queue(fCall, *args, **kwargs):
+		first_failure = None
+		while True:
+			try:
+				return (fCall(*args, **kwargs))
+			except sqlite3.OperationalError as my_Error:
+				now = time()
+				if first_failure is None:
+					first_failure = now
+				if now - first_failure > WORK_QUEUE_IDLE:
+					raise
+				logging.warning(f"Couldn't reach the work queue ({my_Error}) - trying again")
+				sleep(WORK_QUEUE_POLL)
+
+	def keep_leases_alive():
+		while not stop.wait(WORK_QUEUE_HEARTBEAT):
+			now = time()
+			with running_lock:
+				RunningNow = list(Running.items())
+			for task_id, (start_time, thread_worker_id) in RunningNow:
+				try:
+					if now - start_time > fTimeout:
+						# Like the threaded engine, we can't stop the collector, but whatever it finds now is ignored
+						fWorkQueue.finish(task_id, thread_worker_id, fErrorMessage=f"Timed out after {fTimeout} seconds", fDuration=now - start_time)
+						with running_lock:
+							Running.pop(task_id, None)
+					elif not fWorkQueue.heartbeat(task_id, thread_worker_id):
+						logging.warning(f"Lost the lease on task {task_id} to another worker")
+				except sqlite3.OperationalError as my_Error:
+					# We'll try again at the next heartbeat, which is well inside the lease
+					logging.warning(f"Couldn't reach the work queue to keep task {task_id} going: {my_Error}")
+
+	def work(fWorkerId):
+		try:
+			work_until_done(fWorkerId)
+		except sqlite3.OperationalError as my_Error:
+			logging.error(f"Gave up on the work queue after {WORK_QUEUE_IDLE} seconds of not reaching it: {my_Error}")
+
+	def work_until_done(fWorkerId):
+		last_task_time = time()
+		while not stop.is_set():
+			if fSweep is not None and not from_queue(fWorkQueue.sweep_is_open, fSweep):
+				return
+			task = from_queue(fWorkQueue.lease, fWorkerId, list(fCollectors.keys()), fMgmtAccount, fSweep)
+			if task is None:
+				if fSweep is None and time() - last_task_time > WORK_QUEUE_IDLE:
+					return
+				sleep(WORK_QUEUE_POLL)
+				continue
+			begin_time = time()
+			with running_lock:
+				Running[task['Id']] = (begin_time, fWorkerId)
+			try:
+				ocredentials = credentials_for(task['AccountId'])
+				if not ocredentials.get('Success', True):
+					raise RuntimeError(f"Couldn't get credentials for account {task['AccountId']}")
+				ocredentials.setdefault('MgmtAccount', task['MgmtAccount'])
+				Result = fCollectors[task['Collector']](ocredentials, task['Region'])
+			except Exception as my_Error:
+				logging.warning(f"Failed to look in account {task['AccountId']} in region {task['Region']}: {my_Error}")
+				posted = from_queue(fWorkQueue.finish, task['Id'], fWorkerId, fErrorMessage=str(my_Error), fDuration=time() - begin_time)
+			else:
+				posted = from_queue(fWorkQueue.finish, task['Id'], fWorkerId, fResult=Result, fDuration=time() - begin_time)
+			with running_lock:
+				Running.pop(task['Id'], None)
+			if posted:
+				Finished.append(task['Id'])
+			last_task_time = time()
+
+	heartbeat_thread = threading.Thread(target=keep_leases_alive, name='queue-heartbeat', daemon=True)
+	heartbeat_thread.start()
+	WorkerThreads = [threading.Thread(target=work, args=(f"{worker_id}:{thread_number}",), name=f"queue-worker-{thread_number}", daemon=True)
+					 for thread_number in range(fMaxWorkers)]
+	for worker_thread in WorkerThreads:
+		worker_thread.start()
+	try:
+		for worker_thread in WorkerThreads:
+			worker_thread.join()
+	finally:
+		stop.set()
+	logging.info(f"Worker {worker_id} finished {len(Finished)} tasks")
+	return (len(Finished))
+
+
+def _run_local_queue_worker(fQueuePath, fCollectors, fCredentialsByAccount, fMaxWorkers, fTimeout, fSweep):
+	_reset_process_state()
+	run_work_queue_worker(WorkQueue(fQueuePath), fCollectors, lambda fAccountNumber: fCredentialsByAccount[fAccountNumber],
+						  fMaxWorkers, fTimeout, fSweep=fSweep)
+
+
+def run_through_work_queue(fCredentialList, fRegionList, fCollector, fWorkQueue, fTaskName=None, fLocalWorkers=0,
+						   fMaxWorkers=None, fTimeout=None, fJournal=None):
+	"""
+	Does the same sweep as run_across_accounts_and_regions (and takes the same fCredentialList, fRegionList, fCollector
+	and fJournal), but rather than doing the work itself, it puts the (account, region) pairs in fWorkQueue (a WorkQueue)
+	for workers - on this machine or others - to do, and hands back what they find.
+	fTaskName is the name the workers know fCollector by (defaults to the collector's own name). Anything else that
+		changes what the collector does (like a script's filters) belongs in the name too, so a worker that was started
+		with different settings doesn't pick up the task.
+	fLocalWorkers is how many worker processes to start on this machine as well (they're forked, so they already have
+		the collector and the credentials). With none, it's down to workers started elsewhere - see run_work_queue_worker.
+	fMaxWorkers and fTimeout are passed on to the local workers.
+
+	This is a generator - it yields the same dicts as run_across_accounts_and_regions, as the workers post them, with
+	the 'Worker' that did each one as well. If whoever's reading stops early, the sweep's tasks are taken back out of
+	the queue. A global collector is only queued once for each account.
+	If tasks are left but no worker has held any of them for WORK_QUEUE_STALL seconds (the local workers have all
+	died, say, and there aren't any elsewhere), the rest come back as failed, rather than us waiting forever.
+	"""
+	import logging
+	from multiprocessing import get_all_start_methods, get_context
+	from time import sleep, time
+
+	global_regions = _regions_for_global_collector(fCollector, fCredentialList, fRegionList)
+	if global_regions is not None:
+		CallRegions, AllRegions = global_regions
+		yield from _attach_to_all_regions(run_through_work_queue(fCredentialList, CallRegions, fCollector, fWorkQueue, fTaskName, fLocalWorkers,
+																 fMaxWorkers, fTimeout, fJournal), AllRegions)
+		return
+	if fTaskName is None:
+		fTaskName = _collector_name(fCollector)
+	Places = _places_to_look(fCredentialList, fRegionList)
+	ResumedTasks, PlacesLeft = _resume_from_journal(fJournal, fCollector, Places)
+	MgmtAccounts = set([ocredentials.get('MgmtAccount') for ocredentials, _, _ in PlacesLeft])
+	sweep_id = fWorkQueue.start_sweep(MgmtAccounts.pop() if len(MgmtAccounts) == 1 else None,
+									  [(fTaskName, AccountNumber, region) for _, AccountNumber, region in order_longest_first(fCollector, PlacesLeft)])
+	logging.info(f"Put {len(PlacesLeft)} account / region pairs in the work queue {fWorkQueue.Path}, as sweep {sweep_id}")
+	WorkerProcesses = []
+	if fLocalWorkers > 0:
+		if 'fork' not in get_all_start_methods():
+			logging.warning("This platform can't fork, so no workers will be started here - it's down to the workers elsewhere")
+		else:
+			mp_context = get_context('fork')
+			CredentialsByAccount = {AccountNumber: ocredentials for ocredentials, AccountNumber, _ in PlacesLeft}
+			for worker_number in range(fLocalWorkers):
+				worker_process = mp_context.Process(target=_run_local_queue_worker, name=f"queue-worker-{worker_number}",
+													args=(fWorkQueue.Path, {fTaskName: fCollector}, CredentialsByAccount,
+														  fMaxWorkers, fTimeout, sweep_id))
+				worker_process.start()
+				WorkerProcesses.append(worker_process)
+	finished = False
+	try:
+		for task in ResumedTasks:
+			yield (task)
+		remaining = len(PlacesLeft)
+		last_progress_time = time()
+		while remaining > 0:
+			Results, remaining = fWorkQueue.take_results(sweep_id)
+			if len(Results) > 0:
+				last_progress_time = time()
+			for task in Results:
+				if task['Success']:
+					record_task_timing(fCollector, task['AccountId'], task['Region'], task['Duration'],
+									   len(task['Result']) if isinstance(task['Result'], list) else None)
+					if fJournal is not None:
+						fJournal.record(fCollector, task)
+				else:
+					logging.warning(f"Failed to look in account {task['AccountId']} in region {task['Region']}: {task['ErrorMessage']}")
+					if task.get('Duration') is not None:
+						record_task_timing(fCollector, task['AccountId'], task['Region'], task['Duration'])
+				yield (task)
+			if remaining > 0:
+				if len(WorkerProcesses) > 0 and not any([worker_process.is_alive() for worker_process in WorkerProcesses]):
+					logging.warning(f"All the local workers have exited, with {remaining} tasks still waiting for a worker elsewhere")
+					WorkerProcesses = []
+				if fWorkQueue.leases_held(sweep_id) > 0:
+					# Something's still being worked on, so there's no reason to think nobody's coming
+					last_progress_time = time()
+				elif time() - last_progress_time > WORK_QUEUE_STALL:
+					# With no worker left (here or elsewhere), we'd wait forever - so what's left comes back as failed
+					logging.error(f"No worker has touched the {remaining} tasks left in the work queue for {WORK_QUEUE_STALL} seconds, so we're giving up on them")
+					fWorkQueue.give_up(sweep_id, f"No worker picked this up within {WORK_QUEUE_STALL} seconds")
+					continue
+				sleep(WORK_QUEUE_POLL)
+		finished = True
+	finally:
+		fWorkQueue.end_sweep(sweep_id, 'closed' if finished else 'cancelled')
+		for worker_process in WorkerProcesses:
+			worker_process.join(timeout=WORK_QUEUE_POLL * 5)
+			if worker_process.is_alive():
+				worker_process.terminate()
+				worker_process.join()
+		save_caches()
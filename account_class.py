@@ -32,16 +32,22 @@ So if we created a class object that represented the account:
 """
 import boto3
 import logging
+import threading
 from botocore.exceptions import ProfileNotFound, ClientError
 
 
-def _validate_region(faws_prelim_session, fRegion=None):
+def _validate_region(faws_acct, fRegion=None):
+	"""
+	Checks that fRegion is a real AWS region, and that the account has opted into it.
+	The answer comes from the account's region catalogue (Inventory_Modules.get_region_catalogue), which holds the
+	OptInStatus of every region, and is cached - so this usually doesn't cost an API call at all.
+	"""
 	import logging
-	from botocore.exceptions import CredentialRetrievalError, ClientError
+	from botocore.exceptions import BotoCoreError, CredentialRetrievalError, ClientError
+	from Inventory_Modules import get_region_catalogue, OPTED_IN_STATUSES
 
 	try:
-		client_region = faws_prelim_session.client('ec2')
-		all_regions_list = [region_name['RegionName'] for region_name in client_region.describe_regions(AllRegions=True)['Regions']]
+		region_catalogue = get_region_catalogue(faws_acct)
 	except ClientError as myError:
 		message = (f"Access using these credentials didn't work. "
 		           f"Error Message: {myError}")
@@ -58,16 +64,25 @@ def _validate_region(faws_prelim_session, fRegion=None):
 			'Message': message,
 			'Region': fRegion}
 		return (result)
+	except BotoCoreError as myError:
+		message = (f"Couldn't reach EC2 to check the region. "
+		           f"Error Message: {myError}")
+		result = {
+			'Success': False,
+			'Message': message,
+			'Region': fRegion}
+		return (result)
 	if fRegion is None:  # Why are you trying to validate a region, and then didn't supply a region?
 		logging.info(f"No region supplied to check. Defaulting to 'us-east-1'")
 		fRegion = 'us-east-1'
-	if fRegion in all_regions_list:
+	if fRegion in region_catalogue.keys():
 		logging.info(f"{fRegion} is a valid region within AWS")
 		valid_region = True
 	else:
 		logging.info(f"{fRegion} is not a valid region within AWS. Maybe check the spelling?")
 		valid_region = False
-	region_info = client_region.describe_regions(Filters=[{'Name': 'region-name', 'Values': [fRegion]}])['Regions']
+	region_info = [region_name for region_name, opt_in_status in region_catalogue.items()
+	               if region_name == fRegion and opt_in_status in OPTED_IN_STATUSES]
 	if len(region_info) == 0:
 		if valid_region:
 			message = f"While '{fRegion}' is a valid AWS region, this account has not opted into this region"
@@ -103,120 +118,156 @@ class aws_acct_access:
 		creds: The credentials used to get into the account
 		Region: The region used to authenticate into this account. Important to find out if certain regions are allowed (opted-in).
 		ChildAccounts: If the account is a "Root", this is a listing of the child accounts
+		AccountStatus, AccountType, MgmtAccount, OrgID, MgmtEmail and ChildAccounts are only looked up the first time they're used.
+	Functions:
+		copy_org_details: Re-use the Org details already looked up by another object for the same account
+		learned_child_roles: The role that last worked to get into each child account
 	"""
 	def __init__(self, fProfile=None, fRegion='us-east-1', ocredentials=None):
+		from Inventory_Modules import share_model_loader, get_refreshable_session
+
 		logging.basicConfig(format="[%(filename)s:%(lineno)s - %(funcName)s() ] %(message)s")
-		# First thing's first: We need to validate that the region they sent us to use is valid for this account.
-		# Otherwise, all hell will break if it's not.
-		UsingKeys = False
-		UsingSessionToken = False
+		# Building the object only costs the one STS call that finds the account number.
+		# The region validation, the Org attributes and the child accounts are all looked up the first time they're used.
+		if fRegion is None:
+			fRegion = 'us-east-1'
+		self.Region = fRegion
+		self._attribute_lock = threading.RLock()
+		self._RegionValidation = None
+		self._AccountAttributes = None
+		self._ChildAccounts = None
+		self._Credentials = None
 		account_access_successful = False
-		account_and_region_access_successful = False
 		if ocredentials is not None and ocredentials['Success']:
 			# Trying to instantiate a class, based on passed in credentials
-			UsingKeys = True
-			UsingSessionToken = False
-			if 'SessionToken' in ocredentials:
+			if ocredentials.get('RefreshableCredentials') is not None:
+				# Credentials from get_child_access3 can renew themselves, so long-running work doesn't lose access
+				logging.debug("Credentials are refreshable")
+				self.session = get_refreshable_session(ocredentials['RefreshableCredentials'], fRegion)
+			elif 'SessionToken' in ocredentials:
 				# Using a token-based role
-				UsingSessionToken = True
-				prelim_session = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
-				                               aws_secret_access_key=ocredentials['SecretAccessKey'],
-				                               aws_session_token=ocredentials['SessionToken'],
-				                               region_name='us-east-1')
-				account_access_successful = True
+				logging.debug("Credentials are using SessionToken")
+				self.session = share_model_loader(boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
+				                                                aws_secret_access_key=ocredentials['SecretAccessKey'],
+				                                                aws_session_token=ocredentials['SessionToken'],
+				                                                region_name=fRegion))
 			else:
 				# Not using a token-based role
-				prelim_session = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
-				                               aws_secret_access_key=ocredentials['SecretAccessKey'],
-				                               region_name='us-east-1')
-				account_access_successful = True
+				logging.debug("Credentials are using Keys, but no SessionToken")
+				self.session = share_model_loader(boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
+				                                                aws_secret_access_key=ocredentials['SecretAccessKey'],
+				                                                region_name=fRegion))
+			account_access_successful = True
 		else:
 			# Not trying to use account_key_credentials
 			try:
-				prelim_session = boto3.Session(profile_name=fProfile, region_name='us-east-1')
+				logging.debug("Credentials are using a profile")
+				self.session = share_model_loader(boto3.Session(profile_name=fProfile, region_name=fRegion))
 				account_access_successful = True
 			except ProfileNotFound as my_Error:
 				ErrorMessage = (f"The profile {fProfile} wasn't found. Perhaps there was a typo?"
 				                f"Error Message: {my_Error}")
 				logging.error(ErrorMessage)
 				account_access_successful = False
-		if account_access_successful:
-			try:
-				result = _validate_region(prelim_session, fRegion)
-				if result['Success'] is True:
-					if UsingSessionToken:
-						logging.debug("Credentials are using SessionToken")
-						self.session = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
-						                             aws_secret_access_key=ocredentials['SecretAccessKey'],
-						                             aws_session_token=ocredentials['SessionToken'],
-						                             region_name=result['Region'])
-					elif UsingKeys:
-						logging.debug("Credentials are using Keys, but no SessionToken")
-						self.session = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
-						                             aws_secret_access_key=ocredentials['SecretAccessKey'],
-						                             region_name=result['Region'])
-					else:
-						logging.debug("Credentials are using a profile")
-						self.session = boto3.Session(profile_name=fProfile, region_name=result['Region'])
-					account_and_region_access_successful = True
-					self.AccountStatus = 'ACTIVE'
-				else:
-					logging.error(result['Message'])
-					account_and_region_access_successful = False
-					self.AccountStatus = 'INACTIVE'
-			except ProfileNotFound as my_Error:
-				logging.error(f"Profile {fProfile} not found. Please ensure this profile is valid within your system.")
-				logging.info(f"Error: {my_Error}")
-				account_and_region_access_successful = False
 
 		logging.info(f"Capturing Account Information for profile {fProfile}...")
-		if not account_and_region_access_successful:
-			logging.error(f"Didn't find information for profile {fProfile} as something failed")
-		else:
-			logging.info(f"Successfully validated access to account in region {fRegion}")
-		if account_and_region_access_successful:
+		if account_access_successful:
 			self.acct_number = self.acct_num()
-			self._AccountAttributes = self.find_account_attr()
-			logging.info(f"Found {len(self._AccountAttributes)} attributes in this account")
-			self.AccountType = self._AccountAttributes['AccountType']
-			self.MgmtAccount = self._AccountAttributes['MasterAccountId']
-			self.OrgID = self._AccountAttributes['OrgId']
-			self.MgmtEmail = self._AccountAttributes['ManagementEmail']
-			logging.info(f"Account {self.acct_number} is a {self.AccountType} account")
-			self.creds = self.session._session._credentials.get_frozen_credentials()
-			if self.AccountType.lower() == 'root':
-				logging.info("Enumerating all of the child accounts")
-				self.ChildAccounts = self.find_child_accounts()
-				logging.debug(f"As acct {self.acct_number} is the root account, we found {len(self.ChildAccounts)} accounts in the Org")
-
+			account_access_successful = not self.acct_number == 'Failure'
+		if account_access_successful:
+			logging.info(f"Successfully accessed account {self.acct_number}")
+			self._Credentials = self.session._session.get_credentials()
+		else:
+			if ocredentials is not None:
+				logging.error(f"Credentials for account {ocredentials.get('AccountNumber')} failed to successfully access an account")
 			else:
-				self.ChildAccounts = self.find_child_accounts()
-		elif fProfile is not None:
-			logging.error(f"Profile {fProfile} failed to successfully access an account")
-			self.AccountType = 'Unknown'
-			self.MgmtAccount = 'Unknown'
-			self.OrgID = 'Unknown'
-			self.MgmtEmail = 'Unknown'
-			self.creds = 'Unknown'
-		elif ocredentials is not None:
-			logging.error(f"Credentials for access_key {ocredentials['AccountNum']} failed to successfully access an account")
-			self.AccountType = 'Unknown'
-			self.MgmtAccount = 'Unknown'
-			self.OrgID = 'Unknown'
-			self.MgmtEmail = 'Unknown'
-			self.creds = 'Unknown'
+				logging.error(f"Profile {fProfile} failed to successfully access an account")
+			self._RegionValidation = {'Success': False,
+			                          'Message': "Couldn't access the account, so couldn't check the region",
+			                          'Region' : fRegion}
+			self._AccountAttributes = {'AccountType'    : 'Unknown',
+			                           'MasterAccountId': 'Unknown',
+			                           'OrgId'          : 'Unknown',
+			                           'ManagementEmail': 'Unknown'}
+			self._ChildAccounts = []
+			self._Credentials = None
+
+	@property
+	def creds(self):
+		"""
+		The current access key, secret key and token for the account. If the session's credentials can refresh themselves
+		(assumed roles, SSO and the credentials from get_child_access3), this hands back the renewed ones once they've rolled over.
+		"""
+		if self._Credentials is None:
+			return ('Unknown')
+		return (self._Credentials.get_frozen_credentials())
+
+	@property
+	def AccountStatus(self):
+		"""
+		'ACTIVE' if the account is opted into the region this object was built with, otherwise 'INACTIVE'.
+		The region is validated (against the account's cached region catalogue) the first time this is asked for.
+		"""
+		with self._attribute_lock:
+			if self._RegionValidation is None:
+				self._RegionValidation = _validate_region(self, self.Region)
+				if not self._RegionValidation['Success']:
+					logging.error(self._RegionValidation['Message'])
+		return ('ACTIVE' if self._RegionValidation['Success'] else 'INACTIVE')
+
+	def _account_attributes(self):
+		"""
+		Calls find_account_attr (one describe_organization) the first time it's needed, and remembers the answer.
+		"""
+		with self._attribute_lock:
+			if self._AccountAttributes is None:
+				self._AccountAttributes = self.find_account_attr()
+				logging.info(f"Account {self.acct_number} is a {self._AccountAttributes['AccountType']} account")
+		return (self._AccountAttributes)
+
+	@property
+	def AccountType(self):
+		return (self._account_attributes()['AccountType'])
+
+	@property
+	def MgmtAccount(self):
+		return (self._account_attributes()['MasterAccountId'])
+
+	@property
+	def OrgID(self):
+		return (self._account_attributes()['OrgId'])
+
+	@property
+	def MgmtEmail(self):
+		return (self._account_attributes()['ManagementEmail'])
+
+	@property
+	def ChildAccounts(self):
+		"""
+		Enumerates the child accounts (see find_child_accounts) the first time they're needed, and remembers them.
+		A cached list of the Org's accounts is checked for changes first, which costs a call or two rather than a full
+		enumeration.
+		"""
+		with self._attribute_lock:
+			if self._ChildAccounts is None:
+				logging.info("Enumerating all of the child accounts")
+				self._ChildAccounts = self.find_child_accounts(fCheckForChanges=True)
+				logging.debug(f"Found {len(self._ChildAccounts)} accounts for acct {self.acct_number}")
+		return (self._ChildAccounts)
 
 	def acct_num(self):
 		"""
 		This function returns a string of the account's 12 digit account number
 		"""
 		import logging
-		from botocore.exceptions import ClientError, CredentialRetrievalError
+		from botocore.exceptions import BotoCoreError, ClientError, CredentialRetrievalError
 
 		try:
 			aws_session = self.session
 			logging.info(f"Accessing session object to find its account number")
-			client_sts = aws_session.client('sts')
+			# Always asked of us-east-1, so a mistyped region (or one the account hasn't opted into) doesn't stop us
+			# finding the account - the region's problems show up in AccountStatus instead
+			client_sts = aws_session.client('sts', region_name='us-east-1')
 			response = client_sts.get_caller_identity()
 			creds = response['Account']
 		except ClientError as my_Error:
@@ -239,6 +290,9 @@ class aws_acct_access:
 				print(my_Error)
 				pass
 			creds = "Failure"
+		except BotoCoreError as my_Error:
+			logging.error(f"Couldn't reach STS to find the account number: {my_Error}")
+			creds = "Failure"
 		return (creds)
 
 	def find_account_attr(self):
@@ -297,7 +351,7 @@ class aws_acct_access:
 			pass
 		return (function_response)
 
-	def find_child_accounts(self):
+	def find_child_accounts(self, fForceRefresh=False, fCheckForChanges=False):
 		"""
 		This is an example of the list response from this call:
 			[
@@ -306,45 +360,58 @@ class aws_acct_access:
 			{'MgmtAccount':'<12 digit number>', 'AccountId': 'zzzzzzzzzzzz', 'AccountEmail': 'EmailAddr3@example.com', 'AccountStatus': 'SUSPENDED'}
 			]
 		This can be convenient for appending and removing.
+		The Org's accounts come from the shared cache in Inventory_Modules.get_org_accounts (keyed by the Org ID), so
+		scripts run against the same Org within ORG_CACHE_TTL seconds don't have to enumerate it again.
+		fForceRefresh and fCheckForChanges are passed along to get_org_accounts.
 		"""
 		import logging
 		from botocore.exceptions import ClientError
+		from Inventory_Modules import get_org_accounts
 
 		child_accounts = []
-		if self.find_account_attr()['AccountType'].lower() == 'root':
+		if self.AccountType.lower() == 'root':
 			try:
-				session_org = self.session
-				client_org = session_org.client('organizations')
-				response = client_org.list_accounts()
-				theresmore = True
 				logging.info(f"Enumerating Account info for account: {self.acct_number}")
-				while theresmore:
-					for account in response['Accounts']:
-						child_accounts.append({'MgmtAccount': self.acct_number,
-						                       'AccountId': account['Id'],
-						                       'AccountEmail': account['Email'],
-						                       'AccountStatus': account['Status']})
-					if 'NextToken' in response:
-						theresmore = True
-						response = client_org.list_accounts(NextToken=response['NextToken'])
-					else:
-						theresmore = False
+				for account in get_org_accounts(self.OrgID, lambda: self.session.client('organizations'), fForceRefresh, fCheckForChanges):
+					child_accounts.append({'MgmtAccount': self.acct_number,
+					                       'AccountId': account['Id'],
+					                       'AccountEmail': account['Email'],
+					                       'AccountStatus': account['Status']})
 				return (child_accounts)
 			except ClientError as my_Error:
-				logging.warning(f"Account {self.acct_num()} doesn't represent an Org Root account")
+				logging.warning(f"Account {self.acct_number} doesn't represent an Org Root account")
 				logging.debug(my_Error)
 				return ()
-		elif self.find_account_attr()['AccountType'].lower() in ['standalone', 'child']:
-			child_accounts.append({'MgmtAccount': self.acct_num(),
-			                       'AccountId': self.acct_num(),
+		elif self.AccountType.lower() in ['standalone', 'child']:
+			child_accounts.append({'MgmtAccount': self.acct_number,
+			                       'AccountId': self.acct_number,
 			                       'AccountEmail': 'Not an Org Management Account',
 			                       # We know the account is ACTIVE because if it was SUSPENDED, we wouldn't have gotten a valid response from the org_root check
 			                       'AccountStatus': 'ACTIVE'})
 			return (child_accounts)
 		else:
-			logging.warning(f"Account {self.acct_num()} suffered a crisis of identity")
+			logging.warning(f"Account {self.acct_number} suffered a crisis of identity")
 			return ()
 
+	def copy_org_details(self, faws_acct):
+		"""
+		Re-uses the Org attributes (and the child accounts, if they've already been enumerated) from another object
+		for the same account, so that several profiles into one account only ask Organizations once.
+		"""
+		with self._attribute_lock:
+			self._AccountAttributes = faws_acct._account_attributes()
+			if faws_acct._ChildAccounts is not None:
+				self._ChildAccounts = faws_acct._ChildAccounts
+
+	def learned_child_roles(self):
+		"""
+		Returns a dict of {AccountId: RoleName} with the role that last worked to get into each child account from this account.
+		This is the same map that Inventory_Modules.get_child_access3 learns from, and tries first.
+		"""
+		from Inventory_Modules import get_learned_roles
+
+		return (get_learned_roles(self.acct_number))
+
 	def __str__(self):
 		return(f"Account #{self.acct_number} is a {self.AccountType} account with {len(self.ChildAccounts)-1} child accounts")
 
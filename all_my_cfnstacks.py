@@ -6,8 +6,8 @@ from pprint import pprint
 from ArgumentsClass import CommonArguments
 from account_class import aws_acct_access
 from colorama import init, Fore
-from botocore.exceptions import ClientError
 import logging
+import sys
 
 init()
 
@@ -16,6 +16,9 @@ parser.singleprofile()      # Allows for a single profile to be specified
 parser.multiregion()        # Allows for multiple regions to be specified at the command line
 parser.verbosity()          # Allows for the verbosity to be handled.
 parser.extendedargs()       # Allows for extended arguments like which accounts to skip, and whether Force is enabled.
+parser.concurrency()        # Allows for tuning how many accounts and regions we look at, at the same time
+parser.resume()             # Allows for picking up where an interrupted run left off
+parser.workqueue()          # Allows for splitting the work across several machines
 parser.my_parser.add_argument(
 	"-f", "--fragment",
 	dest="stackfrag",
@@ -43,12 +46,28 @@ args = parser.my_parser.parse_args()
 pProfile = args.Profile
 pRegionList = args.Regions
 AccountsToSkip = args.SkipAccounts
+pCredentialWorkers = args.CredentialWorkers
+pWorkers = args.Workers
+pTaskTimeout = args.TaskTimeout
+pEngine = args.Engine
+pResume = args.Resume
+pJournal = args.Journal
+pWorkQueue = args.WorkQueue
+pQueueWorkers = args.QueueWorkers
+pQueueWorker = args.QueueWorker
 verbose = args.loglevel
 pstackfrag = args.stackfrag
 pstatus = args.status
 pStackIdFlag = args.stackid
 DeletionRun = args.DeletionRun
 logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)30s() ] %(message)s")
+Inventory_Modules.set_rate_limits(args.RateLimits)
+Inventory_Modules.set_client_config(args.RetryMode, args.MaxAttempts, args.ConnectTimeout, args.ReadTimeout, args.PoolSize)
+
+if DeletionRun and pResume:
+	# Stacks from the journal carry the status they had when the interrupted run found them, which may not be true anymore
+	logging.critical("--resume can't be used with +delete, since the stacks found before the interruption may have changed since. Exiting.")
+	sys.exit(1)
 
 ##########################
 ERASE_LINE = '\x1b[2K'
@@ -58,6 +77,23 @@ RegionList = Inventory_Modules.get_service_regions('cloudformation', pRegionList
 ChildAccounts = Inventory_Modules.RemoveCoreAccounts(ChildAccounts, AccountsToSkip)
 AccountList = [account['AccountId'] for account in ChildAccounts]
 
+
+def find_stacks(c_account_credentials, c_region):
+	Stacks = Inventory_Modules.find_stacks2(c_account_credentials, c_region, pstackfrag, pstatus)
+	logging.warning(f"Account: {c_account_credentials['AccountId']} | Region: {c_region} | Found {len(Stacks)} Stacks")
+	return (Stacks)
+
+
+# The filters are part of the task's name, so a worker only picks up the tasks it would have found the same things for
+TaskName = f"all_my_cfnstacks:{pstackfrag}:{pstatus}"
+if pWorkQueue is not None and pQueueWorker:
+	print(f"Working on tasks from the queue {Fore.RED}{pWorkQueue}{Fore.RESET} for account {aws_acct.acct_number}...")
+	TasksDone = Inventory_Modules.run_work_queue_worker(Inventory_Modules.WorkQueue(pWorkQueue), {TaskName: find_stacks},
+														lambda fAccountNumber: Inventory_Modules.get_child_access3(aws_acct, fAccountNumber),
+														pWorkers, pTaskTimeout, fMgmtAccount=aws_acct.acct_number)
+	print(f"Finished {TasksDone} tasks, and there's nothing left to do")
+	sys.exit(0)
+
 print(f"You asked to find stacks with this fragment {Fore.RED}'{pstackfrag}'{Fore.RESET}")
 print(f"in these accounts:\n{Fore.RED}{AccountList}{Fore.RESET}")
 print(f"in these regions:\n{Fore.RED}{RegionList}{Fore.RESET}")
@@ -81,44 +117,47 @@ StacksFound = []
 aws_session = aws_acct.session
 sts_client = aws_session.client('sts')
 item_counter = 0
-for account_number in AccountList:
-	try:
-		account_credentials = Inventory_Modules.get_child_access3(aws_acct, account_number)
-	except ClientError as my_Error:
-		if str(my_Error).find("AuthFailure") > 0:
-			print(f"{pProfile}: Authorization Failure for account {account_number}")
-		elif str(my_Error).find("AccessDenied") > 0:
-			print(f"{pProfile}: Access Denied Failure for account {account_number}")
-		else:
-			print(f"{pProfile}: Other kind of failure for account {account_number}")
-			print(my_Error)
+
+CredentialList = Inventory_Modules.get_credentials_for_accounts_in_org(aws_acct, AccountsToSkip, fMaxWorkers=pCredentialWorkers)
+# Only the regions each account has opted into
+StackRegions = Inventory_Modules.get_service_region_matrix(CredentialList, ['cloudformation'], RegionList)['cloudformation']
+PlacesToLook = sum([len(regions) for regions in StackRegions.values()])
+# With --journal (or --resume), remembers each account and region as it's finished, so a later --resume can skip them if this run doesn't make it to the end
+Journal = None
+if pResume or pJournal:
+	Journal = Inventory_Modules.SweepJournal(f"all_my_cfnstacks-{aws_acct.acct_number}-{pstackfrag}-{pstatus}", pResume)
+if pWorkQueue is not None:
+	StackResults = Inventory_Modules.run_through_work_queue(CredentialList, StackRegions, find_stacks, Inventory_Modules.WorkQueue(pWorkQueue),
+															TaskName, pQueueWorkers, pWorkers, pTaskTimeout, fJournal=Journal)
+else:
+	StackResults = Inventory_Modules.run_across_accounts_and_regions(CredentialList, StackRegions, find_stacks, pWorkers, pTaskTimeout, pEngine,
+																	 fJournal=Journal)
+for result in StackResults:
+	item_counter += 1
+	account_number = result['AccountId']
+	region = result['Region']
+	if not result['Success']:
+		print(f"{account_number}: Failure in region {region}")
+		logging.warning(result['ErrorMessage'])
 		continue
-	for region in RegionList:
-		item_counter += 1
-		Stacks = False
-		try:
-			Stacks = Inventory_Modules.find_stacks2(account_credentials, region, pstackfrag, pstatus)
-			logging.warning(f"Account: {account_number} | Region: {region} | Found {len(Stacks)} Stacks")
-			print(f"{ERASE_LINE}{Fore.RED}Account: {account_number} Region: {region} Found {len(Stacks)} Stacks{Fore.RESET} ({item_counter} of {len(AccountList) * len(RegionList)})", end='\r')
-		except ClientError as my_Error:
-			if str(my_Error).find("AuthFailure") > 0:
-				print(f"{account_number}: Authorization Failure")
-		# TODO: Currently we're using this "Stacks" list as a boolean if it's populated. We should change this.
-		if Stacks and len(Stacks) > 0:
-			for y in range(len(Stacks)):
-				StackName = Stacks[y]['StackName']
-				StackStatus = Stacks[y]['StackStatus']
-				StackID = Stacks[y]['StackId']
-				if pStackIdFlag:
-					print(fmt % (account_number, region, StackStatus, StackName, StackID))
-				else:
-					print(fmt % (account_number, region, StackStatus, StackName))
-				StacksFound.append({
-					'Account': account_number,
-					'Region': region,
-					'StackName': StackName,
-					'StackStatus': StackStatus,
-					'StackArn': StackID})
+	Stacks = result['Result']
+	print(f"{ERASE_LINE}{Fore.RED}Account: {account_number} Region: {region} Found {len(Stacks)} Stacks{Fore.RESET} ({item_counter} of {PlacesToLook})", end='\r')
+	for y in range(len(Stacks)):
+		StackName = Stacks[y]['StackName']
+		StackStatus = Stacks[y]['StackStatus']
+		StackID = Stacks[y]['StackId']
+		if pStackIdFlag:
+			print(fmt % (account_number, region, StackStatus, StackName, StackID))
+		else:
+			print(fmt % (account_number, region, StackStatus, StackName))
+		StacksFound.append({
+			'Account': account_number,
+			'Region': region,
+			'StackName': StackName,
+			'StackStatus': StackStatus,
+			'StackArn': StackID})
+if Journal is not None:
+	Journal.close()
 lAccounts = []
 lRegions = []
 lAccountsAndRegions = []
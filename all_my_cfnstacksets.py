@@ -5,7 +5,6 @@ import Inventory_Modules
 from ArgumentsClass import CommonArguments
 from account_class import aws_acct_access
 from colorama import init, Fore
-from botocore.exceptions import ClientError
 
 init()
 
@@ -13,6 +12,7 @@ parser = CommonArguments()
 parser.singleprofile()  # Allows for a single profile to be specified
 parser.multiregion()  # Allows for multiple regions to be specified at the command line
 parser.rootOnly()
+parser.concurrency()  # Allows for tuning how many accounts and regions we look at, at the same time
 parser.verbosity()  # Allows for the verbosity to be handled.
 parser.my_parser.add_argument(
 	"-f", "--fragment",
@@ -39,10 +39,16 @@ pProfile = args.Profile
 pRegionList = args.Regions
 pInstanceCount = args.pinstancecount
 pRootOnly = args.RootOnly
+pWorkers = args.Workers
+pCredentialWorkers = args.CredentialWorkers
+pTaskTimeout = args.TaskTimeout
+pEngine = args.Engine
 verbose = args.loglevel
 pstackfrag = args.pstackfrag
 pstatus = args.pstatus
 logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s")
+Inventory_Modules.set_rate_limits(args.RateLimits)
+Inventory_Modules.set_client_config(args.RetryMode, args.MaxAttempts, args.ConnectTimeout, args.ReadTimeout, args.PoolSize)
 
 aws_acct = aws_acct_access(pProfile)
 if pRootOnly:
@@ -67,49 +73,38 @@ else:
 	print(fmt % ("-------", "------", "------", "-------------"))
 RegionList = Inventory_Modules.get_ec2_regions3(aws_acct, pRegionList)
 
-sts_session = aws_acct.session
-sts_client = sts_session.client('sts')
-account_credentials = {'AccessError': False}  # This shouldn't matter, but makes the IDE checker happy.
-for account in ChildAccounts:
-	try:
-		account_credentials = Inventory_Modules.get_child_access3(aws_acct, account['AccountId'])
-		if account_credentials['AccessError']:
-			logging.error(f"Accessing account {account['AccountId']} didn't work, so we're skipping it")
-			continue
-	except ClientError as my_Error:
-		if str(my_Error).find("AuthFailure") > 0 or str(my_Error).find("AccessDenied") > 0:
-			logging.error("%s: Authorization Failure for account %s", pProfile, account['AccountId'])
-			continue
+
+def find_stacksets(c_account_credentials, c_region):
+	StackSets = Inventory_Modules.find_stacksets2(c_account_credentials, c_region, pstackfrag, pstatus)
+	logging.warning(f"Account: {c_account_credentials['AccountId']} | Region: {c_region} | Found {len(StackSets)} Stacksets")
+	if pInstanceCount:
+		for stackset in StackSets:
+			stackset['InstanceCount'] = len(Inventory_Modules.find_stack_instances2(c_account_credentials, c_region, stackset['StackSetName']))
+	return (StackSets)
+
+
+CredentialList = Inventory_Modules.get_credentials_for_accounts_in_org(aws_acct, fRootOnly=pRootOnly, fMaxWorkers=pCredentialWorkers)
+# Only the regions each account has opted into
+StackSetRegions = Inventory_Modules.get_service_region_matrix(CredentialList, ['cloudformation'], RegionList)['cloudformation']
+for result in Inventory_Modules.run_across_accounts_and_regions(CredentialList, StackSetRegions, find_stacksets, pWorkers, pTaskTimeout, pEngine):
+	if not result['Success']:
+		print(f"{result['AccountId']}: Failure in region {result['Region']}")
+		logging.warning(result['ErrorMessage'])
+		continue
+	StackSets = result['Result']
+	if not StackSets:
+		logging.info(
+			f"We connected to account {result['AccountId']} in region {result['Region']}, but found no stacksets")
+	else:
+		print(
+			f"{ERASE_LINE}{Fore.RED}Account: {result['AccountId']} Region: {result['Region']} Found {len(StackSets)} Stacksets{Fore.RESET}",
+			end="\r")
+	for stackset in StackSets:
+		if pInstanceCount:
+			print(fmt % (result['AccountId'], result['Region'], stackset['Status'], stackset['StackSetName'], stackset['InstanceCount']))
 		else:
-			print(my_Error)
-			break
-	# logging.info(f"Account Creds: {account_credentials}")
-	for region in RegionList:
-		try:
-			print(
-				f"{ERASE_LINE}{Fore.RED}Checking Account: {account['AccountId']} Region: {region} for stacksets matching {pstackfrag} with status: {pstatus}{Fore.RESET}",
-				end="\r")
-			StackSets = Inventory_Modules.find_stacksets2(account_credentials, region, pstackfrag, pstatus)
-			logging.warning(f"Account: {account['AccountId']} | Region: {region} | Found {len(StackSets)} Stacksets")
-			if not StackSets:
-				logging.info(
-					f"We connected to account {account['AccountId']} in region {region}, but found no stacksets")
-			else:
-				print(
-					f"{ERASE_LINE}{Fore.RED}Account: {account['AccountId']} Region: {region} Found {len(StackSets)} Stacksets{Fore.RESET}",
-					end="\r")
-			for y in range(len(StackSets)):
-				StackName = StackSets[y]['StackSetName']
-				StackStatus = StackSets[y]['Status']
-				if pInstanceCount:
-					ListOfStackInstances = Inventory_Modules.find_stack_instances2(account_credentials, region, StackName)
-					print(fmt % (account['AccountId'], region, StackStatus, StackName, len(ListOfStackInstances)))
-				else:
-					print(fmt % (account['AccountId'], region, StackStatus, StackName))
-				NumStacksFound += 1
-		except ClientError as my_Error:
-			if str(my_Error).find("AuthFailure") > 0:
-				print(f"{account['AccountId']}: Authorization Failure")
+			print(fmt % (result['AccountId'], result['Region'], stackset['Status'], stackset['StackSetName']))
+		NumStacksFound += 1
 print(ERASE_LINE)
 print(
 	f"{Fore.RED}Found {NumStacksFound} Stacksets across {len(ChildAccounts)} accounts across {len(RegionList)} regions{Fore.RESET}")
@@ -3,11 +3,11 @@
 import Inventory_Modules
 from Inventory_Modules import get_credentials_for_accounts_in_org
 from colorama import init, Fore
-from botocore.exceptions import ClientError
 from ArgumentsClass import CommonArguments
 from account_class import aws_acct_access
 
 import logging
+import threading
 
 init()
 
@@ -16,6 +16,8 @@ parser.multiprofile()  # Allows for multiple profiles to be specified
 parser.multiregion()  # Allows for multiple regions to be specified at the command line
 parser.fragment()   # Allows for specifying a string fragment to be looked for
 parser.extendedargs()  # Allows for SkipAccounts and Timing
+parser.recheck()  # Allows for retrying the roles and regions that recently failed
+parser.concurrency()  # Allows for tuning how many accounts and regions we look at, at the same time
 parser.verbosity()  # Allows for the verbosity to be handled.
 parser.rootOnly()   # Looks for the directories in the root account of the profile only
 args = parser.my_parser.parse_args()
@@ -25,10 +27,17 @@ pRegionList = args.Regions
 pFragments = args.Fragments
 pSkipAccounts = args.SkipAccounts
 pTiming = args.Time
+pCredentialWorkers = args.CredentialWorkers
+pWorkers = args.Workers
+pTaskTimeout = args.TaskTimeout
+pEngine = args.Engine
 pRootOnly = args.RootOnly
 verbose = args.loglevel
 
 logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s")
+Inventory_Modules.set_negative_cache_recheck(args.Recheck)
+Inventory_Modules.set_rate_limits(args.RateLimits)
+Inventory_Modules.set_client_config(args.RetryMode, args.MaxAttempts, args.ConnectTimeout, args.ReadTimeout, args.PoolSize)
 logging.getLogger("botocore").setLevel(logging.CRITICAL)
 
 SkipProfiles = ['default']
@@ -41,7 +50,6 @@ credential_list = []
 directories = dict()
 ProfileList = Inventory_Modules.get_profiles(SkipProfiles, pProfiles)
 aws_acct = aws_acct_access(ProfileList[0])
-RegionList = Inventory_Modules.get_ec2_regions3(aws_acct, pRegionList)
 CredentialList = []
 
 print()
@@ -51,7 +59,7 @@ if pProfiles is None:
 		aws_acct = aws_acct_access()
 		# print(f"You've asked us to look through {len(pProfiles)} profiles")
 		# print(f"{ERASE_LINE}Looking at account {aws_acct.acct_number} within profile: {profile}", end='\r')
-		CredentialList = get_credentials_for_accounts_in_org(aws_acct, pSkipAccounts, pRootOnly)
+		CredentialList = get_credentials_for_accounts_in_org(aws_acct, pSkipAccounts, pRootOnly, fMaxWorkers=pCredentialWorkers)
 		# credentials = Inventory_Modules.get_child_access3(aws_acct, aws_acct.acct_number)
 		# credential_list.append(credentials)
 	except AttributeError as myError:
@@ -61,7 +69,7 @@ else:
 	for profile in ProfileList:
 		try:
 			aws_acct = aws_acct_access(profile)
-			CredentialList.extend(get_credentials_for_accounts_in_org(aws_acct, pSkipAccounts, pRootOnly))
+			CredentialList.extend(get_credentials_for_accounts_in_org(aws_acct, pSkipAccounts, pRootOnly, fMaxWorkers=pCredentialWorkers))
 			# print(f"{ERASE_LINE}Looking at account {aws_acct.acct_number} within profile: {profile}", end='\r')
 			# credentials = Inventory_Modules.get_child_access3(aws_acct, aws_acct.acct_number)
 			# credential_list.append(credentials)
@@ -69,6 +77,9 @@ else:
 			print(f"Failed on profile: {profile}, but continuing on...")
 			continue
 
+# Directory Service isn't in every region, so we only look where it exists and the account has opted in
+DirectoryRegions = Inventory_Modules.get_service_region_matrix(CredentialList, ['ds'], pRegionList)['ds']
+RegionList = sorted(set(region for account_regions in DirectoryRegions.values() for region in account_regions))
 NumInstancesFound = 0
 print()
 print(f"Looking through {len(RegionList)} regions and {len(ProfileList)} profiles")
@@ -77,31 +88,37 @@ fmt = '%-15s %-10s %-40s %-12s %-16s %-15s %-20s %-13s'
 print(fmt % ("Account", "Region", "Directory Name", "Directory Id", "Home Region", "Shared", "Type", "Owner"))
 print(fmt % ("-------", "------", "--------------", "------------", "-----------", "------", "----", "-----"))
 
-for credential in CredentialList:
-	aws_acct = aws_acct_access(ocredentials=credential)
-	for region in RegionList:
-		print(f"{ERASE_LINE}Looking in account: {aws_acct.acct_number} in region {region}", end='\r')
-		try:
-			directories = Inventory_Modules.find_directories3(aws_acct, region, pFragments)
-			logging.info(f"directories: {directories}")
-			directoryNum = len(directories)
-			print(f"{ERASE_LINE}Account: {aws_acct.acct_number} Region: {region} Found {directoryNum} directories", end='\r')
-		except TypeError as my_Error:
-			logging.info(f"Error: {my_Error}")
-			continue
-		except ClientError as my_Error:
-			if str(my_Error).find("AuthFailure") > 0:
-				print(f"{ERASE_LINE} Account {aws_acct.acct_number} : Authorization Failure")
-		if len(directories) > 0:
-			for directory in directories:
-				DirectoryName = directory['DirectoryName']
-				DirectoryId = directory['DirectoryId']
-				HomeRegion = directory['HomeRegion']
-				Status = directory['Status']
-				Type = directory['Type']
-				Owner = directory['Owner']
-				print(fmt % (aws_acct.acct_number, region, DirectoryName, DirectoryId, HomeRegion, Status, Type, Owner))
-				NumInstancesFound += 1
+AccountObjects = dict()
+# One lock per account, made here before any threads start, so each account's regions share the one account object
+# without holding up the other accounts while it's made
+AccountObjectLocks = {credentials['AccountNumber']: threading.Lock() for credentials in CredentialList}
+
+
+def find_directories(c_account_credentials, c_region):
+	# find_directories3 wants an account object, so we make one per account (not per region)
+	with AccountObjectLocks[c_account_credentials['AccountNumber']]:
+		if c_account_credentials['AccountNumber'] not in AccountObjects:
+			AccountObjects[c_account_credentials['AccountNumber']] = aws_acct_access(ocredentials=c_account_credentials)
+	return (Inventory_Modules.find_directories3(AccountObjects[c_account_credentials['AccountNumber']], c_region, pFragments))
+
+
+for result in Inventory_Modules.run_across_accounts_and_regions(CredentialList, DirectoryRegions, find_directories, pWorkers, pTaskTimeout, pEngine):
+	if not result['Success']:
+		print(f"{ERASE_LINE} Account {result['AccountId']} : Failure in region {result['Region']}")
+		logging.info(f"Error: {result['ErrorMessage']}")
+		continue
+	directories = result['Result']
+	logging.info(f"directories: {directories}")
+	print(f"{ERASE_LINE}Account: {result['AccountId']} Region: {result['Region']} Found {len(directories)} directories", end='\r')
+	for directory in directories:
+		DirectoryName = directory['DirectoryName']
+		DirectoryId = directory['DirectoryId']
+		HomeRegion = directory['HomeRegion']
+		Status = directory['Status']
+		Type = directory['Type']
+		Owner = directory['Owner']
+		print(fmt % (result['AccountId'], result['Region'], DirectoryName, DirectoryId, HomeRegion, Status, Type, Owner))
+		NumInstancesFound += 1
 print(ERASE_LINE)
 print(f"Found {NumInstancesFound} directories across {len(credential_list)} accounts across {len(RegionList)} regions")
 print()
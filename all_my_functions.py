@@ -3,11 +3,8 @@
 import Inventory_Modules
 from Inventory_Modules import get_credentials_for_accounts_in_org
 from colorama import init, Fore
-from botocore.exceptions import ClientError
 from ArgumentsClass import CommonArguments
 from account_class import aws_acct_access
-from queue import Queue
-from threading import Thread
 from time import time
 
 from prettytable import PrettyTable
@@ -21,6 +18,9 @@ parser.multiprofile()  # Allows for a single profile to be specified
 parser.multiregion()  # Allows for multiple regions to be specified at the command line
 parser.fragment()   # Allows for soecifying a string fragment to be looked for
 parser.extendedargs()
+parser.recheck()  # Allows for retrying the roles and regions that recently failed
+parser.concurrency()  # Allows for tuning how many accounts and regions we look at, at the same time
+parser.processes()  # Allows for spreading the work across processes
 parser.rootOnly()
 parser.verbosity()  # Allows for the verbosity to be handled.
 args = parser.my_parser.parse_args()
@@ -32,9 +32,18 @@ pSkipAccounts = args.SkipAccounts
 pSkipProfiles = args.SkipProfiles
 pRootOnly = args.RootOnly
 pTiming = args.Time
+pCredentialWorkers = args.CredentialWorkers
+pWorkers = args.Workers
+pTaskTimeout = args.TaskTimeout
+pEngine = args.Engine
+pProcesses = args.Processes
+pShardBy = args.ShardBy
 verbose = args.loglevel
 
 logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s")
+Inventory_Modules.set_negative_cache_recheck(args.Recheck)
+Inventory_Modules.set_rate_limits(args.RateLimits)
+Inventory_Modules.set_client_config(args.RetryMode, args.MaxAttempts, args.ConnectTimeout, args.ReadTimeout, args.PoolSize)
 
 SkipProfiles = ["default"]
 
@@ -56,81 +65,49 @@ def check_accounts_for_functions(CredentialList, fRegionList=None, fFragments=No
 	Note that this function takes a list of Credentials and checks for functions in every account it has creds for
 	"""
 
-	class FindFunctions(Thread):
-
-		def __init__(self, queue):
-			Thread.__init__(self)
-			self.queue = queue
-
-		def run(self):
-			while True:
-				# Get the work from the queue and expand the tuple
-				c_account_credentials, c_region, c_fragment, c_PlacesToLook, c_PlaceCount = self.queue.get()
-				logging.info(f"De-queued info for account {c_account_credentials['AccountId']}")
-				try:
-					logging.info(f"Attempting to connect to {c_account_credentials['AccountId']}")
-					Functions = Inventory_Modules.find_lambda_functions2(c_account_credentials, c_region, c_fragment)
-					# FunctionNum = len(Functions['Functions'])
-					# logging.info(f"{ERASE_LINE}Account: {acct['AccountId']} Region: {region} Found {FunctionNum} functions", end='\r')
-				except TypeError as my_Error:
-					logging.info(f"Error: {my_Error}")
-					continue
-				except ClientError as my_Error:
-					if str(my_Error).find("AuthFailure") > 0:
-						logging.error(f"Account {c_account_credentials['AccountId']}: Authorization Failure")
-					continue
-				except KeyError as my_Error:
-					logging.error(f"Account Access failed - trying to access {c_account_credentials['AccountId']}")
-					logging.info(f"Actual Error: {my_Error}")
-					continue
-				finally:
-					# print(f"Finished finding functions in account {c_account_credentials['AccountId']} in region {c_region} - {c_PlaceCount} / {c_PlacesToLook}\n"
-					# 	  f"Functions: {Functions}")
-					# print(f"{ERASE_LINE}Finished finding functions in account {c_account_credentials['AccountId']} in region {c_region} - {c_PlaceCount} / {c_PlacesToLook}", end='\r')
-					if len(Functions) > 0:
-						for _ in range(len(Functions)):
-							# print("Y:",y,"Number:",len(Functions['Functions']))
-							# print("Function Name:",Functions['Functions'][y]['FunctionName'])
-							Functions[_]['MgmtAccount'] = c_account_credentials['MgmtAccount']
-							Functions[_]['AccountId'] = c_account_credentials['AccountId']
-							Functions[_]['Region'] = c_region
-							# Functions[_]['FunctionName'] = Functions[_]['FunctionName']
-							# Functions[_]['FunctionName'] = Functions[_]['RunTime']
-							Rolet = Functions[_]['Role']
-							Functions[_]['Role'] = mid(Rolet, Rolet.find("/") + 2, len(Rolet))
-						AllFuncs.extend(Functions)
-					self.queue.task_done()
-
+	def select_functions(c_account_credentials, c_region, c_functions):
+		Functions = Inventory_Modules.select_lambda_functions(c_functions, fFragments)
+		for function in Functions:
+			function['MgmtAccount'] = c_account_credentials['MgmtAccount']
+			function['AccountId'] = c_account_credentials['AccountId']
+			function['Region'] = c_region
+			Rolet = function['Role']
+			function['Role'] = mid(Rolet, Rolet.find("/") + 2, len(Rolet))
+		return (Functions)
+
+	# The same thing find_lambda_functions2 does, but able to run on either engine
+	find_functions = Inventory_Modules.PagedCollector('lambda', 'list_functions', 'Functions', fPostProcess=select_functions)
 	AllFuncs = []
 	PlaceCount = 0
-	PlacesToLook = len(CredentialList) * len(fRegionList)
 
 	if fRegionList is None:
 		fRegionList = ['us-east-1']
-	checkqueue = Queue()
-
-	for x in range(WorkerThreads):
-		worker = FindFunctions(checkqueue)
-		# Setting daemon to True will let the main thread exit even though the workers are blocking
-		worker.daemon = True
-		worker.start()
-
-	for credential in CredentialList:
-		logging.info(f"Connecting to account {credential['AccountId']}")
-		for region in fRegionList:
-			try:
-				# print(f"{ERASE_LINE}Queuing account {credential['AccountId']} in region {region}", end='\r')
-				checkqueue.put((credential, region, fFragments, PlacesToLook, PlaceCount))
-				PlaceCount += 1
-			except ClientError as my_Error:
-				if str(my_Error).find("AuthFailure") > 0:
-					logging.error(f"Authorization Failure accessing account {credential['AccountId']} in {region} region")
-					logging.warning(f"It's possible that the region {region} hasn't been opted-into")
-					pass
-	checkqueue.join()
+	# Only the regions where Lambda exists, and each account has opted into
+	FunctionRegions = Inventory_Modules.get_service_region_matrix(CredentialList, ['lambda'], fRegionList)['lambda']
+	PlacesToLook = sum([len(regions) for regions in FunctionRegions.values()])
+	for result in Inventory_Modules.run_across_accounts_and_regions(CredentialList, FunctionRegions, find_functions, pWorkers, pTaskTimeout, pEngine):
+		PlaceCount += 1
+		if result['Success']:
+			AllFuncs.extend(result['Result'])
+		else:
+			logging.error(f"Couldn't look for functions in account {result['AccountId']} in region {result['Region']}")
+			logging.info(f"Actual Error: {result['ErrorMessage']}")
+		print(f"{ERASE_LINE}Finished finding functions in account {result['AccountId']} in region {result['Region']} - {PlaceCount} / {PlacesToLook}", end='\r')
 	return (AllFuncs)
 
 
+def check_management_account_for_functions(fProfile):
+	"""
+	What each worker process does with a profile, when we're sharding by management account
+	"""
+	aws_acct = aws_acct_access(fProfile)
+	RegionList = Inventory_Modules.get_ec2_regions3(aws_acct, pRegionList)
+	CredentialList = get_credentials_for_accounts_in_org(aws_acct, pSkipAccounts, pRootOnly, fMaxWorkers=pCredentialWorkers)
+	# Lets the main process count the accounts and regions, the same as it does when it's doing the work itself
+	yield ({'CredentialList': CredentialList, 'RegionList': RegionList})
+	yield from check_accounts_for_functions(CredentialList, RegionList, pFragments)
+
+
 ##########################
 
 if pTiming:
@@ -143,10 +120,13 @@ AllChildAccounts = []
 RegionList = []
 CredentialList = []
 
-if pProfiles is None:
+if pProcesses is not None and pShardBy == 'mgmt':
+	# Each worker process finds its own Org's accounts, so that's left until we're looking for the functions
+	pass
+elif pProfiles is None:
 	aws_acct = aws_acct_access()
 	RegionList.extend(Inventory_Modules.get_ec2_regions3(aws_acct, pRegionList))
-	CredentialList = get_credentials_for_accounts_in_org(aws_acct, pSkipAccounts, pRootOnly)
+	CredentialList = get_credentials_for_accounts_in_org(aws_acct, pSkipAccounts, pRootOnly, fMaxWorkers=pCredentialWorkers)
 	# AllChildAccounts.extend(aws_acct.ChildAccounts)
 	# if aws_acct.AccountType.lower() == 'root':
 	# 	NumOfRootProfiles += 1
@@ -156,7 +136,7 @@ else:
 		try:
 			aws_acct = aws_acct_access(profile)
 			RegionList.extend(Inventory_Modules.get_ec2_regions3(aws_acct, pRegionList))
-			CredentialList.extend(get_credentials_for_accounts_in_org(aws_acct, pSkipAccounts, pRootOnly))
+			CredentialList.extend(get_credentials_for_accounts_in_org(aws_acct, pSkipAccounts, pRootOnly, fMaxWorkers=pCredentialWorkers))
 			# print(f"{ERASE_LINE}Looking at account {aws_acct.acct_number} within profile: {profile}", end='\r')
 			# credentials = Inventory_Modules.get_child_access3(aws_acct, aws_acct.acct_number)
 			# credential_list.append(credentials)
@@ -172,14 +152,30 @@ RegionList = list(set(RegionList))
 if pTiming:
 	logging.critical(f"Time so far is {time()-begin_time}")
 print()
-print(f"Looking through {len(RegionList)} regions and {len(CredentialList)} accounts")
+if pProcesses is not None and pShardBy == 'mgmt':
+	print(f"Looking through the accounts in {len(pProfiles) if pProfiles is not None else 1} profile(s) across {pProcesses} processes")
+else:
+	print(f"Looking through {len(RegionList)} regions and {len(CredentialList)} accounts")
 print()
 # fmt = '%-20s %-10s %-40s %-12s %-35s'
 # print(fmt % ("Account", "Region", "Function Name", "Runtime", "Role"))
 # print(fmt % ("-------", "------", "-------------", "-------", "----"))
 
-WorkerThreads = len(CredentialList) * len(RegionList)
-AllFunctions = check_accounts_for_functions(CredentialList, RegionList, pFragments)
+if pProcesses is None:
+	AllFunctions = check_accounts_for_functions(CredentialList, RegionList, pFragments)
+elif pShardBy == 'mgmt':
+	ProfileList = [None] if pProfiles is None else Inventory_Modules.get_profiles(SkipProfiles, pProfiles)
+	AllFunctions = []
+	for item in Inventory_Modules.run_in_process_shards(ProfileList, check_management_account_for_functions, pProcesses):
+		if 'CredentialList' in item.keys():
+			CredentialList.extend(item['CredentialList'])
+			RegionList = list(set(RegionList + item['RegionList']))
+		else:
+			AllFunctions.append(item)
+else:
+	AllFunctions = list(Inventory_Modules.run_in_process_shards(Inventory_Modules.shard_by_account_hash(CredentialList, pProcesses),
+																lambda credentials: check_accounts_for_functions(credentials, RegionList, pFragments),
+																pProcesses))
 
 # for function in AllFunctions:
 # 	print(f"{function['AccountId']:20s}{function['Region']:10s}{function['FunctionName']:40s}{function['Runtime']:12s}{function['Role']:35s}")
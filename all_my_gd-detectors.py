@@ -2,7 +2,6 @@
 
 import sys
 import Inventory_Modules
-import boto3
 from ArgumentsClass import CommonArguments
 from account_class import aws_acct_access
 from colorama import init, Fore
@@ -15,6 +14,8 @@ parser = CommonArguments()
 parser.singleprofile()
 parser.multiregion_nodefault()
 parser.verbosity()
+parser.recheck()
+parser.concurrency()
 parser.my_parser.add_argument(
     "+delete", "+forreal", "+fix",
     dest="flagDelete",
@@ -33,7 +34,14 @@ pRegions = args.Regions
 verbose = args.loglevel
 DeletionRun = args.flagDelete
 ForceDelete = args.ForceDelete
+pWorkers = args.Workers
+pCredentialWorkers = args.CredentialWorkers
+pTaskTimeout = args.TaskTimeout
+pEngine = args.Engine
 logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)s() ] %(message)s")
+Inventory_Modules.set_negative_cache_recheck(args.Recheck)
+Inventory_Modules.set_rate_limits(args.RateLimits)
+Inventory_Modules.set_client_config(args.RetryMode, args.MaxAttempts, args.ConnectTimeout, args.ReadTimeout, args.PoolSize)
 
 ##########################
 ERASE_LINE = '\x1b[2K'
@@ -44,113 +52,92 @@ NumObjectsFound = 0
 NumAccountsInvestigated = 0
 ChildAccounts = aws_acct.ChildAccounts
 
-session_gd = aws_acct.session
-# This check ensures that we're checking only those regions where GuardDuty is enabled.
-if pRegions is None:
-    gd_regions = session_gd.get_available_regions(service_name='guardduty')
-else:
-    gd_regions = Inventory_Modules.get_regions3(aws_acct, pRegions)
+# This check ensures that we're checking only those regions where GuardDuty exists.
+# Each account is then narrowed down further to the regions it has opted into (see get_service_region_matrix).
+gd_regions = Inventory_Modules.get_service_regions('guardduty', pRegions)
 all_gd_detectors = []
 all_gd_invites = []
 GD_Admin_Accounts = []
 print(f"Searching {len(ChildAccounts)} accounts and {len(gd_regions)} regions")
 
-sts_session = aws_acct.session
-sts_client = sts_session.client('sts')
-places_to_try = len(ChildAccounts) * len(gd_regions)
-for account in ChildAccounts:
-    logging.info(f"Checking Account: {account['AccountId']}")
-    NumProfilesInvestigated = 0  # I only care about the last run - so I don't get profiles * regions.
+
+def find_gd_invites_and_detectors(c_account_credentials, c_region):
+    """
+    Returns the GuardDuty invites and detectors found in this account and region
+    """
+    gd_invites = []
+    gd_detectors = []
+    # Every invite and detector refers to the account's credentials, in case we need to delete them later
+    credential_handle = Inventory_Modules.register_credentials(c_account_credentials, c_region)
+    client_aws = Inventory_Modules.get_aws_client(c_account_credentials, 'guardduty', c_region)
+    # List Invitations
+    logging.info(f"Finding any invites for account: {c_account_credentials['AccountId']} in region {c_region}")
     try:
-        account_credentials = Inventory_Modules.get_child_access3(aws_acct, account['AccountId'])
+        response = client_aws.list_invitations()
     except ClientError as my_Error:
-        if str(my_Error).find("AuthFailure") > 0:
-            print(f"Authorization Failure for account {account['AccountId']}")
-        sys.exit("Credentials failure")
-    for region in gd_regions:
-        logging.info(f"Checking Region: {region}")
-        NumAccountsInvestigated += 1
-        places_to_try -= 1
-        try:
-            session_aws = boto3.Session(
-                aws_access_key_id=account_credentials['AccessKeyId'],
-                aws_secret_access_key=account_credentials['SecretAccessKey'],
-                aws_session_token=account_credentials['SessionToken'],
-                region_name=region)
-            client_aws = session_aws.client('guardduty')
-            logging.debug(f"Token Info: {account_credentials} in region {region}")
-            # List Invitations
-            logging.info(f"Finding any invites for account: {account} in region {region}")
-            response = client_aws.list_invitations()
-            logging.debug(f"Finished listing invites for account: {account} in region {region}")
-        except ClientError as my_Error:
-            if str(my_Error).find("AuthFailure") > 0:
-                print(f"{account['AccountId']}: Authorization Failure for account {account['AccountId']}")
-                continue
-            if str(my_Error).find("security token included in the request is invalid") > 0:
-                logging.error(
-                    f"Account #:{account['AccountId']} - The region you're trying ({region}) isn't enabled for your "
-                    f"account")
-                continue
-        except Exception as my_Error:
-            print(my_Error)
-            continue
-        try:
-            if 'Invitations' in response.keys():
-                for i in range(len(response['Invitations'])):
-                    all_gd_invites.append({
-                        'AccountId': response['Invitations'][i]['AccountId'],
-                        'InvitationId': response['Invitations'][i]['InvitationId'],
-                        'Region': region,
-                        'AccessKeyId': account_credentials['AccessKeyId'],
-                        'SecretAccessKey': account_credentials['SecretAccessKey'],
-                        'SessionToken': account_credentials['SessionToken']
-                    })
-                    logging.error(f"Found invite ID {response['Invitations'][i]['InvitationId']} in account {response['Invitations'][i]['AccountId']} in region {region}")
-        except NameError:
-            pass
-        try:
-            print(
-                f"{ERASE_LINE}Trying account {account['AccountId']} in region {region} -- {places_to_try} left of {len(ChildAccounts) * len(gd_regions)}",
-                end='\r')
-            response = client_aws.list_detectors()
-            if len(response['DetectorIds']) > 0:
-                NumObjectsFound = NumObjectsFound + len(response['DetectorIds'])
-                admin_acct_response = client_aws.list_members(
-                    DetectorId=str(response['DetectorIds'][0]),
-                    OnlyAssociated='False',
-                )
-                logging.warning(
-                    f"Found another detector {str(response['DetectorIds'][0])} in account {account['AccountId']} in region {region} bringing the total found to {str(NumObjectsFound)}")
-                if len(admin_acct_response['Members']) > 0:
-                    all_gd_detectors.append({
-                        'AccountId': account['AccountId'],
-                        'Region': region,
-                        'DetectorIds': response['DetectorIds'],
-                        'AccessKeyId': account_credentials['AccessKeyId'],
-                        'SecretAccessKey': account_credentials['SecretAccessKey'],
-                        'SessionToken': account_credentials['SessionToken'],
-                        'GD_Admin_Accounts': admin_acct_response['Members']
-                    })
-                    logging.error(f"Found account {account['AccountId']} in region {region} to be a GuardDuty Admin account."
-                                  f"It has {len(admin_acct_response['Members'])} member accounts connected to detector {response['DetectorIds'][0]}")
-                else:
-                    all_gd_detectors.append({
-                        'AccountId': account['AccountId'],
-                        'Region': region,
-                        'DetectorIds': response['DetectorIds'],
-                        'AccessKeyId': account_credentials['AccessKeyId'],
-                        'SecretAccessKey': account_credentials['SecretAccessKey'],
-                        'SessionToken': account_credentials['SessionToken'],
-                        'GD_Admin_Accounts': "Not an Admin Account"
-                    })
-            else:
-                print(ERASE_LINE,
-                      f"{Fore.RED}No luck in account: {account['AccountId']} in region {region}{Fore.RESET} -- {places_to_try} of {len(ChildAccounts) * len(gd_regions)}",
-                      end='\r')
-        except ClientError as my_Error:
-            if str(my_Error).find("AuthFailure") > 0:
-                print(f"Authorization Failure for account {account['AccountId']}")
+        if Inventory_Modules.is_disabled_region_error(my_Error, c_account_credentials, c_region):
+            logging.error(
+                f"Account #:{c_account_credentials['AccountId']} - The region you're trying ({c_region}) isn't enabled for your "
+                f"account")
+            # Remember this, so the next run doesn't try (and fail in) this region again
+            Inventory_Modules.record_disabled_region(c_account_credentials['AccountId'], c_region, my_Error.response['Error']['Code'])
+        raise
+    logging.debug(f"Finished listing invites for account: {c_account_credentials['AccountId']} in region {c_region}")
+    for invitation in response.get('Invitations', []):
+        gd_invites.append({
+            'AccountId': invitation['AccountId'],
+            'InvitationId': invitation['InvitationId'],
+            'Region': c_region,
+            'CredentialHandle': credential_handle
+        })
+        logging.error(f"Found invite ID {invitation['InvitationId']} in account {invitation['AccountId']} in region {c_region}")
+    response = client_aws.list_detectors()
+    if len(response['DetectorIds']) > 0:
+        admin_acct_response = client_aws.list_members(
+            DetectorId=str(response['DetectorIds'][0]),
+            OnlyAssociated='False',
+        )
+        gd_detectors.append({
+            'AccountId': c_account_credentials['AccountId'],
+            'Region': c_region,
+            'DetectorIds': response['DetectorIds'],
+            'CredentialHandle': credential_handle,
+            'GD_Admin_Accounts': admin_acct_response['Members'] if len(admin_acct_response['Members']) > 0 else "Not an Admin Account"
+        })
+        if len(admin_acct_response['Members']) > 0:
+            logging.error(f"Found account {c_account_credentials['AccountId']} in region {c_region} to be a GuardDuty Admin account."
+                          f"It has {len(admin_acct_response['Members'])} member accounts connected to detector {response['DetectorIds'][0]}")
+    return (gd_invites, gd_detectors)
+
+
+CredentialList = Inventory_Modules.get_credentials_for_accounts_in_org(aws_acct, fMaxWorkers=pCredentialWorkers)
+# Each account is narrowed down to the GuardDuty regions it has opted into
+account_gd_regions = Inventory_Modules.get_service_region_matrix(CredentialList, ['guardduty'], pRegions)['guardduty']
+places_total = sum([len(regions) for regions in account_gd_regions.values()])
+places_to_try = places_total
+for result in Inventory_Modules.run_across_accounts_and_regions(CredentialList, account_gd_regions, find_gd_invites_and_detectors,
+                                                                pWorkers, pTaskTimeout, pEngine):
+    NumAccountsInvestigated += 1
+    places_to_try -= 1
+    if not result['Success']:
+        print(f"{ERASE_LINE}{result['AccountId']}: Failure in region {result['Region']}")
+        logging.warning(result['ErrorMessage'])
+        continue
+    gd_invites, gd_detectors = result['Result']
+    all_gd_invites.extend(gd_invites)
+    all_gd_detectors.extend(gd_detectors)
+    for gd_detector in gd_detectors:
+        NumObjectsFound = NumObjectsFound + len(gd_detector['DetectorIds'])
+        logging.warning(
+            f"Found another detector {str(gd_detector['DetectorIds'][0])} in account {gd_detector['AccountId']} in region {gd_detector['Region']} bringing the total found to {str(NumObjectsFound)}")
+    if len(gd_detectors) > 0:
+        print(
+            f"{ERASE_LINE}Trying account {result['AccountId']} in region {result['Region']} -- {places_to_try} left of {places_total}",
+            end='\r')
+    else:
+        print(ERASE_LINE,
+              f"{Fore.RED}No luck in account: {result['AccountId']} in region {result['Region']}{Fore.RESET} -- {places_to_try} of {places_total}",
+              end='\r')
 
 if args.loglevel < 50:
     print()
@@ -172,7 +159,7 @@ if args.loglevel < 50:
 
 print(ERASE_LINE)
 print(
-    f"We scanned {len(ChildAccounts)} accounts and {len(gd_regions)} regions totalling {len(ChildAccounts) * len(gd_regions)} possible areas for resources.")
+    f"We scanned {len(ChildAccounts)} accounts and {len(gd_regions)} regions totalling {places_total} possible areas for resources.")
 print(f"Found {len(all_gd_invites)} Invites across {len(ChildAccounts)} accounts across {len(gd_regions)} regions")
 print(f"Found {NumObjectsFound} Detectors across {len(ChildAccounts)} profiles across {len(gd_regions)} regions")
 print()
@@ -186,12 +173,7 @@ if DeletionRun and (ReallyDelete or ForceDelete):
     MemberList = []
     logging.warning("Deleting all invites")
     for y in range(len(all_gd_invites)):
-        session_gd_child = boto3.Session(
-            aws_access_key_id=all_gd_invites[y]['AccessKeyId'],
-            aws_secret_access_key=all_gd_invites[y]['SecretAccessKey'],
-            aws_session_token=all_gd_invites[y]['SessionToken'],
-            region_name=all_gd_invites[y]['Region'])
-        client_gd_child = session_gd_child.client('guardduty')
+        client_gd_child = Inventory_Modules.get_client_for_handle(all_gd_invites[y]['CredentialHandle'], 'guardduty')
         # Delete Invitations
         try:
             print(ERASE_LINE, f"Deleting invite for Account {all_gd_invites[y]['AccountId']}", end="\r")
@@ -213,12 +195,7 @@ if DeletionRun and (ReallyDelete or ForceDelete):
             f"Deleting detector-id: {all_gd_detectors[y]['DetectorIds']} from account {all_gd_detectors[y]['AccountId']} in region {all_gd_detectors[y]['Region']}")
         print(
             f"Deleting detector in account {all_gd_detectors[y]['AccountId']} in region {all_gd_detectors[y]['Region']} {num_of_gd_detectors}/{len(all_gd_detectors)}")
-        session_gd_child = boto3.Session(
-            aws_access_key_id=all_gd_detectors[y]['AccessKeyId'],
-            aws_secret_access_key=all_gd_detectors[y]['SecretAccessKey'],
-            aws_session_token=all_gd_detectors[y]['SessionToken'],
-            region_name=all_gd_detectors[y]['Region'])
-        client_gd_child = session_gd_child.client('guardduty')
+        client_gd_child = Inventory_Modules.get_client_for_handle(all_gd_detectors[y]['CredentialHandle'], 'guardduty')
         # List Members
         Member_Dict = client_gd_child.list_members(
             DetectorId=str(all_gd_detectors[y]['DetectorIds'][0]), OnlyAssociated='FALSE')['Members']
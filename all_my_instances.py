@@ -4,7 +4,6 @@ import Inventory_Modules
 from ArgumentsClass import CommonArguments
 from account_class import aws_acct_access
 from colorama import init, Fore
-from botocore.exceptions import ClientError
 
 import logging
 
@@ -13,13 +12,23 @@ init()
 parser = CommonArguments()
 parser.multiprofile()
 parser.multiregion()
+parser.concurrency()
+parser.processes()
 parser.verbosity()
 args = parser.my_parser.parse_args()
 
 pProfiles = args.Profiles
 pRegionList = args.Regions
+pWorkers = args.Workers
+pCredentialWorkers = args.CredentialWorkers
+pTaskTimeout = args.TaskTimeout
+pEngine = args.Engine
+pProcesses = args.Processes
+pShardBy = args.ShardBy
 verbose = args.loglevel
 logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s")
+Inventory_Modules.set_rate_limits(args.RateLimits)
+Inventory_Modules.set_client_config(args.RetryMode, args.MaxAttempts, args.ConnectTimeout, args.ReadTimeout, args.PoolSize)
 
 ##################
 
@@ -30,69 +39,77 @@ logging.info(f"Profiles: {pProfiles}")
 
 
 ##################
-def check_accounts_for_instances(faws_acct, fRegionList=None):
-	ChildAccounts = faws_acct.ChildAccounts
-	AllInstances = []
+def sweep_for_instances(fCredentialList, fRegionList=None):
+	"""
+	Yields the result of looking in each account and region, as run_across_accounts_and_regions returns them
+	"""
+	def log_instances(c_account_credentials, c_region, c_reservations):
+		logging.info(
+			f"Root Account: {c_account_credentials['MgmtAccount']} Account: {c_account_credentials['AccountId']} Region: {c_region} | Found {len(c_reservations)} instances")
+		return (c_reservations)
+
+	# The same thing find_account_instances2 does, but able to run on either engine
+	find_instances = Inventory_Modules.PagedCollector('ec2', 'describe_instances', 'Reservations', fPostProcess=log_instances)
 	if fRegionList is None:
 		fRegionList = ['us-east-1']
-	for account in ChildAccounts:
-		logging.info(f"Connecting to account {account['AccountId']}")
-		try:
-			account_credentials = Inventory_Modules.get_child_access3(faws_acct, account['AccountId'])
-			logging.info(f"Connected to account {account['AccountId']} using role {account_credentials['Role']}")
-		# TODO: We shouldn't refer to "account_credentials['Role']" below, if there was an error.
-		except ClientError as my_Error:
-			if str(my_Error).find("AuthFailure") > 0:
-				logging.error(
-					f"{account['AccountId']}: Authorization failure using role: {account_credentials['Role']}")
-				logging.warning(my_Error)
-			elif str(my_Error).find("AccessDenied") > 0:
-				logging.error(
-					f"{account['AccountId']}: Access Denied failure using role: {account_credentials['Role']}")
-				logging.warning(my_Error)
-			else:
-				logging.error(
-					f"{account['AccountId']}: Other kind of failure using role: {account_credentials['Role']}")
-				logging.warning(my_Error)
-			continue
-		for region in fRegionList:
+	# Only the regions each account has opted into
+	InstanceRegions = Inventory_Modules.get_service_region_matrix(fCredentialList, ['ec2'], fRegionList)['ec2']
+	yield from Inventory_Modules.run_across_accounts_and_regions(fCredentialList, InstanceRegions, find_instances, pWorkers, pTaskTimeout, pEngine)
+
+
+def display_instances(result):
+	"""
+	Prints the instances found in one account and region, and returns their reservations
+	"""
+	print(f"{ERASE_LINE}Checked account {result['AccountId']} in region {result['Region']}", end='\r')
+	if not result['Success']:
+		logging.error(f"Couldn't look for instances in account {result['AccountId']} in {result['Region']} region")
+		logging.warning(result['ErrorMessage'])
+		return ([])
+	for reservation in result['Result']:
+		for instance in reservation['Instances']:
+			InstanceType = instance['InstanceType']
+			InstanceId = instance['InstanceId']
+			PublicDnsName = instance['PublicDnsName']
+			State = instance['State']['Name']
+			Name = "No Name Tag"
 			try:
-				Instances = None
-				print(f"{ERASE_LINE}Checking account {account['AccountId']} in region {region}", end='\r')
-				Instances = Inventory_Modules.find_account_instances2(account_credentials, region)
-				logging.info(
-					f"Root Account: {faws_acct.acct_number} Account: {account['AccountId']} Region: {region} | Found {len(Instances['Reservations'])} instances")
-			except ClientError as my_Error:
-				if str(my_Error).find("AuthFailure") > 0:
-					logging.error(f"Authorization Failure accessing account {account['AccountId']} in {region} region")
-					logging.warning(f"It's possible that the region {region} hasn't been opted-into")
-					pass
-			if 'Reservations' in Instances.keys():
-				for y in range(len(Instances['Reservations'])):
-					for z in range(len(Instances['Reservations'][y]['Instances'])):
-						InstanceType = Instances['Reservations'][y]['Instances'][z]['InstanceType']
-						InstanceId = Instances['Reservations'][y]['Instances'][z]['InstanceId']
-						PublicDnsName = Instances['Reservations'][y]['Instances'][z]['PublicDnsName']
-						State = Instances['Reservations'][y]['Instances'][z]['State']['Name']
-						Name = "No Name Tag"
-						try:
-							for x in range(len(Instances['Reservations'][y]['Instances'][z]['Tags'])):
-								if Instances['Reservations'][y]['Instances'][z]['Tags'][x]['Key'] == "Name":
-									Name = Instances['Reservations'][y]['Instances'][z]['Tags'][x]['Value']
-						except KeyError as my_Error:  # This is needed for when there is no "Tags" key within the describe-instances output
-							logging.info(my_Error)
-							pass
-						if State == 'running':
-							fmt = f"%-12s %-12s %-10s %-15s %-20s %-20s %-42s {Fore.RED}%-12s{Fore.RESET}"
-						else:
-							fmt = '%-12s %-12s %-10s %-15s %-20s %-20s %-42s %-12s'
-						print(fmt % (
-						faws_acct.acct_number, account['AccountId'], region, InstanceType, Name, InstanceId,
-						PublicDnsName, State))
-		AllInstances.extend(Instances['Reservations'])
+				for tag in instance['Tags']:
+					if tag['Key'] == "Name":
+						Name = tag['Value']
+			except KeyError as my_Error:  # This is needed for when there is no "Tags" key within the describe-instances output
+				logging.info(my_Error)
+				pass
+			if State == 'running':
+				fmt = f"%-12s %-12s %-10s %-15s %-20s %-20s %-42s {Fore.RED}%-12s{Fore.RESET}"
+			else:
+				fmt = '%-12s %-12s %-10s %-15s %-20s %-20s %-42s %-12s'
+			print(fmt % (
+			result['MgmtAccount'], result['AccountId'], result['Region'], InstanceType, Name, InstanceId,
+			PublicDnsName, State))
+	return (result['Result'])
+
+
+def check_accounts_for_instances(faws_acct, fRegionList=None):
+	AllInstances = []
+	CredentialList = Inventory_Modules.get_credentials_for_accounts_in_org(faws_acct, fMaxWorkers=pCredentialWorkers)
+	for result in sweep_for_instances(CredentialList, fRegionList):
+		AllInstances.extend(display_instances(result))
 	return (AllInstances)
 
 
+def sweep_management_account(fProfile):
+	"""
+	What each worker process does with a profile, when we're sharding by management account
+	"""
+	aws_acct = aws_acct_access(fProfile)
+	logging.warning(f"Looking at {fProfile} account now... ")
+	# Lets the main process count the accounts, the same as it does when it's doing the work itself
+	yield ({'ChildAccounts': aws_acct.ChildAccounts})
+	yield from sweep_for_instances(Inventory_Modules.get_credentials_for_accounts_in_org(aws_acct, fMaxWorkers=pCredentialWorkers),
+								   Inventory_Modules.get_regions3(aws_acct, pRegionList))
+
+
 ##################
 
 
@@ -108,7 +125,33 @@ print(fmt % ("-----------", "---------", "------", "------------", "----", "----
 InstancesFound = []
 AllChildAccounts = []
 
-if pProfiles is None:  # Default use case from the classes
+if pProcesses is not None:
+	# Shard the work across processes, and print whatever they find as it streams back
+	ProfileList = [None] if pProfiles is None else Inventory_Modules.get_profiles(fprofiles=pProfiles, fSkipProfiles="skipplus")
+	if pShardBy == 'mgmt':
+		Shards = ProfileList
+		sweep_shard = sweep_management_account
+	else:
+		CredentialList = []
+		RegionList = []
+		for profile in ProfileList:
+			aws_acct = aws_acct_access(profile)
+			RegionList.extend(Inventory_Modules.get_regions3(aws_acct, pRegionList))
+			CredentialList.extend(Inventory_Modules.get_credentials_for_accounts_in_org(aws_acct, fMaxWorkers=pCredentialWorkers))
+			AllChildAccounts.extend(aws_acct.ChildAccounts)
+		RegionList = list(set(RegionList))
+		Shards = Inventory_Modules.shard_by_account_hash(CredentialList, pProcesses)
+		sweep_shard = lambda credentials: sweep_for_instances(credentials, RegionList)
+	RegionsSeen = set()
+	for item in Inventory_Modules.run_in_process_shards(Shards, sweep_shard, pProcesses):
+		if 'ChildAccounts' in item.keys():
+			AllChildAccounts.extend(item['ChildAccounts'])
+			continue
+		RegionsSeen.add(item['Region'])
+		InstancesFound.extend(display_instances(item))
+	if pShardBy == 'mgmt':
+		RegionList = list(RegionsSeen)
+elif pProfiles is None:  # Default use case from the classes
 	logging.info("Using whatever the default profile is")
 	aws_acct = aws_acct_access()
 	RegionList = Inventory_Modules.get_regions3(aws_acct, pRegionList)
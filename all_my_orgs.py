@@ -4,7 +4,7 @@ import logging
 from ArgumentsClass import CommonArguments
 # from account_class import aws_acct_access
 import Inventory_Modules
-from Inventory_Modules import get_org_accounts_from_profiles
+from Inventory_Modules import iter_org_accounts_from_profiles
 from time import time
 # from botocore.exceptions import ClientError, NoCredentialsError, InvalidConfigError
 from colorama import init, Fore, Style
@@ -73,21 +73,18 @@ ProfileList = Inventory_Modules.get_profiles(fSkipProfiles=pSkipProfiles, fprofi
 # print("Capturing info for supplied profiles")
 logging.warning(f"These profiles are being checked {ProfileList}.")
 print(f"Please bear with us as we run through {len(ProfileList)} profiles")
-AllProfileAccounts = get_org_accounts_from_profiles(ProfileList, progress_bar=False)
+AllProfileAccounts = []
 AccountList = []
 landing_zone = 'N/A'
 
-if pTiming:
-	print()
-	print(f"It's been {time()-begin_time} seconds...")
-	print()
 fmt = '%-23s %-15s %-15s %-12s %-10s'
 print("<------------------------------------>")
 print(fmt % ("Profile Name", "Account Number", "Payer Org Acct", "Org ID", "Root Acct?"))
 print(fmt % ("------------", "--------------", "--------------", "------", "----------"))
 
-for item in AllProfileAccounts:
-	# Print results for all profiles
+# Each profile is printed as soon as we've finished with it, rather than waiting for all of them
+for item in iter_org_accounts_from_profiles(ProfileList):
+	AllProfileAccounts.append(item)
 	try:
 		if pRootOnly and not item['RootAcct']:
 			continue
@@ -100,6 +97,11 @@ for item in AllProfileAccounts:
 	except TypeError as my_Error:
 		print(f"Error - {my_Error} on {item}")
 		pass
+
+if pTiming:
+	print()
+	print(f"It's been {time()-begin_time} seconds...")
+	print()
 '''
 If I create a dictionary from the Root Accts and Root Profiles Lists - 
 I can use that to determine which profile belongs to the root user of my (child) account.
@@ -122,15 +124,24 @@ if not shortform:
 	NumOfOrgAccounts = 0
 	NumOfNonOrgAccounts = 0
 	FailedAccounts = 0
+	# Several profiles can lead to the same account (or Org), so we only show and count each of them once
+	AccountsSeen = set()
+	OrgsSeen = set()
 	account = dict()
 	for item in AllProfileAccounts:
-		if item['Success'] and not item['RootAcct']:
+		if item['Success'] and not item['RootAcct'] and item['aws_acct'].acct_number in AccountsSeen:
+			continue
+		elif item['Success'] and item['RootAcct'] and item['MgmtAcct'] in OrgsSeen:
+			continue
+		elif item['Success'] and not item['RootAcct']:
+			AccountsSeen.add(item['aws_acct'].acct_number)
 			account.update(item['aws_acct'].ChildAccounts[0])
 			account.update({'Profile': item['profile']})
 			# print(account)
 			AccountList.append(account.copy())
 			NumOfNonOrgAccounts += len(item['aws_acct'].ChildAccounts)
 		elif item['Success'] and item['RootAcct']:
+			OrgsSeen.add(item['MgmtAcct'])
 			# account = dict()
 			# landing_zone = Inventory_Modules.find_if_alz(item['profile'])['ALZ']
 			for i in item['aws_acct'].ChildAccounts:
@@ -153,7 +164,7 @@ if not shortform:
 			continue
 
 	print()
-	print(f"Number of Organizations: {len([i for i in AllProfileAccounts if i['RootAcct']])}")
+	print(f"Number of Organizations: {len(OrgsSeen)}")
 	print(f"Number of Organization Accounts: {NumOfOrgAccounts}")
 	print(f"Number of Standalone Accounts: {NumOfNonOrgAccounts}")
 	print(f"Number of profiles that failed: {FailedAccounts}")
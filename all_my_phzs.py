@@ -5,7 +5,6 @@ import Inventory_Modules
 from ArgumentsClass import CommonArguments
 from account_class import aws_acct_access
 from colorama import init, Fore
-from botocore.exceptions import ClientError
 
 import logging
 
@@ -37,34 +36,44 @@ RegionList = Inventory_Modules.get_regions3(aws_acct, pRegionList)
 
 NumPHZsFound = 0
 HostedZones = []
+AccountsSeen = set()
 print()
 fmt = '%-20s %-10s %-25s %-20s %-25s'
 print(fmt % ("Account", "Region", "Hosted Zone Name", "Number of Records", "Zone ID"))
 print(fmt % ("-------", "------", "----------------", "-----------------", "-------"))
 
+CredentialList = []
 for profile in ProfileList:
 	if pProfiles is None:
 		aws_acct = aws_acct_access()
 	else:
 		aws_acct = aws_acct_access(profile)
-	for region in RegionList:
-		try:
-			HostedZones = Inventory_Modules.find_private_hosted_zones3(aws_acct, region)['HostedZones']
-			PHZNum = len(HostedZones)
-			logging.info(f"Account: {aws_acct.acct_number:12s} | Region: {region:15s} | Found {PHZNum:2d} Hosted Zones")
-			print(f"{ERASE_LINE}{Fore.RED}Account: {aws_acct.acct_number:12s} Region: {region:15s} Found: {PHZNum:2d} Hosted Zones{Fore.RESET}", end='\r')
-		except ClientError as my_Error:
-			if str(my_Error).find("AuthFailure") > 0:
-				print(f"{profile}: Authorization Failure")
-		if len(HostedZones) > 0:
-			for y in range(len(HostedZones)):
-				PHZName = HostedZones[y]['Name']
-				Records = HostedZones[y]['ResourceRecordSetCount']
-				PHZId = HostedZones[y]['Id']
-				print(fmt % (aws_acct.acct_number, region, PHZName, Records, PHZId))
-				NumPHZsFound += 1
+	# Asking for the account we're already in just hands back the profile's own credentials
+	CredentialList.append(Inventory_Modules.get_child_access3(aws_acct, aws_acct.acct_number))
+# Route 53 is a global service, so this only asks each account once. The zones it finds come back under every region,
+# but we only count (and show) them once for each account.
+for result in Inventory_Modules.run_across_accounts_and_regions(CredentialList, RegionList,
+																Inventory_Modules.PagedCollector('route53', 'list_hosted_zones', 'HostedZones')):
+	if not result['Success']:
+		if str(result['ErrorMessage']).find("AuthFailure") > 0:
+			print(f"{result['AccountId']}: Authorization Failure")
+		logging.warning(result['ErrorMessage'])
+		continue
+	if result['AccountId'] in AccountsSeen:
+		continue
+	AccountsSeen.add(result['AccountId'])
+	HostedZones = result['Result']
+	PHZNum = len(HostedZones)
+	logging.info(f"Account: {result['AccountId']:12s} | Found {PHZNum:2d} Hosted Zones")
+	print(f"{ERASE_LINE}{Fore.RED}Account: {result['AccountId']:12s} Found: {PHZNum:2d} Hosted Zones{Fore.RESET}", end='\r')
+	for y in range(len(HostedZones)):
+		PHZName = HostedZones[y]['Name']
+		Records = HostedZones[y]['ResourceRecordSetCount']
+		PHZId = HostedZones[y]['Id']
+		print(fmt % (result['AccountId'], 'global', PHZName, Records, PHZId))
+		NumPHZsFound += 1
 print(ERASE_LINE)
-print(f"{Fore.RED}Found {NumPHZsFound} Hosted Zones across {len(ProfileList)} accounts across {len(RegionList)} regions{Fore.RESET}")
+print(f"{Fore.RED}Found {NumPHZsFound} Hosted Zones across {len(AccountsSeen)} accounts{Fore.RESET}")
 print()
 print("Thanks for using this script...")
 print()
@@ -5,7 +5,6 @@ import Inventory_Modules
 from ArgumentsClass import CommonArguments
 from account_class import aws_acct_access
 from colorama import init, Fore
-from botocore.exceptions import ClientError
 
 import logging
 
@@ -14,13 +13,20 @@ init()
 parser = CommonArguments()
 parser.multiprofile()
 parser.multiregion()
+parser.concurrency()
 parser.verbosity()
 args = parser.my_parser.parse_args()
 
 pProfiles = args.Profiles
 pRegionList = args.Regions
+pWorkers = args.Workers
+pCredentialWorkers = args.CredentialWorkers
+pTaskTimeout = args.TaskTimeout
+pEngine = args.Engine
 verbose = args.loglevel
 logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s")
+Inventory_Modules.set_rate_limits(args.RateLimits)
+Inventory_Modules.set_client_config(args.RetryMode, args.MaxAttempts, args.ConnectTimeout, args.ReadTimeout, args.PoolSize)
 
 ##################
 
@@ -35,54 +41,34 @@ def check_accounts_for_instances(faws_acct, fRegionList=None):
 	"""
 	Note that this function checks the account AND any children accounts in the Org.
 	"""
-	ChildAccounts = faws_acct.ChildAccounts
+	def find_rds_instances(c_account_credentials, c_region):
+		Instances = Inventory_Modules.find_account_rds_instances2(c_account_credentials, c_region)
+		logging.info(f"Root Account: {faws_acct.acct_number} Account: {c_account_credentials['AccountId']} Region: {c_region} | Found {len(Instances['DBInstances'])} instances")
+		return (Instances['DBInstances'])
+
 	AllInstances = []
-	Instances = dict()
 	if fRegionList is None:
 		fRegionList = ['us-east-1']
-	for account in ChildAccounts:
-		logging.info(f"Connecting to account {account['AccountId']}")
-		try:
-			account_credentials = Inventory_Modules.get_child_access3(faws_acct, account['AccountId'])
-			logging.info(f"Connected to account {account['AccountId']} using role {account_credentials['Role']}")
-		# TODO: We shouldn't refer to "account_credentials['Role']" below, if there was an error.
-		except ClientError as my_Error:
-			if str(my_Error).find("AuthFailure") > 0:
-				logging.error(f"{account['AccountId']}: Authorization failure using role: {account_credentials['Role']}")
-				logging.warning(my_Error)
-			elif str(my_Error).find("AccessDenied") > 0:
-				logging.error(f"{account['AccountId']}: Access Denied failure using role: {account_credentials['Role']}")
-				logging.warning(my_Error)
-			else:
-				logging.error(f"{account['AccountId']}: Other kind of failure using role: {account_credentials['Role']}")
-				logging.warning(my_Error)
+	CredentialList = Inventory_Modules.get_credentials_for_accounts_in_org(faws_acct, fMaxWorkers=pCredentialWorkers)
+	# Only the regions where RDS exists, and each account has opted into
+	InstanceRegions = Inventory_Modules.get_service_region_matrix(CredentialList, ['rds'], fRegionList)['rds']
+	for result in Inventory_Modules.run_across_accounts_and_regions(CredentialList, InstanceRegions, find_rds_instances, pWorkers, pTaskTimeout, pEngine):
+		print(f"{ERASE_LINE}Checked account {result['AccountId']} in region {result['Region']}", end='\r')
+		if not result['Success']:
+			logging.error(f"Couldn't look for instances in account {result['AccountId']} in {result['Region']} region")
+			logging.warning(result['ErrorMessage'])
 			continue
-		except AttributeError as my_Error:
-			logging.error(f"Error: Likely that one of the supplied profiles {pProfiles} was wrong")
-			logging.warning(my_Error)
-			continue
-		for region in fRegionList:
-			try:
-				print(f"{ERASE_LINE}Checking account {account['AccountId']} in region {region}", end='\r')
-				Instances = Inventory_Modules.find_account_rds_instances2(account_credentials, region)
-				logging.info(f"Root Account: {faws_acct.acct_number} Account: {account['AccountId']} Region: {region} | Found {len(Instances['DBInstances'])} instances")
-			except ClientError as my_Error:
-				if str(my_Error).find("AuthFailure") > 0:
-					logging.error(f"Authorization Failure accessing account {account['AccountId']} in {region} region")
-					logging.warning(f"It's possible that the region {region} hasn't been opted-into")
-					pass
-			if 'DBInstances' in Instances.keys():
-				for y in range(len(Instances['DBInstances'])):
-					InstanceType = Instances['DBInstances'][y]['DBInstanceClass']
-					State = Instances['DBInstances'][y]['DBInstanceStatus']
-					if 'DBName' in Instances['DBInstances'][y].keys():
-						Name = Instances['DBInstances'][y]['DBName']
-					else:
-						Name = "No Name"
-					Engine = Instances['DBInstances'][y]['Engine']
-					fmt = '%-12s %-12s %-10s %-15s %-20s %-20s %-12s'
-					print(fmt % (faws_acct.acct_number, account['AccountId'], region, InstanceType, Name, Engine, State))
-		AllInstances.extend(Instances['DBInstances'])
+		for instance in result['Result']:
+			InstanceType = instance['DBInstanceClass']
+			State = instance['DBInstanceStatus']
+			if 'DBName' in instance.keys():
+				Name = instance['DBName']
+			else:
+				Name = "No Name"
+			Engine = instance['Engine']
+			fmt = '%-12s %-12s %-10s %-15s %-20s %-20s %-12s'
+			print(fmt % (faws_acct.acct_number, result['AccountId'], result['Region'], InstanceType, Name, Engine, State))
+		AllInstances.extend(result['Result'])
 	return (AllInstances)
 
 
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import Inventory_Modules
-import boto3
 from ArgumentsClass import CommonArguments
 from account_class import aws_acct_access
 from colorama import init
@@ -16,6 +15,7 @@ parser.my_parser.description = ("We're going to find all roles within any of the
 parser.verbosity()
 parser.singleprofile()
 parser.extendedargs()   # This adds the "DryRun" and "Force" objects
+parser.concurrency()    # Allows for tuning how many accounts we look at, at the same time
 parser.my_parser.add_argument(
 	"--role",
 	dest="pRole",
@@ -39,7 +39,13 @@ args = parser.my_parser.parse_args()
 pProfile = args.Profile
 pRole = args.pRole
 pDelete = args.pDelete
+pCredentialWorkers = args.CredentialWorkers
+pWorkers = args.Workers
+pTaskTimeout = args.TaskTimeout
+pEngine = args.Engine
 logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)20s() ] %(""message)s")
+Inventory_Modules.set_rate_limits(args.RateLimits)
+Inventory_Modules.set_client_config(args.RetryMode, args.MaxAttempts, args.ConnectTimeout, args.ReadTimeout, args.PoolSize)
 
 ##########################
 ERASE_LINE = '\x1b[2K'
@@ -47,13 +53,7 @@ ERASE_LINE = '\x1b[2K'
 
 
 def my_delete_role(fRoleList):
-	iam_session = boto3.Session(
-		aws_access_key_id=fRoleList['aws_access_key_id'],
-		aws_secret_access_key=fRoleList['aws_secret_access_key'],
-		aws_session_token=fRoleList['aws_session_token'],
-		region_name='us-east-1'
-		)
-	iam_client = iam_session.client('iam')
+	iam_client = Inventory_Modules.get_client_for_handle(fRoleList['CredentialHandle'], 'iam')
 	try:
 		attached_role_policies = iam_client.list_attached_role_policies(
 			RoleName=fRoleList['RoleName']
@@ -93,57 +93,26 @@ print(fmt % ("--------------", "---------"))
 Roles = []
 SpecifiedRoleNum = 0
 DeletedRoles = 0
-for account in ChildAccounts:
-	try:
-		RoleNum = 0
-		account_credentials = Inventory_Modules.get_child_access3(aws_acct, account['AccountId'])
-		if "AccessError" in account_credentials.keys():
-			logging.error(f"Access to member account {account['AccountId']} failed...")
-			continue
-		elif account_credentials['Role'] == 'Use Profile':
-			logging.error(f"Access to the Root Account {account['AccountId']}")
-			logging.info(f"Using Root profile provided")
-			iam_session = aws_acct.session
+CredentialList = Inventory_Modules.get_credentials_for_accounts_in_org(aws_acct, fMaxWorkers=pCredentialWorkers)
+CredentialsByAccount = {ocredentials['AccountId']: ocredentials for ocredentials in CredentialList if ocredentials['Success']}
+# IAM is global, so each account's roles are listed just the once, from us-east-1
+for result in Inventory_Modules.run_across_accounts_and_regions(CredentialList, ['us-east-1'], Inventory_Modules.PagedCollector('iam', 'list_roles', 'Roles'),
+																pWorkers, pTaskTimeout, pEngine):
+	if not result['Success']:
+		if str(result['ErrorMessage']).find("AuthFailure") > 0:
+			print(f"{pProfile}: Authorization Failure for account {result['AccountId']}")
 		else:
-			logging.info(f"Using child account's creds")
-			iam_session = boto3.Session(
-				aws_access_key_id=account_credentials['AccessKeyId'],
-				aws_secret_access_key=account_credentials['SecretAccessKey'],
-				aws_session_token=account_credentials['SessionToken'],
-				region_name='us-east-1')
-		account_credentials['AccountNumber'] = account['AccountId']
-		logging.info(f"Connecting to {account['AccountId']} with {account_credentials['Role']} role")
-		print(ERASE_LINE, f"Checking Account {account_credentials['AccountNumber']}", end="")
-	except ClientError as my_Error:
-		if str(my_Error).find("AuthFailure") > 0:
-			print(f"{pProfile}: Authorization Failure for account {account['AccountId']}")
+			print(f"Error: {result['ErrorMessage']}")
 		continue
-	iam_client = iam_session.client('iam')
-	try:
-		response = iam_client.list_roles()
-		for i in range(len(response['Roles'])):
-			Roles.append({
-				'aws_access_key_id': account_credentials['AccessKeyId'],
-				'aws_secret_access_key': account_credentials['SecretAccessKey'],
-				'aws_session_token': account_credentials['SessionToken'],
-				'AccountId': account_credentials['AccountNumber'],
-				'RoleName': response['Roles'][i]['RoleName']
-				})
-		RoleNum = len(response['Roles'])
-		while response['IsTruncated']:
-			response = iam_client.list_roles(Marker=response['Marker'])
-			for i in range(len(response['Roles'])):
-				Roles.append({
-					'AccountId': account_credentials['AccountNumber'],
-					'RoleName': response['Roles'][i]['RoleName']
-					})
-				RoleNum += len(response['Roles'])
-		print(f" - Found {RoleNum} roles", end="\r")
-	except ClientError as my_Error:
-		if str(my_Error).find("AuthFailure") > 0:
-			print(f"{pProfile}: Authorization Failure for account {account['AccountId']}")
-		else:
-			print(f"Error: {my_Error}")
+	# Every role in this account refers to these credentials, rather than carrying its own copy of them
+	credential_handle = Inventory_Modules.register_credentials(CredentialsByAccount[result['AccountId']], 'us-east-1')
+	for role in result['Result']:
+		Roles.append({
+			'CredentialHandle': credential_handle,
+			'AccountId': result['AccountId'],
+			'RoleName': role['RoleName']
+			})
+	print(ERASE_LINE, f"Checking Account {result['AccountId']} - Found {len(result['Result'])} roles", end="\r")
 
 RoleNum = 0
 if pRole is None:
@@ -6,7 +6,6 @@ import logging
 from ArgumentsClass import CommonArguments
 from account_class import aws_acct_access
 from colorama import init, Fore
-from botocore.exceptions import ClientError
 
 init()
 
@@ -14,6 +13,7 @@ parser = CommonArguments()
 parser.singleprofile()
 parser.singleregion()
 parser.verbosity()
+parser.concurrency()  # Allows for tuning how many accounts we look at, at the same time
 parser.my_parser.add_argument(
 	"+delete", "+forreal",
 	dest="DeletionRun",
@@ -25,9 +25,15 @@ args = parser.my_parser.parse_args()
 
 pProfile = args.Profile
 pRegion = args.Region
+pWorkers = args.Workers
+pCredentialWorkers = args.CredentialWorkers
+pTaskTimeout = args.TaskTimeout
+pEngine = args.Engine
 verbose = args.loglevel
 DeletionRun = args.DeletionRun
 logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)30s() ] %(message)s")
+Inventory_Modules.set_rate_limits(args.RateLimits)
+Inventory_Modules.set_client_config(args.RetryMode, args.MaxAttempts, args.ConnectTimeout, args.ReadTimeout, args.PoolSize)
 
 ##########################
 ERASE_LINE = '\x1b[2K'
@@ -40,41 +46,29 @@ print(fmt % ("Account", "pRegion", "IDP Name"))
 print(fmt % ("-------", "------", "--------"))
 ChildAccounts = aws_acct.ChildAccounts
 
-NumofAccounts = len(ChildAccounts)
 IdpsFound = []
-for account in ChildAccounts:
-	try:
-		account_credentials = Inventory_Modules.get_child_access3(aws_acct, account['AccountId'])
-		account_credentials['AccountNumber'] = account['AccountId']
-	except ClientError as my_Error:
-		if str(my_Error).find("AuthFailure") > 0:
-			print(f"{pProfile}: Authorization Failure for account {account['AccountId']}")
-		else:
-			print(f"{pProfile}: Other kind of failure for account {account['AccountId']}")
-			print(my_Error)
-		break
-	try:
-		Idps = Inventory_Modules.find_saml_components_in_acct2(account_credentials, pRegion)
-		idpNum = len(Idps)
-		logging.warning(f"Account: {account['AccountId']} | Region: {pRegion} | Found {idpNum} Idps")
-		logging.warning(f"{ERASE_LINE}{Fore.RED}Account: {account['AccountId']} pRegion: {pRegion} Found {idpNum} Idps. Only {NumofAccounts} accounts left to go{Fore.RESET}")
-	except ClientError as my_Error:
-		if str(my_Error).find("AuthFailure") > 0:
-			print(f"{account['AccountId']}: Authorization Failure")
-		idpNum = 0
-	if idpNum > 0:
-		for y in range(len(Idps)):
-			logging.warning(f"Arn: {Idps[y]['Arn']}")
-			NameStart = Idps[y]['Arn'].find('/')+1
-			logging.debug(f"Name starts at character: {NameStart}")
-			IdpName = Idps[y]['Arn'][NameStart:]
-			print(fmt % (account['AccountId'], pRegion, IdpName))
-			IdpsFound.append({
-				'AccountId': account['AccountId'],
-				'pRegion': pRegion,
-				'IdpName': IdpName,
-				'Arn': Idps[y]['Arn']})
-	NumofAccounts -= 1
+CredentialList = Inventory_Modules.get_credentials_for_accounts_in_org(aws_acct, fMaxWorkers=pCredentialWorkers)
+# IAM is global, so find_saml_components_in_acct2 only runs once in each account, whichever region we're asked about
+for result in Inventory_Modules.run_across_accounts_and_regions(CredentialList, [pRegion], Inventory_Modules.find_saml_components_in_acct2,
+																 pWorkers, pTaskTimeout, pEngine):
+	if not result['Success']:
+		if str(result['ErrorMessage']).find("AuthFailure") > 0:
+			print(f"{result['AccountId']}: Authorization Failure")
+		logging.warning(result['ErrorMessage'])
+		continue
+	Idps = result['Result']
+	logging.warning(f"Account: {result['AccountId']} | Region: {result['Region']} | Found {len(Idps)} Idps")
+	for y in range(len(Idps)):
+		logging.warning(f"Arn: {Idps[y]['Arn']}")
+		NameStart = Idps[y]['Arn'].find('/')+1
+		logging.debug(f"Name starts at character: {NameStart}")
+		IdpName = Idps[y]['Arn'][NameStart:]
+		print(fmt % (result['AccountId'], result['Region'], IdpName))
+		IdpsFound.append({
+			'AccountId': result['AccountId'],
+			'pRegion': result['Region'],
+			'IdpName': IdpName,
+			'Arn': Idps[y]['Arn']})
 
 print(ERASE_LINE)
 print(Fore.RED+f"Found {len(IdpsFound)} Idps across {len(ChildAccounts)} accounts in region {pRegion}"+Fore.RESET)
@@ -5,7 +5,6 @@ import logging
 from ArgumentsClass import CommonArguments
 from account_class import aws_acct_access
 from colorama import init, Fore
-from botocore.exceptions import ClientError
 
 init()
 
@@ -13,6 +12,7 @@ parser = CommonArguments()
 parser.verbosity()
 parser.singleprofile()
 parser.multiregion()
+parser.concurrency()
 parser.my_parser.add_argument(
 	"-f", "--topic", "--fragment",
 	dest="pTopicFrag",
@@ -24,9 +24,15 @@ args = parser.my_parser.parse_args()
 
 pProfile = args.Profile
 pRegionList = args.Regions
+pWorkers = args.Workers
+pCredentialWorkers = args.CredentialWorkers
+pTaskTimeout = args.TaskTimeout
+pEngine = args.Engine
 verbose = args.loglevel
 pTopicFrag = args.pTopicFrag
 logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)30s() ] %(message)s")
+Inventory_Modules.set_rate_limits(args.RateLimits)
+Inventory_Modules.set_client_config(args.RetryMode, args.MaxAttempts, args.ConnectTimeout, args.ReadTimeout, args.PoolSize)
 
 ##########################
 ERASE_LINE = '\x1b[2K'
@@ -45,38 +51,45 @@ ChildAccounts = aws_acct.ChildAccounts
 logging.info(f"# of Regions: {len(RegionList)}")
 logging.info(f"# of Child Accounts: {len(ChildAccounts)}")
 
-account_credentials = None
-for i in range(len(ChildAccounts)):
-	logging.info(f"Connecting to child account {ChildAccounts[i]['AccountId']} using account {aws_acct.acct_number}")
-	try:
-		account_credentials = Inventory_Modules.get_child_access3(aws_acct, ChildAccounts[i]['AccountId'], 'us-east-1')
-	except ClientError as my_Error:
-		if str(my_Error).find("AuthFailure") > 0:
-			print(f"{ChildAccounts[i]['MgmtAccount']}: Authorization Failure for account {ChildAccounts[i]['AccountId']}")
-			print(my_Error)
-		elif str(my_Error).find("AccessDenied") > 0:
-			print(f"{ChildAccounts[i]['MgmtAccount']}: Access Denied Failure for account {ChildAccounts[i]['AccountId']}")
-			print(my_Error)
-		else:
-			print(f"{ChildAccounts[i]['MgmtAccount']}: Other kind of failure for account {ChildAccounts[i]['AccountId']}")
-			print(my_Error)
-			break
 
-	regionNum = 0
-	for region in RegionList:
-		regionNum += 1
-		try:
-			logging.info(f"Looking for Topics in acct {ChildAccounts[i]['AccountId']} in region {region}")
-			Topics = Inventory_Modules.find_sns_topics2(account_credentials, region, pTopicFrag)
-			print(f"{ERASE_LINE}On account {i+1} of {len(ChildAccounts)} in region {regionNum} of {len(RegionList)}", end='\r')
-			logging.error(f"Found {len(Topics)} topics in account {Fore.RED}{ChildAccounts[i]['AccountId']}{Fore.RESET} in {region}")
-		except ClientError as my_Error:
-			if str(my_Error).find("AuthFailure") > 0:
-				print(f"{aws_acct.acct_number} :Authorization Failure for account: {ChildAccounts[i]['AccountId']} in region {region}")
-			continue
-		for y in range(len(Topics)):
-			print(fmt % (ChildAccounts[i]['AccountId'], region, Topics[y]))
-			NumTopicsFound += 1
+def select_topics(c_account_credentials, c_region, c_topics):
+	logging.info(f"Looking through Topics in acct {c_account_credentials['AccountId']} in region {c_region}")
+	return (Inventory_Modules.select_sns_topics([topic['TopicArn'] for topic in c_topics], pTopicFrag))
+
+
+# The same thing find_sns_topics2 does, but able to run on either engine
+find_topics = Inventory_Modules.PagedCollector('sns', 'list_topics', 'Topics', fPostProcess=select_topics)
+
+
+CredentialList = Inventory_Modules.get_credentials_for_accounts_in_org(aws_acct, fMaxWorkers=pCredentialWorkers)
+# Only the regions where SNS exists, and each account has opted into
+TopicRegions = Inventory_Modules.get_service_region_matrix(CredentialList, ['sns'], RegionList)['sns']
+PlacesToLook = sum([len(regions) for regions in TopicRegions.values()])
+PlaceCount = 0
+if pEngine == 'asyncio':
+	Results = Inventory_Modules.run_across_accounts_and_regions(CredentialList, TopicRegions, find_topics, pWorkers, pTaskTimeout, pEngine)
+else:
+	# Each topic is printed as soon as its page arrives, rather than once its whole account and region is done
+	Results = Inventory_Modules.stream_across_accounts_and_regions(CredentialList, TopicRegions, find_topics, pWorkers)
+for result in Results:
+	if result.get('Finished') is False:
+		print(f"{ERASE_LINE}{fmt % (result['AccountId'], result['Region'], result['Result'])}")
+		NumTopicsFound += 1
+		continue
+	PlaceCount += 1
+	print(f"{ERASE_LINE}Finished {PlaceCount} of {PlacesToLook} accounts and regions", end='\r')
+	if not result['Success']:
+		print(f"{aws_acct.acct_number} :Failure for account: {result['AccountId']} in region {result['Region']}")
+		logging.warning(result['ErrorMessage'])
+		continue
+	if 'Finished' in result.keys():
+		logging.error(f"Found {result['Count']} topics in account {Fore.RED}{result['AccountId']}{Fore.RESET} in {result['Region']}")
+		continue
+	Topics = result['Result']
+	logging.error(f"Found {len(Topics)} topics in account {Fore.RED}{result['AccountId']}{Fore.RESET} in {result['Region']}")
+	for y in range(len(Topics)):
+		print(fmt % (result['AccountId'], result['Region'], Topics[y]))
+		NumTopicsFound += 1
 
 print(ERASE_LINE)
 print(f"Found {NumTopicsFound} Topics across {len(ChildAccounts)} accounts across {len(RegionList)} regions")
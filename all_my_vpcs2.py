@@ -7,7 +7,6 @@ from ArgumentsClass import CommonArguments
 from time import time
 from account_class import aws_acct_access
 from colorama import init, Fore
-from botocore.exceptions import ClientError
 
 import logging
 
@@ -17,6 +16,7 @@ parser = CommonArguments()
 parser.multiprofile()
 parser.multiregion()
 parser.extendedargs()
+parser.concurrency()
 parser.verbosity()
 parser.my_parser.add_argument(
 	"--default",
@@ -31,9 +31,16 @@ args = parser.my_parser.parse_args()
 pProfiles = args.Profiles
 pRegionList = args.Regions
 pTiming = args.Time
+pSkipAccounts = args.SkipAccounts
+pCredentialWorkers = args.CredentialWorkers
+pWorkers = args.Workers
+pTaskTimeout = args.TaskTimeout
+pEngine = args.Engine
 pDefault = args.pDefault
 verbose = args.loglevel
 logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)30s() ] %(message)s")
+Inventory_Modules.set_rate_limits(args.RateLimits)
+Inventory_Modules.set_client_config(args.RetryMode, args.MaxAttempts, args.ConnectTimeout, args.ReadTimeout, args.PoolSize)
 
 ##########################
 ERASE_LINE = '\x1b[2K'
@@ -77,79 +84,58 @@ else:
 # 	ProfileList = [pProfiles]
 
 aws_acct_list = []
+CredentialList = []
 if pProfiles is None:
 	aws_acct = aws_acct_access()
 	AllChildAccounts.extend(aws_acct.ChildAccounts)
+	CredentialList.extend(Inventory_Modules.get_credentials_for_accounts_in_org(aws_acct, pSkipAccounts, fMaxWorkers=pCredentialWorkers))
 	if aws_acct.AccountType.lower() == 'root':
 		NumOfRootProfiles += 1
 else:
 	for profile in pProfiles:
-		aws_acct = aws_acct_access()
+		aws_acct = aws_acct_access(profile)
 		AllChildAccounts.extend(aws_acct.ChildAccounts)
 		print(ERASE_LINE, f"Gathering all account data from account # {aws_acct.acct_number}", end="\r")
+		CredentialList.extend(Inventory_Modules.get_credentials_for_accounts_in_org(aws_acct, pSkipAccounts, fMaxWorkers=pCredentialWorkers))
 		if aws_acct.AccountType.lower() == 'root':
 			NumOfRootProfiles += 1
 
 NumOfTotalAccounts = len(AllChildAccounts)
-AccountCounter = 0
 logging.info(f"# of Regions: {len(pRegionList)}")
 logging.info(f"# of Management Accounts: {NumOfRootProfiles}")
 logging.info(f"# of Child Accounts: {NumOfTotalAccounts}")
 
+for account_credentials in CredentialList:
+	if not account_credentials['Success']:
+		print(f"Accessing account {account_credentials['AccountId']} with {account_credentials['MgmtAccount']} failed...")
+
 print(f"Found {NumOfTotalAccounts} accounts to look through:")
 print()
-for i in range(len(AllChildAccounts)):
-	# aws_acct = aws_acct_access(AllChildAccounts[i]['ParentProfile'])
-	# sts_client = aws_acct.session.client('sts')
-	# logging.info(f"Connecting to account {aws_acct.acct_number} using Parent Profile %s:", AllChildAccounts[i]['AccountId'], AllChildAccounts[i]['ParentProfile'])
-	AccountCounter += 1
-	print(f"{Fore.BLUE}{AccountCounter} of {NumOfTotalAccounts} looked at... {Fore.RESET}", end='')
-	try:
-		account_credentials = Inventory_Modules.get_child_access3(aws_acct, AllChildAccounts[i]['AccountId'])
-		if account_credentials['AccessError']:
-			print(f"Accessing account {AllChildAccounts[i]['AccountId']} with {aws_acct.acct_number} failed...")
-		aws_acct_child = aws_acct_access(ocredentials=account_credentials)
-	except ClientError as my_error:
-		if str(my_error).find("AuthFailure") > 0:
-			print(f"Authorization Failure for account {AllChildAccounts[i]['AccountId']}")
-		elif str(my_error).find("AccessDenied") > 0:
-			print(f"Access Denied Failure for account {AllChildAccounts[i]['AccountId']}")
-			print(my_error)
-		else:
-			print(f"Other kind of failure for account {AllChildAccounts[i]['AccountId']}")
-			print(my_error)
-			break
-
-	# NumRegions += 1
-	# NumProfilesInvestigated = 0	# I only care about the last run - so I don't get profiles * regions.
-	for region in pRegionList:
-		# NumProfilesInvestigated += 1
-		Vpcs = dict()
-		try:
-			Vpcs = Inventory_Modules.find_account_vpcs3(aws_acct_child, region, pDefault)
-			VpcNum = len(Vpcs['Vpcs']) if Vpcs['Vpcs'] == [] else 0
-			print(f"{ERASE_LINE} Looking in account {Fore.RED}{AllChildAccounts[i]['AccountId']}{Fore.RESET} in {region} where we found {VpcNum} {vpctype} Vpcs", end='\r')
-		except ClientError as my_error:
-			if str(my_error).find("AuthFailure") > 0:
-				logging.critical(ERASE_LINE, f"Authorization Failure for account: {AllChildAccounts[i]['AccountId']} in region {region}")
-		except TypeError as my_error:
-			logging.error(my_error)
-			continue
-		if 'Vpcs' in Vpcs.keys() and len(Vpcs['Vpcs']) > 0:
-			for y in range(len(Vpcs['Vpcs'])):
-				VpcId = Vpcs['Vpcs'][y]['VpcId']
-				IsDefault = Vpcs['Vpcs'][y]['IsDefault']
-				CIDR = Vpcs['Vpcs'][y]['CidrBlock']
-				if 'Tags' in Vpcs['Vpcs'][y]:
-					for z in range(len(Vpcs['Vpcs'][y]['Tags'])):
-						if Vpcs['Vpcs'][y]['Tags'][z]['Key'] == "Name":
-							VpcName = Vpcs['Vpcs'][y]['Tags'][z]['Value']
-				else:
-					VpcName = "No name defined"
-				print(fmt % (Vpcs['Vpcs'][y]['OwnerId'], region, VpcId, CIDR, IsDefault, VpcName))
-				NumVpcsFound += 1
-		else:
-			continue
+
+
+def find_vpcs(c_account_credentials, c_region):
+	return (Inventory_Modules.find_account_vpcs2(c_account_credentials, c_region, pDefault))
+
+
+# Only the regions each account has opted into
+VpcRegions = Inventory_Modules.get_service_region_matrix(CredentialList, ['ec2'], pRegionList)['ec2']
+for result in Inventory_Modules.run_across_accounts_and_regions(CredentialList, VpcRegions, find_vpcs, pWorkers, pTaskTimeout, pEngine):
+	if not result['Success']:
+		logging.critical(f"{ERASE_LINE}Failure for account: {result['AccountId']} in region {result['Region']}")
+		logging.error(result['ErrorMessage'])
+		continue
+	Vpcs = result['Result']
+	print(f"{ERASE_LINE} Looking in account {Fore.RED}{result['AccountId']}{Fore.RESET} in {result['Region']} where we found {len(Vpcs['Vpcs'])} {vpctype} Vpcs", end='\r')
+	for vpc in Vpcs['Vpcs']:
+		VpcId = vpc['VpcId']
+		IsDefault = vpc['IsDefault']
+		CIDR = vpc['CidrBlock']
+		VpcName = "No name defined"
+		for tag in vpc.get('Tags', []):
+			if tag['Key'] == "Name":
+				VpcName = tag['Value']
+		print(fmt % (vpc['OwnerId'], result['Region'], VpcId, CIDR, IsDefault, VpcName))
+		NumVpcsFound += 1
 
 if pTiming:
 	print(ERASE_LINE)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import Inventory_Modules
+from ArgumentsClass import CommonArguments
+from multiprocessing import get_context
+from colorama import init, Fore
+from time import time
+
+import logging
+
+init()
+
+parser = CommonArguments()
+parser.verbosity()  # Allows for the verbosity to be handled.
+parser.my_parser.add_argument(
+		"--accounts",
+		dest="Accounts",
+		type=int,
+		default=100,
+		help="The number of (pretend) accounts to build clients for")
+parser.my_parser.add_argument(
+		"--services",
+		dest="Services",
+		nargs="*",
+		default=['ec2', 'logs', 'cloudtrail', 'lambda', 'cloudformation'],
+		help="The services to build clients for in each account")
+args = parser.my_parser.parse_args()
+
+pAccounts = args.Accounts
+pServices = args.Services
+verbose = args.loglevel
+
+logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s")
+
+"""
+This script doesn't talk to AWS at all - it builds clients with made-up credentials, which never leave the machine.
+Each approach runs in its own process, so the peak memory (RSS) it reports belongs to that approach alone.
+"""
+
+
+def fake_credentials(fAccountNumber):
+	return ({'AccessKeyId'    : f"ASIA{fAccountNumber:016d}",
+			 'SecretAccessKey': 'NotARealSecretKey',
+			 'SessionToken'   : 'NotARealSessionToken',
+			 'AccountNumber'  : f"{fAccountNumber:012d}",
+			 'Profile'        : None})
+
+
+def build_clients_with_new_sessions(fAccounts, fServices):
+	"""
+	This is what the find_*2 functions used to do - a brand new boto3 Session for every client.
+	"""
+	import boto3
+
+	for account_number in range(fAccounts):
+		ocredentials = fake_credentials(account_number)
+		for service in fServices:
+			session_aws = boto3.Session(aws_access_key_id=ocredentials['AccessKeyId'],
+										aws_secret_access_key=ocredentials['SecretAccessKey'],
+										aws_session_token=ocredentials['SessionToken'],
+										region_name='us-east-1')
+			session_aws.client(service)
+
+
+def build_clients_with_shared_session(fAccounts, fServices):
+	"""
+	This is what the find_*2 functions do now - every client comes from the one shared session.
+	"""
+	for account_number in range(fAccounts):
+		ocredentials = fake_credentials(account_number)
+		for service in fServices:
+			Inventory_Modules.get_aws_client(ocredentials, service, 'us-east-1')
+
+
+def run_benchmark(fApproach, fAccounts, fServices, fResultQueue):
+	import resource
+
+	begin_time = time()
+	fApproach(fAccounts, fServices)
+	# ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+	fResultQueue.put({'Duration': time() - begin_time,
+					  'MaxRSS'  : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+
+
+##########################
+if __name__ == '__main__':
+	# "spawn" makes sure each approach starts with a clean interpreter, rather than inheriting our loaded models
+	mp_context = get_context('spawn')
+	ClientCount = pAccounts * len(pServices)
+	print()
+	print(f"Building {ClientCount} clients ({pAccounts} accounts x {len(pServices)} services) each way...")
+	print()
+	for approach in [build_clients_with_new_sessions, build_clients_with_shared_session]:
+		result_queue = mp_context.Queue()
+		benchmark_process = mp_context.Process(target=run_benchmark, args=(approach, pAccounts, pServices, result_queue))
+		benchmark_process.start()
+		result = result_queue.get()
+		benchmark_process.join()
+		logging.info(f"Finished {approach.__name__}: {result}")
+		print(f"{approach.__name__:35s}: "
+			  f"{Fore.GREEN}{result['Duration']:8.2f}{Fore.RESET} seconds | "
+			  f"{Fore.GREEN}{result['Duration'] / ClientCount * 1000:8.2f}{Fore.RESET} ms per client | "
+			  f"peak RSS {Fore.GREEN}{result['MaxRSS'] / 1024:8.1f}{Fore.RESET} MB")
+	print()
+	print("Thank you for using this script")
+	print()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import Inventory_Modules
+from ArgumentsClass import CommonArguments
+from multiprocessing import get_context
+from colorama import init, Fore
+from time import time
+
+import logging
+
+init()
+
+parser = CommonArguments()
+parser.verbosity()  # Allows for the verbosity to be handled.
+parser.concurrency()
+parser.my_parser.add_argument(
+		"--accounts",
+		dest="Accounts",
+		type=int,
+		default=1000,
+		help="The number of (pretend) accounts in the (pretend) Org")
+parser.my_parser.add_argument(
+		"--regions",
+		dest="Regions",
+		type=int,
+		default=17,
+		help="The number of (pretend) regions to look in, in each account")
+parser.my_parser.add_argument(
+		"--latency",
+		dest="Latency",
+		type=float,
+		default=0.05,
+		help="How long (in seconds) each pretend API call takes, on average")
+args = parser.my_parser.parse_args()
+
+pAccounts = args.Accounts
+pRegions = args.Regions
+pLatency = args.Latency
+# Both engines get the same concurrency, so it's the engines being compared, and not how many things each does at once
+pWorkers = args.Workers if args.Workers is not None else Inventory_Modules.SWEEP_WORKERS
+pTaskTimeout = args.TaskTimeout
+verbose = args.loglevel
+
+logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s")
+
+"""
+This script doesn't talk to AWS at all - the Org, its accounts and the API calls are all made up, and each call just
+waits for a while (somewhere around the latency given) before handing back an empty answer.
+Each engine runs in its own process, so the peak memory (RSS) it reports belongs to that engine alone.
+"""
+
+
+class StubCollector:
+	"""
+	Stands in for a PagedCollector - the threaded engine calls it, and the asyncio engine awaits collect_async.
+	"""
+
+	Service = 'stub'
+
+	def __init__(self, fLatency):
+		self.Latency = fLatency
+		self.__name__ = 'StubCollector'
+
+	def __call__(self, ocredentials, fRegion):
+		import random
+		from time import sleep
+
+		sleep(self.Latency * random.uniform(0.5, 1.5))
+		return ([])
+
+	async def collect_async(self, fGetClient, ocredentials, fRegion):
+		import asyncio
+		import random
+
+		await asyncio.sleep(self.Latency * random.uniform(0.5, 1.5))
+		return ([])
+
+
+def fake_credentials(fAccountNumber):
+	return ({'AccessKeyId'    : f"ASIA{fAccountNumber:016d}",
+			 'SecretAccessKey': 'NotARealSecretKey',
+			 'SessionToken'   : 'NotARealSessionToken',
+			 'AccountNumber'  : f"{fAccountNumber:012d}",
+			 'AccountId'      : f"{fAccountNumber:012d}",
+			 'MgmtAccount'    : f"{0:012d}",
+			 'Success'        : True})
+
+
+def sweep_with_threads(fCredentialList, fRegionList, fCollector):
+	return (Inventory_Modules.run_across_accounts_and_regions(fCredentialList, fRegionList, fCollector, pWorkers, pTaskTimeout))
+
+
+def sweep_with_asyncio(fCredentialList, fRegionList, fCollector):
+	# Called directly, since the engine switch in run_across_accounts_and_regions would want aiobotocore installed,
+	# and the stub collector never asks for a client. The per-account limit is lifted, since the threads don't have one.
+	return (Inventory_Modules.run_across_accounts_and_regions_async(fCredentialList, fRegionList, fCollector, pWorkers, pTaskTimeout,
+																	fPerService=pWorkers, fPerAccount=pWorkers))
+
+
+def run_benchmark(fEngine, fAccounts, fRegions, fLatency, fResultQueue):
+	import resource
+
+	CredentialList = [fake_credentials(account_number) for account_number in range(fAccounts)]
+	RegionList = [f"xx-region-{region_number}" for region_number in range(fRegions)]
+	Failures = 0
+	begin_time = time()
+	for result in fEngine(CredentialList, RegionList, StubCollector(fLatency)):
+		if not result['Success']:
+			Failures += 1
+	# ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+	fResultQueue.put({'Duration': time() - begin_time,
+					  'Failures': Failures,
+					  'MaxRSS'  : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+
+
+##########################
+if __name__ == '__main__':
+	# "spawn" makes sure each engine starts with a clean interpreter
+	mp_context = get_context('spawn')
+	PlaceCount = pAccounts * pRegions
+	print()
+	print(f"Sweeping {PlaceCount} pretend places ({pAccounts} accounts x {pRegions} regions) each way, "
+		  f"{pWorkers} at a time, at around {pLatency} seconds per call...")
+	print()
+	for engine in [sweep_with_threads, sweep_with_asyncio]:
+		result_queue = mp_context.Queue()
+		benchmark_process = mp_context.Process(target=run_benchmark, args=(engine, pAccounts, pRegions, pLatency, result_queue))
+		benchmark_process.start()
+		result = result_queue.get()
+		benchmark_process.join()
+		logging.info(f"Finished {engine.__name__}: {result}")
+		print(f"{engine.__name__:20s}: "
+			  f"{Fore.GREEN}{result['Duration']:8.2f}{Fore.RESET} seconds | "
+			  f"{Fore.GREEN}{PlaceCount / result['Duration']:8.0f}{Fore.RESET} places per second | "
+			  f"{Fore.RED if result['Failures'] > 0 else Fore.GREEN}{result['Failures']}{Fore.RESET} failures | "
+			  f"peak RSS {Fore.GREEN}{result['MaxRSS'] / 1024:8.1f}{Fore.RESET} MB")
+	print()
+	print("Thank you for using this script")
+	print()
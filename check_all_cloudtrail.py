@@ -5,7 +5,6 @@ import Inventory_Modules
 from ArgumentsClass import CommonArguments
 from account_class import aws_acct_access
 from colorama import init, Fore
-from botocore.exceptions import ClientError
 from prettytable import PrettyTable
 
 import logging
@@ -17,6 +16,8 @@ parser.multiprofile()
 parser.multiregion()
 parser.extendedargs()
 parser.rootOnly()
+parser.concurrency()  # Allows for tuning how many accounts and regions we look at, at the same time
+parser.resume()  # Allows for picking up where an interrupted run left off
 parser.verbosity()
 args = parser.my_parser.parse_args()
 
@@ -24,8 +25,16 @@ pProfiles = args.Profiles
 pRegionList = args.Regions
 pSkipAccounts = args.SkipAccounts
 pRootOnly = args.RootOnly
+pWorkers = args.Workers
+pCredentialWorkers = args.CredentialWorkers
+pTaskTimeout = args.TaskTimeout
+pEngine = args.Engine
+pResume = args.Resume
+pJournal = args.Journal
 verbose = args.loglevel
 logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s")
+Inventory_Modules.set_rate_limits(args.RateLimits)
+Inventory_Modules.set_client_config(args.RetryMode, args.MaxAttempts, args.ConnectTimeout, args.ReadTimeout, args.PoolSize)
 
 ##################
 
@@ -40,74 +49,47 @@ def check_accounts_for_cloudtrail(faws_acct, fRegionList=None):
 	"""
 	Note that this function checks the account AND any children accounts in the Org.
 	"""
-	ChildAccounts = faws_acct.ChildAccounts
+	def find_trails(c_account_credentials, c_region):
+		Trails = Inventory_Modules.find_account_cloudtrail2(c_account_credentials, c_region)
+		logging.info(f"Root Account: {faws_acct.acct_number} Account: {c_account_credentials['AccountId']} Region: {c_region} | Found {len(Trails['trailList'])} trails")
+		for trail in Trails['trailList']:
+			trail['MgmtAccount'] = c_account_credentials['MgmtAccount']
+			trail['AccountId'] = c_account_credentials['AccountId']
+			trail['Region'] = c_region
+			trail['OrgTrail'] = "OrgTrail" if trail['IsOrganizationTrail'] else "Account Trail"
+			trail['KMS'] = trail.get('KmsKeyId')
+			trail['CloudWatchLogArn'] = trail.get('CloudWatchLogsLogGroupArn')
+			trail['HomeRegion'] = trail.get('HomeRegion')
+			trail['SNSTopicName'] = trail.get('SNSTopicName')
+		return (Trails['trailList'])
+
 	AllTrails = []
-	account_credentials = {'Role': 'Nothing'}
-	Trails = dict()
-	AccountNum = 0
 	if fRegionList is None:
 		fRegionList = ['us-east-1']
-	for account in ChildAccounts:
-		SkipAccounts = pSkipAccounts
-		if account['AccountId'] in SkipAccounts:
-			continue
-		elif pRootOnly and not account['AccountId'] == account['MgmtAccount']:
-			continue
-		logging.info(f"Connecting to account {account['AccountId']}")
-		AccountNum += 1
-		try:
-			account_credentials = Inventory_Modules.get_child_access3(faws_acct, account['AccountId'])
-			logging.info(f"Connected to account {account['AccountId']} using role {account_credentials['Role']}")
-		except ClientError as my_Error:
-			if str(my_Error).find("AuthFailure") > 0:
-				logging.error(f"{account['AccountId']}: Authorization failure using role: {account_credentials['Role']}")
-				logging.warning(my_Error)
-			elif str(my_Error).find("AccessDenied") > 0:
-				logging.error(f"{account['AccountId']}: Access Denied failure using role: {account_credentials['Role']}")
-				logging.warning(my_Error)
-			else:
-				logging.error(f"{account['AccountId']}: Other kind of failure using role: {account_credentials['Role']}")
-				logging.warning(my_Error)
-			continue
-		except KeyError as my_Error:
-			logging.error(f"Account Access failed - trying to access {account['AccountId']}")
-			logging.info(f"Actual Error: {my_Error}")
-			pass
-		except AttributeError as my_Error:
-			logging.error(f"Error: Likely that one of the supplied profiles {pProfiles} was wrong")
-			logging.warning(my_Error)
+	CredentialList = Inventory_Modules.get_credentials_for_accounts_in_org(faws_acct, pSkipAccounts, pRootOnly, fMaxWorkers=pCredentialWorkers)
+	# Only the regions where CloudTrail exists, and each account has opted into
+	TrailRegions = Inventory_Modules.get_service_region_matrix(CredentialList, ['cloudtrail'], fRegionList)['cloudtrail']
+	PlacesToLook = sum([len(regions) for regions in TrailRegions.values()])
+	PlaceCount = 0
+	# With --journal (or --resume), remembers each account and region as it's finished, so a later --resume can skip them if this run doesn't make it to the end
+	Journal = None
+	if pResume or pJournal:
+		Journal = Inventory_Modules.SweepJournal(f"check_all_cloudtrail-{faws_acct.acct_number}-{pRootOnly}", pResume)
+	for result in Inventory_Modules.run_across_accounts_and_regions(CredentialList, TrailRegions, find_trails, pWorkers, pTaskTimeout, pEngine,
+																	fJournal=Journal):
+		PlaceCount += 1
+		print(f"{ERASE_LINE}{PlaceCount} / {PlacesToLook}: Checked account {result['AccountId']} in region {result['Region']}", end='\r')
+		if not result['Success']:
+			logging.error(f"Couldn't look for trails in account {result['AccountId']} in {result['Region']} region")
+			logging.warning(result['ErrorMessage'])
 			continue
-		for region in fRegionList:
-			try:
-				print(f"{ERASE_LINE}{AccountNum} / {len(ChildAccounts)}: Checking account {account['AccountId']} in region {region}", end='\r')
-				Trails = Inventory_Modules.find_account_cloudtrail2(account_credentials, region)
-				logging.info(f"Root Account: {faws_acct.acct_number} Account: {account['AccountId']} Region: {region} | Found {len(Trails['trailList'])} trails")
-			except ClientError as my_Error:
-				if str(my_Error).find("AuthFailure") > 0:
-					logging.error(f"Authorization Failure accessing account {account['AccountId']} in {region} region")
-					logging.warning(f"It's possible that the region {region} hasn't been opted-into")
-					pass
-			if 'trailList' in Trails.keys():
-				for y in range(len(Trails['trailList'])):
-					Trails['trailList'][y]['MgmtAccount'] = account['MgmtAccount']
-					Trails['trailList'][y]['AccountId'] = account['AccountId']
-					Trails['trailList'][y]['Region'] = region
-					TrailName = Trails['trailList'][y]['Name']
-					MultiRegion = Trails['trailList'][y]['IsMultiRegionTrail']
-					Trails['trailList'][y]['OrgTrail'] = "OrgTrail" if Trails['trailList'][y]['IsOrganizationTrail'] else "Account Trail"
-					Bucket = Trails['trailList'][y]['S3BucketName']
-					KMS = Trails['trailList'][y]['KmsKeyId'] if 'KmsKeyId' in Trails.keys() else None
-					Trails['trailList'][y]['KMS'] = KMS
-					CloudWatchLogArn = Trails['trailList'][y]['CloudWatchLogsLogGroupArn'] if 'CloudWatchLogsLogGroupArn' in Trails.keys() else None
-					Trails['trailList'][y]['CloudWatchLogArn'] = CloudWatchLogArn
-					HomeRegion = Trails['trailList'][y]['HomeRegion'] if 'HomeRegion' in Trails.keys() else None
-					Trails['trailList'][y]['HomeRegion'] = HomeRegion
-					SNSTopicName = Trails['trailList'][y]['SNSTopicName'] if 'SNSTopicName' in Trails.keys() else None
-					Trails['trailList'][y]['SNSTopicName'] = SNSTopicName
-					# fmt = '%-12s %-12s %-10s %-15s %-20s %-20s %-12s'
-					# print(fmt % (faws_acct.acct_number, account['AccountId'], region, InstanceType, Name, Engine, State))
-					print(f"{faws_acct.acct_number:12s} {account['AccountId']:12s} {region:15s} {TrailName:40s} {Trails['trailList'][y]['OrgTrail']:15s} {Bucket:45s} ")
-			AllTrails.extend(Trails['trailList'])
+		for trail in result['Result']:
+			# fmt = '%-12s %-12s %-10s %-15s %-20s %-20s %-12s'
+			# print(fmt % (faws_acct.acct_number, account['AccountId'], region, InstanceType, Name, Engine, State))
+			print(f"{faws_acct.acct_number:12s} {trail['AccountId']:12s} {trail['Region']:15s} {trail['Name']:40s} {trail['OrgTrail']:15s} {trail['S3BucketName']:45s} ")
+		AllTrails.extend(result['Result'])
+	if Journal is not None:
+		Journal.close()
 	return (AllTrails)
 
 
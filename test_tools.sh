@@ -20,7 +20,8 @@ function exists_in_list() {
 scripts_to_not_test="Inventory_Modules.py recovery_stack_ids.py lock_down_stack_sets_role.py ArgumentsClass.py \
 account_class.py ALZ_CheckAccount.py CT_CheckAccount.py delete_bucket_objects.py enable_drift_detection.py \
 find_my_LZ_versions.py move_stack_instances.py RunOnMultiAccounts.py UpdateRoleToMemberAccounts.py vpc_modules.py \
-recover_stack_ids.py setup.py"
+recover_stack_ids.py setup.py benchmark_client_creation.py benchmark_sweep_engines.py \
+test_work_queue.py"
 
 declare -a arrScripts
 
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import Inventory_Modules
+from ArgumentsClass import CommonArguments
+from colorama import init, Fore
+from time import time
+
+import logging
+import os
+import sys
+import tempfile
+
+init()
+
+parser = CommonArguments()
+parser.verbosity()  # Allows for the verbosity to be handled.
+parser.concurrency()
+parser.my_parser.add_argument(
+		"--accounts",
+		dest="Accounts",
+		type=int,
+		default=50,
+		help="The number of (pretend) accounts in the (pretend) Org")
+parser.my_parser.add_argument(
+		"--regions",
+		dest="Regions",
+		type=int,
+		default=5,
+		help="The number of (pretend) regions to look in, in each account")
+parser.my_parser.add_argument(
+		"--latency",
+		dest="Latency",
+		type=float,
+		default=0.05,
+		help="How long (in seconds) each pretend API call takes, on average")
+parser.my_parser.add_argument(
+		"--queueworkers",
+		dest="QueueWorkers",
+		type=int,
+		default=4,
+		help="How many worker processes to start - one of them is made to die part-way through, so there need to be at least two")
+parser.my_parser.add_argument(
+		"--lease",
+		dest="Lease",
+		type=int,
+		default=3,
+		help="How many seconds a worker's lease on a task lasts, so how long it takes for the dead worker's tasks to be taken over")
+args = parser.my_parser.parse_args()
+
+pAccounts = args.Accounts
+pRegions = args.Regions
+pLatency = args.Latency
+pQueueWorkers = max(2, args.QueueWorkers)
+pWorkers = args.Workers if args.Workers is not None else 5
+pTaskTimeout = args.TaskTimeout
+verbose = args.loglevel
+
+logging.basicConfig(level=args.loglevel, format="[%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s")
+
+"""
+This script doesn't talk to AWS at all - the Org, its accounts and the API calls are all made up, and each call just
+waits for a while (somewhere around the latency given) before handing back where it looked.
+It puts the lot through a work queue (in a file of its own, which it removes afterwards) with several local workers.
+The first worker to pick up the first account's first region dies on the spot, as a runner box would if it were
+pulled out from under us - so its leases run out, and the other workers have to take its tasks over.
+"""
+
+# The leases are cut short, so the dead worker's tasks come back in seconds rather than minutes. The local workers are
+# forked, so they see these too.
+Inventory_Modules.WORK_QUEUE_LEASE = args.Lease
+Inventory_Modules.WORK_QUEUE_HEARTBEAT = max(1, args.Lease // 3)
+Inventory_Modules.WORK_QUEUE_POLL = 0.2
+
+
+class StubCollector:
+	"""
+	Stands in for a collector - it waits a while, and then says where it looked. The first time it's asked to look at
+	the doomed account and region, it takes its whole worker process down with it.
+	"""
+
+	def __init__(self, fLatency, fDoomedAccount, fDoomedRegion, fMarkerFile):
+		self.Latency = fLatency
+		self.DoomedPlace = (fDoomedAccount, fDoomedRegion)
+		self.MarkerFile = fMarkerFile
+		self.__name__ = 'StubCollector'
+
+	def __call__(self, ocredentials, fRegion):
+		import random
+		from time import sleep
+
+		if (ocredentials['AccountId'], fRegion) == self.DoomedPlace:
+			try:
+				# Only the first worker to get here dies - whoever takes the task over finds the file already there
+				os.close(os.open(self.MarkerFile, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+				os._exit(1)
+			except FileExistsError:
+				pass
+		sleep(self.Latency * random.uniform(0.5, 1.5))
+		return ([{'AccountId': ocredentials['AccountId'], 'Region': fRegion, 'Pid': os.getpid()}])
+
+
+def fake_credentials(fAccountNumber):
+	return ({'AccessKeyId'    : f"ASIA{fAccountNumber:016d}",
+			 'SecretAccessKey': 'NotARealSecretKey',
+			 'SessionToken'   : 'NotARealSessionToken',
+			 'AccountNumber'  : f"{fAccountNumber:012d}",
+			 'AccountId'      : f"{fAccountNumber:012d}",
+			 'MgmtAccount'    : f"{0:012d}",
+			 'Success'        : True})
+
+
+##########################
+if __name__ == '__main__':
+	CredentialList = [fake_credentials(account_number) for account_number in range(pAccounts)]
+	RegionList = [f"xx-region-{region_number}" for region_number in range(pRegions)]
+	PlaceCount = pAccounts * pRegions
+	TempDir = tempfile.mkdtemp(prefix='test_work_queue-')
+	work_queue = Inventory_Modules.WorkQueue(os.path.join(TempDir, 'queue.db'))
+	collector = StubCollector(pLatency, CredentialList[0]['AccountId'], RegionList[0], os.path.join(TempDir, 'died'))
+	print()
+	print(f"Sending {PlaceCount} pretend places ({pAccounts} accounts x {pRegions} regions) through the work queue, "
+		  f"to {pQueueWorkers} workers running {pWorkers} tasks each, with {args.Lease} second leases...")
+	print()
+	Problems = []
+	PlacesSeen = dict()
+	Workers = set()
+	begin_time = time()
+	try:
+		for result in Inventory_Modules.run_through_work_queue(CredentialList, RegionList, collector, work_queue, 'test_work_queue',
+															   fLocalWorkers=pQueueWorkers, fMaxWorkers=pWorkers, fTimeout=pTaskTimeout):
+			place = (result['AccountId'], result['Region'])
+			PlacesSeen[place] = PlacesSeen.get(place, 0) + 1
+			Workers.add(result['Worker'].rsplit(':', 1)[0])  # The worker process, rather than which of its threads
+			if not result['Success']:
+				Problems.append(f"Account {place[0]} in region {place[1]} failed: {result['ErrorMessage']}")
+			elif not result['Result'] == [{'AccountId': place[0], 'Region': place[1], 'Pid': result['Result'][0]['Pid']}]:
+				Problems.append(f"Account {place[0]} in region {place[1]} came back with someone else's result: {result['Result']}")
+	finally:
+		for file_name in os.listdir(TempDir):
+			os.remove(os.path.join(TempDir, file_name))
+		os.rmdir(TempDir)
+	duration = time() - begin_time
+	Problems.extend([f"Account {place[0]} in region {place[1]} came back {count} times"
+					 for place, count in PlacesSeen.items() if count > 1])
+	if len(PlacesSeen) < PlaceCount:
+		Problems.append(f"Only {len(PlacesSeen)} of the {PlaceCount} places came back")
+	if (CredentialList[0]['AccountId'], RegionList[0]) not in PlacesSeen:
+		Problems.append("The task the dead worker had wasn't taken over")
+	for problem in Problems:
+		print(f"{Fore.RED}{problem}{Fore.RESET}")
+	print(f"{len(PlacesSeen)} of {PlaceCount} places came back in {duration:.2f} seconds, from {len(Workers)} workers - "
+		  f"{Fore.RED + 'FAILED' if len(Problems) > 0 else Fore.GREEN + 'PASSED'}{Fore.RESET}")
+	print()
+	print("Thank you for using this script")
+	print()
+	sys.exit(1 if len(Problems) > 0 else 0)
@@ -93,6 +93,8 @@ def check_cw_groups_retention(faws_acct, fRegionList=None):
 					logging.warning(f"It's possible that the region {region} hasn't been opted-into")
 					pass
 			if 'logGroups' in CW_Groups.keys():
+				# Every log group in this account and region refers to the same credentials, rather than carrying its own copy
+				credential_handle = Inventory_Modules.register_credentials(account_credentials, region)
 				for y in range(len(CW_Groups['logGroups'])):
 					if 'retentionInDays' in CW_Groups['logGroups'][y].keys():
 						Retention = CW_Groups['logGroups'][y]['retentionInDays']
@@ -100,9 +102,7 @@ def check_cw_groups_retention(faws_acct, fRegionList=None):
 						Retention = "Never"
 					Name = CW_Groups['logGroups'][y]['logGroupName']
 					Size = CW_Groups['logGroups'][y]['storedBytes']
-					CW_Groups['logGroups'][y]['AccessKeyId'] = account_credentials['AccessKeyId']
-					CW_Groups['logGroups'][y]['SecretAccessKey'] = account_credentials['SecretAccessKey']
-					CW_Groups['logGroups'][y]['SessionToken'] = account_credentials['SessionToken']
+					CW_Groups['logGroups'][y]['CredentialHandle'] = credential_handle
 					CW_Groups['logGroups'][y]['AccountId'] = account_credentials['AccountId']
 					CW_Groups['logGroups'][y]['region'] = region
 					# fmt = f'%-12s %-{account_number_format} %-15s %-10s %15d %-50s'
@@ -115,17 +115,11 @@ def check_cw_groups_retention(faws_acct, fRegionList=None):
 
 
 def update_cw_groups_retention(fCWGroups=None, fOldRetentionDays=None, fRetentionDays=None):
-	import boto3
-
 	if fOldRetentionDays is None:
 		fOldRetentionDays = 0
 	Success = True
 	for item in fCWGroups:
-		cw_session = boto3.Session(aws_access_key_id=item['AccessKeyId'],
-								   aws_secret_access_key=item['SecretAccessKey'],
-								   aws_session_token=item['SessionToken'],
-								   region_name=item['region'])
-		cw_client = cw_session.client('logs')
+		cw_client = Inventory_Modules.get_client_for_handle(item['CredentialHandle'], 'logs')
 		logging.info(f"Connecting to account {item['AccountId']}")
 		try:
 			print(f"{ERASE_LINE}Updating log group {item['logGroupName']} account {item['AccountId']} in region {item['region']}", end='\r')